@@ -0,0 +1,33 @@
+from .suite import run_benchmarks, save_results, compare_results
+import argparse
+import yaml
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Offline benchmarks over the cached reports"
+    )
+    parser.add_argument("--config", default="./file_cfg.yml")
+    parser.add_argument("--output", default="./benchmarks/results/latest.json")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--baseline", help="results file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        cfg = yaml.safe_load(f)
+    results = run_benchmarks(cfg, args.repeats, args.workers)
+    save_results(results, args.output)
+    for name, timings in results["benchmarks"].items():
+        print(f"{name:<50} {timings['min']:10.4f} s")
+
+    if args.baseline is not None:
+        comparison = compare_results(args.baseline, results, args.tolerance)
+        print(comparison.to_string())
+        if comparison["regression"].any():
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+from data import DatasetManager, StageProfiler
+from models import CompartmentalOptimizer, FitBudget
+from models.compartment import fit_many
+from models.compartment.reproduction import HillDecay, GridReproduction
+from models.selection import model_per_country_simple_split
+from models.validation import get_validation_results
+from visualization.basic import plot_country_dynamic, plot_cases_map
+from visualization.advanced import CustomOverviewGraph
+from visualization.geometry import GeometryCache
+from .upstream import build_upstream
+from datetime import datetime
+import copy
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import scipy
+import plotly
+
+
+def _timings(function, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _summary(timings):
+    return {
+        "repeats": len(timings),
+        "min": float(np.min(timings)),
+        "mean": float(np.mean(timings)),
+        "max": float(np.max(timings)),
+    }
+
+
+def _environment():
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL
+        )
+        commit = commit.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "scipy": scipy.__version__,
+        "plotly": plotly.__version__,
+        "commit": commit,
+    }
+
+
+def _offline_config(cfg, root):
+    """
+    Configuration with every report folder inside the root, reload on
+    and upstream responses replayed from the archive in root/upstream.
+    """
+    cfg = copy.deepcopy(cfg)
+    cfg["root"] = root
+    cfg["reload"] = True
+    cfg["transport"] = {"mode": "replay", "archive": f"{root}/upstream"}
+    for source in ["csse", "google", "oxford", "rospotreb"]:
+        cfg[source]["root"] = root
+    return cfg
+
+
+def pipeline_benchmarks(cfg, repeats=3):
+    """
+    Stage timings of full DatasetManager refreshes replaying the recorded
+    stand-ins of the upstream sources (see benchmarks.upstream).
+    """
+    with tempfile.TemporaryDirectory() as root:
+        build_upstream(cfg, f"{root}/upstream")
+        profiler = StageProfiler()
+        manager = DatasetManager(_offline_config(cfg, root), profiler)
+        for _ in range(repeats):
+            manager.get_data()
+    report = profiler.report()
+    # repeated stages (merges) are summed within a run
+    report = report.groupby(["stage", "run"], sort=False)["seconds"].sum()
+    return {
+        f"pipeline/{stage}": _summary(timings.values)
+        for stage, timings in report.groupby(level="stage", sort=False)
+    }
+
+
+def model_benchmarks(world_data, populations, repeats=3, workers=1):
+    """
+    Timings of the splits, a single fit and fits of several countries.
+    Fits are bounded by the number of objective evaluations,
+    so every run does the same amount of work.
+    """
+    frame = world_data.set_index("country_code")
+    results = {}
+    results["split"] = _summary(
+        _timings(
+            lambda: list(
+                model_per_country_simple_split(frame, ["cases", "deaths", "date"])
+            ),
+            repeats,
+        )
+    )
+
+    splits = dict(model_per_country_simple_split(frame, ["cases", "deaths"]))
+    largest = frame.groupby(level=0)["cases"].max().sort_values()[-8:].index
+    single = splits[largest[-1]]
+    optimizer = CompartmentalOptimizer(optim_days=14)
+    budget = FitBudget(max_evaluations=200)
+    results["fit_single"] = _summary(
+        _timings(
+            lambda: optimizer.fit(
+                single["cases"],
+                single["deaths"],
+                populations[largest[-1]],
+                budget=budget,
+            ),
+            repeats,
+        )
+    )
+
+    daily_optimizer = CompartmentalOptimizer(optim_days=14, engine="daily")
+    countries = [(code, splits[code]) for code in largest]
+    results["fit_many"] = _summary(
+        _timings(
+            lambda: fit_many(
+                daily_optimizer, countries, populations, workers=workers, budget=budget
+            ),
+            repeats,
+        )
+    )
+
+    # R_t lookups with the numpy times solve_ivp passes to the model
+    hill = HillDecay()(3.0, (2.0, 20.0))
+    grid = GridReproduction(hill(np.arange(100.0)))
+    times = list(np.linspace(0, 99, 100000))
+    for name, reproduction in [("hill", hill), ("grid", grid)]:
+        results[f"reproduction_{name}"] = _summary(
+            _timings(lambda: [reproduction(t) for t in times], repeats)
+        )
+    return results
+
+
+def validation_benchmarks(rus_data, regions, n_submissions=20, repeats=3):
+    """
+    Timings of scoring synthetic submissions against the regions data.
+    """
+    random = np.random.RandomState(0)
+    truth = rus_data.reset_index(drop=True)
+    submissions = []
+    for _ in range(n_submissions):
+        submission = truth[["date", "region"]].copy()
+        noise = random.lognormal(0, 0.3, len(truth))
+        submission["prediction_confirmed"] = truth["confirmed"].values * noise
+        submissions.append(submission)
+    start, end = truth["date"].min(), truth["date"].max()
+    return {
+        "validation": _summary(
+            _timings(
+                lambda: get_validation_results(submissions, truth, start, end, regions),
+                repeats,
+            )
+        )
+    }
+
+
+def figure_benchmarks(world_data, rus_data, regions, geodata, repeats=3):
+    """
+    Timings of figure construction (without rendering).
+    """
+    overview = CustomOverviewGraph(regions, geodata)
+    dates = sorted(rus_data["date"].unique())[-10:]
+    figures = {
+        "figure/country_dynamic": lambda: plot_country_dynamic(
+            world_data, key="cases", group="country_code", clip=20
+        ),
+        "figure/cases_map": lambda: plot_cases_map(
+            rus_data.copy(), geodata, mtype="choropleth_mapbox", center=(61.5, 105)
+        ),
+        "figure/overview": lambda: overview.plot(rus_data, "confirmed", dates),
+    }
+    return {
+        name: _summary(_timings(function, repeats))
+        for name, function in figures.items()
+    }
+
+
+def run_benchmarks(cfg, repeats=3, workers=1):
+    """
+    Runs the whole offline benchmark suite over the cached reports.
+    Returns a dictionary with the environment and the timings
+    (min, mean and max seconds) by benchmark name.
+    """
+    manager = DatasetManager(dict(cfg, reload=False))
+    data = manager.get_data()
+    world_data = data["world"]["by_date"]
+    rus_data = data["russia"]["by_date"]
+    populations = data["world"]["by_country"].set_index("country_code")["population"]
+    regions = data["russia"]["by_region"].set_index("iso_code")
+    geodata = GeometryCache(cfg["auxiliary"]["geojson"])
+
+    benchmarks = {}
+    benchmarks.update(pipeline_benchmarks(cfg, repeats))
+    benchmarks.update(model_benchmarks(world_data, populations, repeats, workers))
+    benchmarks.update(validation_benchmarks(rus_data, regions, repeats=repeats))
+    benchmarks.update(
+        figure_benchmarks(world_data, rus_data, regions, geodata, repeats)
+    )
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "environment": _environment(),
+        "benchmarks": benchmarks,
+    }
+
+
+def save_results(results, filename):
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(filename, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def compare_results(baseline, current, tolerance=0.2, statistic="min"):
+    """
+    Compares two benchmark results (dictionaries or json filenames).
+    A benchmark is a regression when its time grew by more than
+    the tolerance fraction.
+    Returns a dataframe indexed by benchmark names.
+    """
+    if isinstance(baseline, str):
+        baseline = load_results(baseline)
+    if isinstance(current, str):
+        current = load_results(current)
+    names = [x for x in current["benchmarks"] if x in baseline["benchmarks"]]
+    comparison = pd.DataFrame(
+        {
+            "baseline": [baseline["benchmarks"][x][statistic] for x in names],
+            "current": [current["benchmarks"][x][statistic] for x in names],
+        },
+        index=pd.Index(names, name="benchmark"),
+    )
+    comparison["ratio"] = comparison["current"] / comparison["baseline"]
+    comparison["regression"] = comparison["ratio"] > 1 + tolerance
+    return comparison
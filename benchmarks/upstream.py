@@ -0,0 +1,134 @@
+from data.csv_parsers.oxford_parser import OXFORD_COLUMNS
+from data.transport import Transport
+import pandas as pd
+
+NEWS_LINK_TEXT = (
+    " О подтвержденных случаях новой коронавирусной инфекции COVID-2019 в России"
+)
+
+MOBILITY_COLUMNS = [
+    "retail_and_recreation_percent_change_from_baseline",
+    "grocery_and_pharmacy_percent_change_from_baseline",
+    "parks_percent_change_from_baseline",
+    "transit_stations_percent_change_from_baseline",
+    "workplaces_percent_change_from_baseline",
+    "residential_percent_change_from_baseline",
+]
+
+
+def _csse_dates(dates):
+    dates = pd.to_datetime(dates)
+    return [f"{x.month}/{x.day}/{x.strftime('%y')}" for x in dates]
+
+
+def _csse_series(world, countries, key):
+    series = world.pivot(index="country_code", columns="date", values=key)
+    series.columns = _csse_dates(series.columns)
+    series.insert(0, "Long", 0.0)
+    series.insert(0, "Lat", 0.0)
+    series.insert(0, "Country/Region", countries.loc[series.index, "ccse_name"])
+    series.insert(0, "Province/State", None)
+    # upstream lists some overseas territories as separate province rows
+    territory = series.iloc[:1].copy()
+    territory.iloc[:, 4:] = 0
+    territory["Province/State"] = "Territory"
+    return pd.concat([series, territory]).reset_index(drop=True)
+
+
+def _oxford_report(world):
+    lower_columns = [col.replace(" ", "_").lower() for col in OXFORD_COLUMNS[2:]]
+    report = world[["country_code", "date"] + lower_columns].copy()
+    report.columns = OXFORD_COLUMNS
+    report["Date"] = report["Date"].str.replace("-", "")
+    return report
+
+
+def _google_report(world, countries):
+    report = world[["country_code", "date"] + MOBILITY_COLUMNS].dropna()
+    codes = countries.loc[report["country_code"]]
+    report.insert(0, "sub_region_2", None)
+    report.insert(0, "sub_region_1", None)
+    report.insert(0, "country_region", codes["name"].values)
+    report.insert(0, "country_region_code", codes["iso_alpha2"].values)
+    return report.drop(columns="country_code")
+
+
+def _russian_series(russia, regions):
+    series = russia.pivot(index="region", columns="date", values="confirmed")
+    series.columns = _csse_dates(series.columns)
+    metadata = [
+        "UID",
+        "iso2",
+        "iso3",
+        "code3",
+        "FIPS",
+        "Admin2",
+        "Province_State",
+        "Country_Region",
+        "Lat",
+        "Long_",
+        "Combined_Key",
+    ]
+    for position, column in enumerate(metadata):
+        series.insert(position, column, None)
+    series["Province_State"] = regions.loc[series.index, "csse_province_state"]
+    series["Country_Region"] = "Russia"
+    return series.reset_index(drop=True)
+
+
+def _russian_update(last_day, regions, date):
+    items = "".join(
+        f"<li>{number}. {regions.loc[code, 'name']} - {int(value)}</li>"
+        for number, (code, value) in enumerate(last_day.items(), 1)
+    )
+    day = pd.Timestamp(date).strftime("%d.%m.%Y")
+    return (
+        f'<html><body><div class="news-detail"><p class="date">{day} г.</p>'
+        f"<ul>{items}</ul></div></body></html>"
+    )
+
+
+def build_upstream(cfg, archive):
+    """
+    Records stand-ins of the upstream responses into a transport archive
+    for the replay mode, reconstructed from the cached reports (report_files)
+    in their original formats: CSSE, Oxford and Google csv files,
+    the Russian regions timeseries without its last day
+    and the Rospotrebnadzor pages with the last day update.
+    Returns the archive transport.
+    """
+    world = pd.read_csv(f"{cfg['root']}/world_confirmed_cases.csv")
+    russia = pd.read_csv(f"{cfg['root']}/rus_confirmed_cases.csv")
+    countries = pd.read_csv(cfg["auxiliary"]["countries"]).set_index("iso_alpha3")
+    regions = pd.read_csv(cfg["auxiliary"]["regions"]).set_index("iso_code")
+    russia = russia[russia["region"].isin(regions.index)]
+    transport = Transport("replay", archive)
+
+    def save(url, data):
+        if isinstance(data, pd.DataFrame):
+            data = data.to_csv(index=False).encode()
+        transport.save(url, data)
+
+    for key in ["confirmed", "deaths", "recovered"]:
+        column = "cases" if key == "confirmed" else key
+        save(cfg["csse"][f"global_{key}"], _csse_series(world, countries, column))
+    save(cfg["oxford"]["main_page_url"], _oxford_report(world))
+    save(cfg["google"]["main_page_url"], _google_report(world, countries))
+
+    last_date = russia["date"].max()
+    history = russia[russia["date"] < last_date]
+    last_day = russia[russia["date"] == last_date].set_index("region")["confirmed"]
+    previous_day = history[history["date"] == history["date"].max()]
+    last_day = last_day - previous_day.set_index("region")["confirmed"]
+    rospotreb = cfg["rospotreb"]
+    save(rospotreb["timeseries_page"], _russian_series(history, regions))
+    news = f'<html><body><a href="news/update.html">{NEWS_LINK_TEXT}</a></body></html>'
+    save(
+        rospotreb["rospotreb_page"] + "about/info/news/",
+        news.encode("Windows-1251"),
+    )
+    save(
+        rospotreb["rospotreb_page"] + "news/update.html",
+        _russian_update(last_day, regions, last_date).encode("Windows-1251"),
+    )
+    return transport
@@ -5,3 +5,7 @@ from .dataset import (
     GoogleParser,
     RussianRegionsParser,
 )
+from .profiling import StageProfiler
+from .features import FeatureStore
+from .quality import DataQuality
+from .transport import Transport
@@ -1,27 +1,44 @@
+from ..profiling import NullProfiler
+from ..transport import Transport
 import os
+import numpy as np
 import pandas as pd
-import requests
 
 
 class ReportDownloader:
-    def __init__(self, file_cfg):
+    def __init__(self, file_cfg, transport=None):
         self.rewrite = file_cfg["rewrite"]
         self.root = file_cfg["root"]
+        self.transport = Transport() if transport is None else transport
+        self.profiler = NullProfiler()
 
-    def download_report(self, url, to_filename):
-        main_page = requests.get(url)
-        if main_page.status_code != 200:
-            raise ValueError(f"Wrong response code for {self.main_page_url}")
-        data = main_page.content.decode()
-        filename = f"{self.root}/{to_filename}"
-        if not os.path.exists(filename) or self.rewrite:
-            with open(filename, "w") as f:
-                f.write(data)
+    def download_report(self, url, to_filename, **read_args):
+        """
+        Downloads the csv report to the root folder and parses it,
+        read_args are passed to pd.read_csv (usecols, dtype, ...).
+        """
+        with self.profiler.stage(f"download {to_filename}") as stage:
+            main_page = self.transport.get(url)
+            if main_page.status_code != 200:
+                raise ValueError(f"Wrong response code for {url}")
+            stage["bytes"] = len(main_page.content)
+            data = main_page.content.decode()
+            filename = f"{self.root}/{to_filename}"
+            if not os.path.exists(filename) or self.rewrite:
+                with open(filename, "w", encoding="utf-8") as f:
+                    f.write(data)
 
-        dataframe = pd.read_csv(filename)
+        with self.profiler.stage(f"parse {to_filename}") as stage:
+            dataframe = pd.read_csv(filename, **read_args)
+            stage["rows_out"] = len(dataframe)
         return dataframe
 
 
 def fix_date(df, date_format=None):
-    df["date"] = pd.to_datetime(df.date, format=date_format).dt.strftime("%Y-%m-%d")
+    # every date is repeated for each country, convert the unique values only
+    codes, dates = pd.factorize(df["date"])
+    dates = pd.to_datetime(dates, format=date_format).strftime("%Y-%m-%d")
+    dates = np.asarray(dates, dtype=object)[codes]
+    dates[codes < 0] = np.nan
+    df["date"] = dates
     return df
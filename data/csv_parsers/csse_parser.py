@@ -1,35 +1,118 @@
+import numpy as np
 import pandas as pd
-from .base import ReportDownloader, fix_date
+from ..transport import get_transport
+from .base import ReportDownloader
+
+US_COUNTY_COLUMNS = {
+    "UID": "uid",
+    "FIPS": "fips",
+    "Admin2": "county",
+    "Province_State": "state",
+}
+
+
+def _date_columns(frame):
+    """
+    Date columns ("%m/%d/%y") of a wide CSSE report
+    and their "%Y-%m-%d" dates, parsed once per column.
+    """
+    columns = [column for column in frame.columns if column.count("/") == 2]
+    dates = pd.to_datetime(columns, format="%m/%d/%y").strftime("%Y-%m-%d")
+    return columns, np.asarray(dates)
+
+
+def _wide_to_long(ids, dates, series):
+    """
+    Long report from (rows, dates) arrays, the rows are repeated for every
+    date in the row-major order of the arrays.
+        ids = column name: values per row
+        series = column name: (rows, dates) array
+    """
+    n_rows, n_dates = len(next(iter(series.values()))), len(dates)
+    report = {name: np.repeat(values, n_dates) for name, values in ids.items()}
+    report["date"] = np.tile(dates, n_rows)
+    for name, values in series.items():
+        report[name] = values.ravel()
+    return pd.DataFrame(report)
 
 
 class CSSEParser:
+    """
+    CSSE timeseries reports: global confirmed, deaths and recovered
+    by country (load_data) and the US confirmed and deaths
+    by county (load_counties).
+    """
+
     def __init__(self, cfg):
         self.cfg = cfg["csse"]
-        self.downloader = ReportDownloader(self.cfg)
+        self.downloader = ReportDownloader(self.cfg, get_transport(cfg))
         self.data = [
-            (self.cfg["global_confirmed"], "world_timeseries_confirmed.csv"),
-            (self.cfg["global_deaths"], "world_timeseries_deaths.csv"),
+            ("cases", self.cfg["global_confirmed"], "world_timeseries_confirmed.csv"),
+            ("deaths", self.cfg["global_deaths"], "world_timeseries_deaths.csv"),
         ]
+        if "global_recovered" in self.cfg:
+            self.data.append(
+                (
+                    "recovered",
+                    self.cfg["global_recovered"],
+                    "world_timeseries_recovered.csv",
+                )
+            )
 
-    def _compose(self, frames):
-        frames = [frame.groupby("Country/Region").sum() for frame in frames]
-        frames = [
-            pd.melt(
-                frame.drop(["Lat", "Long"], 1).reset_index(),
-                id_vars=["Country/Region"],
-                var_name="date",
-                value_name="val",
-            ).set_index(["Country/Region", "date"])
-            for frame in frames
-        ]
-        frames = pd.concat(frames, axis=1).reset_index()
-        return frames
+    def _by_country(self, frame):
+        """
+        Province rows summed by country, a (countries, dates) dataframe.
+        """
+        columns, dates = _date_columns(frame)
+        countries, codes = np.unique(
+            frame["Country/Region"].values.astype(str), return_inverse=True
+        )
+        order = np.argsort(codes, kind="mergesort")
+        starts = np.flatnonzero(np.diff(codes[order], prepend=-1))
+        values = np.nan_to_num(frame[columns].values.astype(float))
+        sums = np.add.reduceat(values[order], starts, axis=0)
+        return pd.DataFrame(sums, index=countries, columns=dates)
+
+    def _compose(self, frames, names):
+        frames = [self._by_country(frame) for frame in frames]
+        countries, dates = frames[0].index, frames[0].columns
+        for frame in frames[1:]:
+            countries, dates = countries.union(frame.index), dates.union(frame.columns)
+        frames = [frame.reindex(index=countries, columns=dates) for frame in frames]
+        return _wide_to_long(
+            {"country_code": countries.values},
+            dates.values,
+            {name: frame.values for name, frame in zip(names, frames)},
+        )
 
     def load_data(self):
         frames = [
-            self.downloader.download_report(page, fname) for page, fname in self.data
+            self.downloader.download_report(page, fname) for _, page, fname in self.data
         ]
-        frames = self._compose(frames)
-        frames.columns = ["country_code", "date", "cases", "deaths"]
-        csv_data = fix_date(frames, "%m/%d/%y").sort_values(by=["country_code", "date"])
-        return csv_data
+        return self._compose(frames, [name for name, _, _ in self.data])
+
+    def load_counties(self):
+        """
+        US confirmed cases and deaths by county with the county population,
+        a row per (uid, date).
+        """
+        confirmed = self.downloader.download_report(
+            self.cfg["us_confirmed"], "us_timeseries_confirmed.csv"
+        )
+        deaths = self.downloader.download_report(
+            self.cfg["us_deaths"], "us_timeseries_deaths.csv"
+        )
+        columns, dates = _date_columns(confirmed)
+        deaths = deaths.set_index("UID").reindex(confirmed["UID"])
+        ids = {
+            name: confirmed[column].values for column, name in US_COUNTY_COLUMNS.items()
+        }
+        ids["population"] = deaths["Population"].values
+        return _wide_to_long(
+            ids,
+            dates,
+            {
+                "cases": confirmed[columns].values.astype(float),
+                "deaths": deaths[columns].values.astype(float),
+            },
+        )
@@ -1,10 +1,11 @@
+from ..transport import get_transport
 from .base import ReportDownloader
 
 
 class GoogleParser:
     def __init__(self, cfg):
         self.cfg = cfg["google"]
-        self.downloader = ReportDownloader(self.cfg)
+        self.downloader = ReportDownloader(self.cfg, get_transport(cfg))
 
     def _filter_columns(self, df):
         df.columns = ["country_code"] + list(df.columns[1:])
@@ -1,49 +1,112 @@
+import pandas as pd
+from ..transport import get_transport
 from .base import ReportDownloader, fix_date
 
+OXFORD_COLUMNS = [
+    "CountryCode",
+    "Date",
+    "C1_School closing",
+    "C2_Workplace closing",
+    "C3_Cancel public events",
+    "C4_Restrictions on gatherings",
+    "C6_Stay at home requirements",
+    "C7_Restrictions on internal movement",
+    "C8_International travel controls",
+    "E1_Income support",
+    "E2_Debt/contract relief",
+    "E3_Fiscal measures",
+    "E4_International support",
+    "H1_Public information campaigns",
+    "H2_Testing policy",
+    "H3_Contact tracing",
+    "H4_Emergency investment in healthcare",
+    "H5_Investment in vaccines",
+    "StringencyIndexForDisplay",
+]
+
+# sub-national rows of the report have a region code
+OXFORD_REGION_COLUMNS = {"RegionName": "region_name", "RegionCode": "region_code"}
+
+# monetary indicators, the rest are small ordinal levels
+OXFORD_AMOUNTS = [
+    "E3_Fiscal measures",
+    "E4_International support",
+    "H4_Emergency investment in healthcare",
+    "H5_Investment in vaccines",
+    "StringencyIndexForDisplay",
+]
+
+
+def _oxford_dtypes():
+    """
+    Compact dtypes of the read columns. Ordinal levels are float32
+    rather than integers since they have gaps until the forward fill.
+    """
+    dtypes = {"CountryCode": str, "Date": str, "RegionName": str, "RegionCode": str}
+    for column in OXFORD_COLUMNS[2:]:
+        dtypes[column] = "float64" if column in OXFORD_AMOUNTS else "float32"
+    return dtypes
+
 
 class OxfordParser:
+    """
+    OxCGRT government response indicators by country (load_data)
+    and by sub-national region where the report has them (load_regions).
+    Only the indicator columns are read, gaps are forward filled
+    within each country or region.
+    The report is downloaded and parsed once by load_data,
+    load_regions splits the same report.
+    """
+
     def __init__(self, cfg):
         self.cfg = cfg["oxford"]
-        self.downloader = ReportDownloader(self.cfg)
-
-    def _filter_columns(self, df):
-        columns = [
-            "CountryCode",
-            "Date",
-            "C1_School closing",
-            "C2_Workplace closing",
-            "C3_Cancel public events",
-            "C4_Restrictions on gatherings",
-            "C6_Stay at home requirements",
-            "C7_Restrictions on internal movement",
-            "C8_International travel controls",
-            "E1_Income support",
-            "E2_Debt/contract relief",
-            "E3_Fiscal measures",
-            "E4_International support",
-            "H1_Public information campaigns",
-            "H2_Testing policy",
-            "H3_Contact tracing",
-            "H4_Emergency investment in healthcare",
-            "H5_Investment in vaccines",
-            "StringencyIndexForDisplay",
-        ]
-
-        df = df[columns]
-        df.columns = ["country_code", "date"] + [
-            col.replace(" ", "_").lower() for col in df.columns[2:]
-        ]
+        self.downloader = ReportDownloader(self.cfg, get_transport(cfg))
+        self.report = None
+
+    def _download(self):
+        columns = set(OXFORD_COLUMNS) | set(OXFORD_REGION_COLUMNS)
+        report = self.downloader.download_report(
+            self.cfg["main_page_url"],
+            "oxford_report.csv",
+            usecols=lambda column: column in columns,
+            dtype=_oxford_dtypes(),
+        )
+        if "RegionCode" not in report:
+            for column in OXFORD_REGION_COLUMNS:
+                report[column] = None
+        return report
+
+    def _filter_columns(self, df, regional=False):
+        regions = list(OXFORD_REGION_COLUMNS) if regional else []
+        df = df[OXFORD_COLUMNS[:2] + regions + OXFORD_COLUMNS[2:]]
+        df.columns = (
+            ["country_code", "date"]
+            + [OXFORD_REGION_COLUMNS[col] for col in regions]
+            + [col.replace(" ", "_").lower() for col in OXFORD_COLUMNS[2:]]
+        )
         return df
 
-    def _process_dataframe(self, df):
-        df = self._filter_columns(df)
+    def _process_dataframe(self, df, regional=False):
+        df = self._filter_columns(df.reset_index(drop=True), regional)
         df = fix_date(df, "%Y%m%d")
-        df = df.fillna(method="ffill")
-        return df
+        group = "region_code" if regional else "country_code"
+        indicators = list(df.columns[-(len(OXFORD_COLUMNS) - 2) :])
+        # one grouped pass, values never leak into the next country or region
+        filled = df.groupby(group, sort=False)[indicators].ffill()
+        return pd.concat([df.drop(columns=indicators), filled], axis=1)
 
     def load_data(self):
-        raw_data = self.downloader.download_report(
-            self.cfg["main_page_url"], "oxford_report.csv"
-        )
-        processed_data = self._process_dataframe(raw_data)
-        return processed_data
+        self.report = self._download()
+        national = self.report["RegionCode"].isna()
+        return self._process_dataframe(self.report[national])
+
+    def load_regions(self):
+        """
+        Indicators of the sub-national rows
+        (empty for the reports without them)
+        of the report of the last load_data call.
+        """
+        if self.report is None:
+            self.report = self._download()
+        regional = self.report["RegionCode"].notna()
+        return self._process_dataframe(self.report[regional], True)
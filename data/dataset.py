@@ -1,5 +1,6 @@
 from .csv_parsers import OxfordParser, CSSEParser, GoogleParser
 from .rospotrebnadzor import RussianRegionsParser
+from .profiling import NullProfiler
 import pandas as pd
 import os
 
@@ -47,18 +48,28 @@ class Convention:
 
 
 class DateLevelStatCollector:
-    def __init__(self, cfg):
+    def __init__(self, cfg, profiler=None):
         self.convention = Convention(cfg["auxiliary"])
         csse_parser = CSSEParser(cfg)
         oxford_parser = OxfordParser(cfg)
         google_parser = GoogleParser(cfg)
         self.parsers = [csse_parser, oxford_parser, google_parser]
+        self.profiler = NullProfiler() if profiler is None else profiler
+        for parser in self.parsers:
+            parser.downloader.profiler = self.profiler
+
+    def _load_report(self, parser):
+        name = type(parser).__name__
+        with self.profiler.stage(f"load {name}") as stage:
+            report = parser.load_data()
+            stage["rows_out"] = len(report)
+        with self.profiler.stage(f"convention {name}", len(report)) as stage:
+            report = self.convention.fix_report(report, "country_code")
+            stage["rows_out"] = len(report)
+        return report
 
     def collect_dataframe(self):
-        reports = [parser.load_data() for parser in self.parsers]
-        reports = [
-            self.convention.fix_report(report, "country_code") for report in reports
-        ]
+        reports = [self._load_report(parser) for parser in self.parsers]
 
         joint_report = None
         for report_index in range(len(reports) - 1):
@@ -67,13 +78,16 @@ class DateLevelStatCollector:
             )
             right_report = reports[report_index + 1]
 
-            joint_report = pd.merge(
-                left_report,
-                right_report,
-                how="left",
-                left_on=["date", "country_code"],
-                right_on=["date", "country_code"],
-            )
+            rows_in = len(left_report) + len(right_report)
+            with self.profiler.stage("merge", rows_in) as stage:
+                joint_report = pd.merge(
+                    left_report,
+                    right_report,
+                    how="left",
+                    left_on=["date", "country_code"],
+                    right_on=["date", "country_code"],
+                )
+                stage["rows_out"] = len(joint_report)
 
         return joint_report
 
@@ -89,31 +103,50 @@ class SummaryStatCollector:
 
 
 class RegionLevelStatCollector:
-    def __init__(self, cfg):
+    def __init__(self, cfg, profiler=None):
         self.rosparser = RussianRegionsParser(cfg)
+        self.profiler = NullProfiler() if profiler is None else profiler
+        self.rosparser.downloader.profiler = self.profiler
 
     def collect_dataframe(self):
-        report = self.rosparser.load_data()
+        with self.profiler.stage("load RussianRegionsParser") as stage:
+            report = self.rosparser.load_data()
+            stage["rows_out"] = len(report)
         return report.reset_index()
 
 
 class DatasetManager:
-    def __init__(self, cfg):
+    """
+    Collects, caches and returns all datasets.
+    With a StageProfiler every get_data() call is profiled by stages
+    (downloads, csv parsing, convention fixing, merges, cache reads and writes),
+    see profiler.report() and profiler.aggregate().
+    """
+
+    def __init__(self, cfg, profiler=None):
         self.root = cfg["root"]
         self.reload = cfg["reload"]
+        self.profiler = NullProfiler() if profiler is None else profiler
         self.summary = SummaryStatCollector(cfg)
-        self.date_parser = DateLevelStatCollector(cfg)
-        self.region_parser = RegionLevelStatCollector(cfg)
+        self.date_parser = DateLevelStatCollector(cfg, self.profiler)
+        self.region_parser = RegionLevelStatCollector(cfg, self.profiler)
 
     def _load(self, filename, parser, **args):
+        name = os.path.basename(filename)
         if os.path.exists(filename) and self.reload is False:
-            dataframe = pd.read_csv(filename)
+            with self.profiler.stage(f"read {name}") as stage:
+                dataframe = pd.read_csv(filename)
+                stage["rows_out"] = len(dataframe)
         else:
-            dataframe = parser.collect_dataframe(**args)
-            dataframe.to_csv(filename, index=False)
+            with self.profiler.stage(f"collect {name}") as stage:
+                dataframe = parser.collect_dataframe(**args)
+                stage["rows_out"] = len(dataframe)
+            with self.profiler.stage(f"write {name}", len(dataframe)):
+                dataframe.to_csv(filename, index=False)
         return dataframe
 
     def get_data(self):
+        self.profiler.next_run()
         wold_countries = self._load(
             f"{self.root}/world_countries.csv", self.summary, key="countries"
         )
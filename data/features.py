@@ -0,0 +1,204 @@
+from .profiling import NullProfiler
+import os
+import numpy as np
+import pandas as pd
+
+# source name: (group column, cumulative columns)
+FEATURE_SOURCES = {
+    "world": ("country_code", ["cases", "deaths"]),
+    "russia": ("region", ["confirmed"]),
+}
+
+
+def _positions(groups):
+    """
+    Position of every row within its group (rows sorted by group).
+    """
+    index = np.arange(len(groups))
+    starts = np.ones(len(groups), dtype=bool)
+    starts[1:] = groups[1:] != groups[:-1]
+    return index - np.maximum.accumulate(np.where(starts, index, 0))
+
+
+def _calendar(groups, dates):
+    """
+    Daily calendar of every group (rows sorted by group and date):
+    the calendar row of every data row and the position of every
+    calendar row within its group, missing dates get empty rows.
+    """
+    days = pd.to_datetime(dates).values.astype("datetime64[D]").astype(np.int64)
+    starts = _positions(groups) == 0
+    codes = np.cumsum(starts) - 1
+    offsets = days - days[starts][codes]
+    lengths = np.zeros(starts.sum(), dtype=np.int64)
+    np.maximum.at(lengths, codes, offsets + 1)
+    first_rows = np.cumsum(lengths) - lengths
+    positions = np.arange(lengths.sum()) - np.repeat(first_rows, lengths)
+    return first_rows[codes] + offsets, positions
+
+
+def _shift(values, positions, periods):
+    shifted = np.full(len(values), np.nan)
+    shifted[periods:] = values[:-periods]
+    shifted[positions < periods] = np.nan
+    return shifted
+
+
+def _rolling_mean(values, positions, window):
+    """
+    Mean of the valid values of the last window rows of the group.
+    """
+    valid = ~np.isnan(values)
+    sums = np.concatenate([[0], np.cumsum(np.where(valid, values, 0))])
+    counts = np.concatenate([[0], np.cumsum(valid)])
+    index = np.arange(len(values))
+    lower = np.maximum(index + 1 - window, index - positions)
+    total = sums[index + 1] - sums[lower]
+    count = counts[index + 1] - counts[lower]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, total / count, np.nan)
+
+
+def derive_features(data, group, keys, populations, windows=(7, 14)):
+    """
+    Derived metrics of cumulative series, for every key:
+        key_new = daily new values
+        key_per_100k, key_new_per_100k = values per 100 000 people
+        key_new_avg{window} = rolling means of the daily new values
+        key_growth = daily growth rate of the cumulative values over a week
+        key_doubling_days = doubling time of the cumulative values
+    The data has a row per (group, date), populations map groups to people.
+    Missing dates are empty days: the windows and lags count calendar days,
+    not rows, and the day after a gap has no new value.
+    Returns a frame sorted by group and date.
+    """
+    data = data[[group, "date"] + keys].sort_values([group, "date"], kind="mergesort")
+    data = data.reset_index(drop=True)
+    rows, positions = _calendar(data[group].values, data["date"].values)
+    per_100k = 1e5 / data[group].map(populations).values.astype(float)
+
+    def reindexed(values):
+        full = np.full(len(positions), np.nan)
+        full[rows] = values
+        return full
+
+    for key in keys:
+        values = reindexed(data[key].values.astype(float))
+        new = values - _shift(values, positions, 1)
+        data[f"{key}_new"] = new[rows]
+        data[f"{key}_per_100k"] = values[rows] * per_100k
+        data[f"{key}_new_per_100k"] = new[rows] * per_100k
+        for window in windows:
+            average = _rolling_mean(new, positions, window)
+            data[f"{key}_new_avg{window}"] = average[rows]
+        week_ago = _shift(values, positions, 7)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            growth = np.log(values / week_ago) / 7
+            growth[~((values > 0) & (week_ago > 0))] = np.nan
+        data[f"{key}_growth"] = growth[rows]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            data[f"{key}_doubling_days"] = np.where(
+                growth > 0, np.log(2) / growth, np.nan
+            )[rows]
+    return data
+
+
+class FeatureStore:
+    """
+    Derived metrics (see derive_features) of the DatasetManager timeseries,
+    materialized as csv files in the data root next to the reports.
+    When only new dates arrive, the metrics are computed for the tail
+    (with enough history for the windows) and appended to the files.
+    Any change of the already stored values recomputes the whole source.
+    Loaded metrics are kept in memory for the following updates.
+    """
+
+    def __init__(self, cfg, windows=(7, 14), profiler=None):
+        self.root = cfg["root"]
+        self.windows = windows
+        self.profiler = NullProfiler() if profiler is None else profiler
+        # days of history the metrics of a date depend on
+        self.lookback = max(max(windows), 7)
+        self.frames = {}
+
+    def _filename(self, name):
+        return f"{self.root}/{name}_features.csv"
+
+    def _populations(self, name, data):
+        if name == "world":
+            summary = data["world"]["by_country"].set_index("country_code")
+        else:
+            summary = data["russia"]["by_region"].set_index("iso_code")
+        return summary["population"]
+
+    def _stored(self, name, base):
+        """
+        Stored features if they were computed from the same values
+        for the dates they cover, else None.
+        """
+        stored = self.frames.get(name)
+        if stored is None:
+            filename = self._filename(name)
+            if not os.path.exists(filename):
+                return None
+            stored = pd.read_csv(filename)
+            group = base.columns[0]
+            stored = stored.sort_values([group, "date"], kind="mergesort")
+            stored = stored.reset_index(drop=True)
+        known = base[base["date"] <= stored["date"].max()].reset_index(drop=True)
+        labels = list(base.columns[:2])
+        if len(known) != len(stored) or not known[labels].equals(stored[labels]):
+            return None
+        # the csv round trip can change the last digit of the floats,
+        # a relative tolerance of 1e-9 still sees a change by one case
+        keys = list(base.columns[2:])
+        if not np.allclose(
+            known[keys].values.astype(float),
+            stored[keys].values.astype(float),
+            rtol=1e-9,
+            atol=0,
+            equal_nan=True,
+        ):
+            return None
+        return stored
+
+    def _materialize(self, name, data):
+        group, keys = FEATURE_SOURCES[name]
+        frame = data[name]["by_date"]
+        populations = self._populations(name, data)
+        base = frame[[group, "date"] + keys].sort_values(
+            [group, "date"], kind="mergesort"
+        )
+        base = base.reset_index(drop=True)
+
+        stored = self._stored(name, base)
+        if stored is None:
+            with self.profiler.stage(f"features {name}", len(base)) as stage:
+                features = derive_features(base, group, keys, populations, self.windows)
+                features.to_csv(self._filename(name), index=False)
+                stage["rows_out"] = len(features)
+            return features
+
+        last_date = stored["date"].max()
+        if base["date"].max() == last_date:
+            return stored
+        first_new = base.loc[base["date"] > last_date, "date"].min()
+        start = pd.Timestamp(first_new) - pd.Timedelta(days=self.lookback)
+        history = base[base["date"] >= start.strftime("%Y-%m-%d")]
+        with self.profiler.stage(f"features {name} tail", len(history)) as stage:
+            tail = derive_features(history, group, keys, populations, self.windows)
+            tail = tail[tail["date"] > last_date]
+            tail.to_csv(self._filename(name), mode="a", header=False, index=False)
+            stage["rows_out"] = len(tail)
+        features = pd.concat([stored, tail], ignore_index=True)
+        features = features.sort_values([group, "date"], kind="mergesort")
+        return features.reset_index(drop=True)
+
+    def update(self, data):
+        """
+        Brings the stored metrics up to date with DatasetManager.get_data()
+        output, returns {"world": frame, "russia": frame}.
+        """
+        for name in FEATURE_SOURCES:
+            self.frames[name] = self._materialize(name, data)
+        return dict(self.frames)
@@ -0,0 +1,107 @@
+from contextlib import contextmanager
+import time
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def _peak_memory():
+    """
+    Peak resident memory of the process in bytes (None where unavailable).
+    """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class StageProfiler:
+    """
+    Collects a record per pipeline stage: wall time, bytes downloaded,
+    rows in and out and the peak memory delta (how much the stage raised
+    the peak resident memory of the process).
+    Records of every get_data() call share a run number,
+    nested stages are listed in the order they were started.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.run = 0
+
+    def next_run(self):
+        self.run += 1
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        Times the block, the yielded record can be updated
+        with "rows_out" and "bytes" inside it.
+        """
+        record = {
+            "run": self.run,
+            "stage": name,
+            "seconds": None,
+            "bytes": None,
+            "rows_in": rows_in,
+            "rows_out": None,
+            "peak_memory_delta": None,
+        }
+        self.records.append(record)
+        memory = _peak_memory()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            if memory is not None:
+                record["peak_memory_delta"] = _peak_memory() - memory
+
+    def report(self):
+        """
+        Returns a dataframe with a row per stage record.
+        """
+        report = pd.DataFrame(
+            self.records,
+            columns=[
+                "run",
+                "stage",
+                "seconds",
+                "bytes",
+                "rows_in",
+                "rows_out",
+                "peak_memory_delta",
+            ],
+        )
+        numeric = ["seconds", "bytes", "rows_in", "rows_out", "peak_memory_delta"]
+        report[numeric] = report[numeric].astype(float)
+        return report
+
+    def aggregate(self):
+        """
+        Statistics of the stages over all runs.
+        """
+        report = self.report()
+        return report.groupby("stage", sort=False).agg(
+            runs=("run", "count"),
+            mean_seconds=("seconds", "mean"),
+            max_seconds=("seconds", "max"),
+            total_seconds=("seconds", "sum"),
+            mean_bytes=("bytes", "mean"),
+            mean_rows_out=("rows_out", "mean"),
+            max_peak_memory_delta=("peak_memory_delta", "max"),
+        )
+
+
+class NullProfiler:
+    """
+    Profiler stand-in used when profiling is disabled.
+    """
+
+    def next_run(self):
+        pass
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        yield {}
@@ -0,0 +1,227 @@
+from .features import FEATURE_SOURCES, _positions, _shift, _rolling_mean
+import numpy as np
+import pandas as pd
+
+
+def _streaks(flags, positions):
+    """
+    Number of consecutive true flags of the group ending at every row.
+    """
+    index = np.arange(len(flags))
+    breaks = np.where(positions == 0, index - 1, -1)
+    return index - np.maximum.accumulate(np.where(flags, breaks, index))
+
+
+class DataQuality:
+    """
+    Finds and repairs problems of cumulative series, all series at once:
+        decreases = values below the previous day (downward corrections)
+        jumps = daily increments above jump_factor times the mean
+            increment of the previous window days (and above min_jump),
+            usually a reporting backlog
+        stale = runs of at least stale_days days repeating a value
+            of a series growing by at least min_rate per day before the run,
+            followed by a catch-up increase (no reports in between),
+            runs made by the decreases repair are not stale
+    Repairs (None leaves the values as they are):
+        decreases = negative values are raised to 0 and
+            "hold" keeps the previous maximum,
+            "cap" lowers the earlier values to the corrected one,
+            "auto" caps or holds every decrease, whichever changes
+            fewer values (a short spike is capped, a correction is held)
+        jumps = "spread" moves the excess of the jump over the baseline
+            to the preceding window days
+        stale = "interpolate" replaces the run by a line to the next value
+    """
+
+    def __init__(
+        self,
+        window=7,
+        jump_factor=10,
+        min_jump=1000,
+        stale_days=3,
+        min_rate=1,
+        decreases="auto",
+        jumps="spread",
+        stale="interpolate",
+    ):
+        if decreases not in ("auto", "hold", "cap", None):
+            raise ValueError(f"Wrong decreases repair {decreases}")
+        if jumps not in ("spread", None):
+            raise ValueError(f"Wrong jumps repair {jumps}")
+        if stale not in ("interpolate", None):
+            raise ValueError(f"Wrong stale repair {stale}")
+        self.window = window
+        self.jump_factor = jump_factor
+        self.min_jump = min_jump
+        self.stale_days = stale_days
+        self.min_rate = min_rate
+        self.decreases = decreases
+        self.jumps = jumps
+        self.stale = stale
+
+    def _find_decreases(self, values, positions):
+        drops = _shift(values, positions, 1) - values
+        with np.errstate(invalid="ignore"):
+            return drops > 0, drops
+
+    def _baseline(self, values, positions):
+        """
+        Daily increments and the mean increment of the previous window days.
+        """
+        increments = values - _shift(values, positions, 1)
+        mean = _rolling_mean(increments, positions, self.window)
+        return increments, _shift(mean, positions, 1)
+
+    def _find_jumps(self, values, positions):
+        increments, baseline = self._baseline(values, positions)
+        with np.errstate(invalid="ignore"):
+            jumps = (increments > self.jump_factor * baseline) & (
+                increments > self.min_jump
+            )
+        return jumps, increments - baseline
+
+    def _find_stale(self, values, positions):
+        increments, baseline = self._baseline(values, positions)
+        with np.errstate(invalid="ignore"):
+            same = increments == 0
+        # a run shares the id of the last fresh row before it
+        runs = np.cumsum(~same)
+        lengths = np.bincount(runs, weights=same)
+        previous = _shift(same.astype(float), positions, 1) == 1
+        rates = np.zeros(len(lengths))
+        starts = same & ~previous
+        rates[runs[starts]] = baseline[starts]
+        caught_up = np.zeros(len(lengths), dtype=bool)
+        with np.errstate(invalid="ignore"):
+            ends = ~same & previous & (increments > 0)
+        caught_up[runs[ends] - 1] = True
+        with np.errstate(invalid="ignore"):
+            return (
+                same
+                & (lengths[runs] >= self.stale_days)
+                & (rates[runs] >= self.min_rate)
+                & caught_up[runs]
+            )
+
+    def _repair_decreases(self, values, codes, positions, decreases):
+        values = np.maximum(values, 0)
+        held = pd.Series(values).groupby(codes).cummax().values
+        if self.decreases == "hold":
+            return held
+        reverse = pd.Series(values[::-1]).groupby(codes[::-1]).cummin()
+        capped = reverse.values[::-1]
+        if self.decreases == "cap":
+            return capped
+        # values the cap would lower ending before every decrease
+        # and values the hold would raise starting at it
+        with np.errstate(invalid="ignore"):
+            lowered = _streaks(values > capped, positions)
+            raised = _streaks((values < held)[::-1], _positions(codes[::-1]))[::-1]
+        ends = np.flatnonzero(decreases)
+        lengths = lowered[ends - 1]
+        cap = lengths < raised[ends]
+        ends, lengths = ends[cap], lengths[cap]
+        steps = np.arange(lengths.sum()) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths
+        )
+        rows = np.repeat(ends - lengths, lengths) + steps
+        values[rows] = capped[rows]
+        return pd.Series(values).groupby(codes).cummax().values
+
+    def _spread_jumps(self, values, positions, jumps, excess):
+        """
+        Raises the days before every jump linearly (up to window - 1 days),
+        so the excess is added gradually instead of in one day.
+        """
+        ends = np.flatnonzero(jumps)
+        lengths = np.minimum(positions[ends], self.window - 1)
+        steps = np.arange(lengths.sum()) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths
+        )
+        rows = np.repeat(ends - lengths, lengths) + steps
+        share = (steps + 1) / np.repeat(lengths + 1, lengths)
+        adjusted = values.copy()
+        np.add.at(adjusted, rows, np.repeat(excess[ends], lengths) * share)
+        return adjusted
+
+    def _interpolate_stale(self, values, positions, stale):
+        index = np.arange(len(values))
+        last = np.append(positions[1:] == 0, True)
+        # trailing runs have no next value and stay flat
+        fresh = ~stale | (positions == 0) | last
+        interpolated = np.interp(index, index[fresh], values[fresh])
+        replace = stale & ~np.isnan(interpolated)
+        adjusted = values.copy()
+        adjusted[replace] = interpolated[replace]
+        return adjusted
+
+    def _repair_series(self, values, codes, positions):
+        original = values
+        decreases, drops = self._find_decreases(values, positions)
+        if self.decreases is not None:
+            values = self._repair_decreases(values, codes, positions, decreases)
+        jumps, excess = self._find_jumps(values, positions)
+        if self.jumps is not None and jumps.any():
+            values = self._spread_jumps(values, positions, jumps, excess)
+        # runs flattened by the decreases repair are not stale reports
+        with np.errstate(invalid="ignore"):
+            stale = self._find_stale(values, positions) & (values == original)
+        if self.stale is not None:
+            values = self._interpolate_stale(values, positions, stale)
+        return values, decreases, drops, jumps, stale
+
+    def repair(self, data, group, keys):
+        """
+        Repaired copy of the data with rows in the original order
+        and a report per series indexed by group and key:
+        the number of decreases, the largest decrease, the number of jumps,
+        stale days and values changed by the repairs.
+        """
+        order = np.lexsort((data["date"].values, data[group].values))
+        codes, names = pd.factorize(data[group].values[order])
+        positions = _positions(codes)
+        repaired = data.copy()
+        reports = []
+        for key in keys:
+            original = data[key].values.astype(float)[order]
+            values, decreases, drops, jumps, stale = self._repair_series(
+                original, codes, positions
+            )
+            with np.errstate(invalid="ignore"):
+                changed = (values != original) & ~np.isnan(original)
+            max_decrease = np.zeros(len(names))
+            np.maximum.at(max_decrease, codes[decreases], drops[decreases])
+
+            def count(issue):
+                return np.bincount(codes, issue, len(names)).astype(int)
+
+            reports.append(
+                pd.DataFrame(
+                    {
+                        group: names,
+                        "key": key,
+                        "decreases": count(decreases),
+                        "max_decrease": max_decrease,
+                        "jumps": count(jumps),
+                        "stale_days": count(stale),
+                        "repaired_values": count(changed),
+                    }
+                )
+            )
+            column = np.empty(len(values))
+            column[order] = values
+            repaired[key] = column
+        report = pd.concat(reports, ignore_index=True)
+        return repaired, report.set_index([group, "key"])
+
+    def repair_all(self, data):
+        """
+        Repairs the world and Russia timeseries of DatasetManager.get_data()
+        output in place, returns {"world": report, "russia": report}.
+        """
+        reports = {}
+        for name, (group, keys) in FEATURE_SOURCES.items():
+            frame, reports[name] = self.repair(data[name]["by_date"], group, keys)
+            data[name]["by_date"] = frame
+        return reports
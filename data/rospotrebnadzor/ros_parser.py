@@ -1,7 +1,9 @@
+from ..profiling import NullProfiler
+from ..transport import Transport, get_transport
 from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
 import warnings
-import requests
+import io
 import pandas as pd
 import re
 
@@ -56,11 +58,20 @@ class RegionMatcher:
 
 
 class ReportDownloader:
-    def __init__(self, cfg):
+    def __init__(self, cfg, transport=None):
         self.cfg = cfg
+        self.transport = Transport() if transport is None else transport
+        self.profiler = NullProfiler()
 
     def get_latest_info(self):
-        rospage_response = requests.get(self.cfg["rospotreb_page"] + "about/info/news/")
+        with self.profiler.stage("download rospotrebnadzor update") as stage:
+            div = self._get_latest_info(stage)
+        return div
+
+    def _get_latest_info(self, stage):
+        rospage_response = self.transport.get(
+            self.cfg["rospotreb_page"] + "about/info/news/"
+        )
         main_page_content = rospage_response.content.decode("Windows-1251")
         soup = BeautifulSoup(main_page_content, "html.parser")
         link = (
@@ -70,14 +81,22 @@ class ReportDownloader:
                 text=" О подтвержденных случаях новой коронавирусной инфекции COVID-2019 в России",
             )["href"]
         )
-        last_report_response = requests.get(link)
+        last_report_response = self.transport.get(link)
+        stage["bytes"] = len(rospage_response.content) + len(
+            last_report_response.content
+        )
         report = last_report_response.content.decode("Windows-1251")
         soup = BeautifulSoup(report, "html.parser")
         div = soup.find("div", {"class": "news-detail"})
         return div
 
     def download_report(self):
-        confirmed_cases = pd.read_csv(self.cfg["timeseries_page"])
+        with self.profiler.stage("download rospotrebnadzor timeseries") as stage:
+            response = self.transport.get(self.cfg["timeseries_page"])
+            stage["bytes"] = len(response.content)
+        with self.profiler.stage("parse rospotrebnadzor timeseries") as stage:
+            confirmed_cases = pd.read_csv(io.BytesIO(response.content))
+            stage["rows_out"] = len(confirmed_cases)
         last_update = self.get_latest_info()
         return confirmed_cases, last_update
 
@@ -90,7 +109,7 @@ class RussianRegionsParser:
     def __init__(self, cfg):
         main_cfg = cfg["rospotreb"]
         aux_cfg = cfg["auxiliary"]
-        self.downloader = ReportDownloader(main_cfg)
+        self.downloader = ReportDownloader(main_cfg, get_transport(cfg))
         self.regions_fname = aux_cfg["regions"]
         self.matcher = RegionMatcher()
 
@@ -0,0 +1,95 @@
+import gzip
+import hashlib
+import json
+import os
+import requests
+
+
+class ArchivedResponse:
+    """
+    Response served from a transport archive,
+    with the fields of the requests response the downloaders use.
+    """
+
+    def __init__(self, url, content, status_code=200):
+        self.url = url
+        self.content = content
+        self.status_code = status_code
+
+
+class Transport:
+    """
+    HTTP access shared by all downloaders with three modes:
+        live = plain requests
+        record = requests with every response saved to the archive
+        replay = responses served from the archive, no network access
+    The archive is a folder with a gzip compressed file per url
+    and an index.json with urls, file names and status codes.
+    """
+
+    modes = ("live", "record", "replay")
+
+    def __init__(self, mode="live", archive=None):
+        if mode not in self.modes:
+            raise ValueError(f"Wrong transport mode {mode}")
+        if mode != "live" and archive is None:
+            raise ValueError(f"Transport mode {mode} needs an archive folder")
+        self.mode = mode
+        self.archive = archive
+        self.index = {}
+        if archive is not None:
+            self.index = self._read_index()
+
+    def _index_filename(self):
+        return f"{self.archive}/index.json"
+
+    def _read_index(self):
+        if not os.path.exists(self._index_filename()):
+            return {}
+        with open(self._index_filename()) as f:
+            return json.load(f)
+
+    def save(self, url, content, status_code=200):
+        os.makedirs(self.archive, exist_ok=True)
+        filename = hashlib.sha1(url.encode()).hexdigest() + ".gz"
+        with gzip.open(f"{self.archive}/{filename}", "wb") as f:
+            f.write(content)
+        self.index[url] = {"file": filename, "status_code": status_code}
+        with open(self._index_filename(), "w") as f:
+            json.dump(self.index, f, indent=2, sort_keys=True)
+
+    def load(self, url):
+        if url not in self.index:
+            # the archive could have been recorded by another transport
+            self.index = self._read_index()
+        if url not in self.index:
+            raise ValueError(f"No recorded response for {url}")
+        entry = self.index[url]
+        with gzip.open(f"{self.archive}/{entry['file']}", "rb") as f:
+            content = f.read()
+        return ArchivedResponse(url, content, entry["status_code"])
+
+    def get(self, url):
+        if self.mode == "replay":
+            return self.load(url)
+        response = requests.get(url)
+        if self.mode == "record":
+            self.save(url, response.content, response.status_code)
+        return response
+
+
+_transports = {}
+
+
+def get_transport(cfg):
+    """
+    Transport of the "transport" configuration section ({mode, archive}),
+    live requests by default. Parsers with the same settings share one
+    transport (and its archive index).
+    """
+    transport_cfg = cfg.get("transport") or {}
+    mode = transport_cfg.get("mode", "live")
+    archive = transport_cfg.get("archive")
+    if (mode, archive) not in _transports:
+        _transports[(mode, archive)] = Transport(mode, archive)
+    return _transports[(mode, archive)]
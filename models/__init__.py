@@ -1,2 +1,2 @@
-from .compartment import CompartmentalOptimizer
+from .compartment import CompartmentalOptimizer, JointCompartmentalOptimizer, FitBudget
 from .selection import model_per_country_simple_split
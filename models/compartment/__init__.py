@@ -1 +1,11 @@
 from .optimizer import CompartmentalOptimizer
+from .joint import JointCompartmentalOptimizer
+from .budget import FitBudget
+from .reproduction import HillDecay, CovariateReproduction, covariates_from_frame
+from .engines import RK45Engine, DailyEngine
+from .stochastic import StochasticSEIR_HCD
+from .bootstrap import bootstrap_fit
+from .sensitivity import sobol_indices, morris_indices, sensitivity_report
+from .store import FitStore
+from .parallel import fit_many
+from .instrumentation import FitInstrumentation, summarize_records
@@ -0,0 +1,102 @@
+from ..parallel import run_tasks
+import numpy as np
+
+
+def resample_series(fitted, observed, n_samples, random, block_size=7):
+    """
+    Synthetic cumulative series from a moving block bootstrap of the log
+    residuals of daily increments. Blocks of block_size consecutive days
+    keep the autocorrelation of the residuals (block_size=1 is the iid one).
+    Returns a (n_samples, days) array starting from the first observed value.
+    """
+    fitted = np.clip(fitted, 0, np.inf)
+    fitted_increments = np.log1p(np.clip(np.diff(fitted), 0, np.inf))
+    residuals = np.log1p(np.clip(np.diff(observed), 0, np.inf)) - fitted_increments
+    days = len(residuals)
+    block_size = max(min(block_size, days), 1)
+    n_blocks = -(-days // block_size)
+    starts = random.randint(0, days - block_size + 1, (n_samples, n_blocks))
+    indices = (starts[:, :, None] + np.arange(block_size)).reshape(n_samples, -1)
+    increments = np.expm1(fitted_increments + residuals[indices[:, :days]])
+    samples = np.zeros((n_samples, days + 1))
+    samples[:, 0] = observed[0]
+    samples[:, 1:] = observed[0] + np.cumsum(np.clip(increments, 0, np.inf), axis=1)
+    return np.round(samples)
+
+
+def _refit(task):
+    optimizer, cases, deaths, population, initial_guess, budget, tol, horizon = task
+    result = optimizer.fit(
+        cases, deaths, population, initial_guess=initial_guess, budget=budget, tol=tol
+    )
+    pred_cases, pred_fatal = optimizer.predict(
+        result.x, cases, deaths, population, horizon
+    )
+    return result.x, pred_cases[-horizon:], pred_fatal[-horizon:]
+
+
+def bootstrap_fit(
+    optimizer,
+    params,
+    cases,
+    deaths,
+    population,
+    n_samples=100,
+    horizon=10,
+    quantiles=(0.05, 0.5, 0.95),
+    workers=None,
+    budget=None,
+    tol=1e-6,
+    seed=None,
+    block_size=7,
+):
+    """
+    Parametric bootstrap of a CompartmentalOptimizer fit.
+    Residuals of the daily increments of the fitted params are resampled
+    in blocks of block_size days into synthetic series
+    that are refitted starting from the params. Refits are spread over
+    a process pool of workers (all CPUs by default, 1 runs in place).
+    An optional FitBudget and the looser tolerance are applied to every refit.
+    Returns a dictionary with quantile arrays of the "parameters"
+    (len(quantiles), n_params) and of the "cases" and "deaths" forecasts
+    (len(quantiles), horizon) together with the raw "samples".
+    """
+    cases = np.asarray(cases, dtype=float)
+    deaths = np.asarray(deaths, dtype=float)
+    model = optimizer.model
+    solution = model._solve_ode(
+        model._get_optimization_args(params), population, cases[0], len(cases)
+    )
+    fitted_cases, fitted_deaths = model._get_predictions(solution, population)
+    random = np.random.RandomState(seed)
+    synthetic_cases = resample_series(
+        fitted_cases, cases, n_samples, random, block_size
+    )
+    synthetic_deaths = resample_series(
+        fitted_deaths, deaths, n_samples, random, block_size
+    )
+
+    tasks = [
+        (
+            optimizer,
+            sample_cases,
+            sample_deaths,
+            population,
+            params,
+            budget,
+            tol,
+            horizon,
+        )
+        for sample_cases, sample_deaths in zip(synthetic_cases, synthetic_deaths)
+    ]
+    outputs = run_tasks(_refit, tasks, workers)
+
+    samples, pred_cases, pred_fatal = [np.array(x) for x in zip(*outputs)]
+    return {
+        "quantiles": np.array(quantiles),
+        "parameter_names": list(optimizer.states.keys()),
+        "parameters": np.quantile(samples, quantiles, axis=0),
+        "cases": np.quantile(pred_cases, quantiles, axis=0),
+        "deaths": np.quantile(pred_fatal, quantiles, axis=0),
+        "samples": samples,
+    }
@@ -0,0 +1,95 @@
+import time
+import numpy as np
+
+
+class BudgetExhausted(Exception):
+    """
+    Raised inside the objective or the ODE right hand side
+    when one of the fit budget limits is reached.
+    """
+
+    def __init__(self, reason):
+        super().__init__(f"Fit budget exhausted: {reason}")
+        self.reason = reason
+
+
+class FitBudget:
+    """
+    Resource limits for a single CompartmentalOptimizer.fit() call.
+    Any limit set to None is not checked.
+        max_seconds = wall-clock time for all initial guesses together
+        max_evaluations = number of objective function calls
+        max_rhs_calls = number of ODE right hand side evaluations
+    """
+
+    def __init__(self, max_seconds=None, max_evaluations=None, max_rhs_calls=None):
+        self.max_seconds = max_seconds
+        self.max_evaluations = max_evaluations
+        self.max_rhs_calls = max_rhs_calls
+
+    def watches_rhs(self):
+        """
+        RHS calls are only wrapped when it is needed: a single ODE solve
+        can take long enough to overrun the time limit by itself.
+        """
+        return self.max_rhs_calls is not None or self.max_seconds is not None
+
+
+class BudgetTracker:
+    """
+    Counts objective and RHS calls during a fit, keeps the best parameters
+    seen so far and the convergence trace (objective value per evaluation).
+    Only parameters passing the optional feasible(params) check
+    are accepted as the best-so-far result.
+    """
+
+    def __init__(self, budget=None, feasible=None):
+        self.budget = FitBudget() if budget is None else budget
+        self.feasible = feasible
+        self.start = time.perf_counter()
+        self.evaluations = 0
+        self.rhs_calls = 0
+        self.best_score = np.inf
+        self.best_params = None
+        self.trace = []
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def check(self):
+        budget = self.budget
+        if budget.max_seconds is not None and self.elapsed() > budget.max_seconds:
+            raise BudgetExhausted("max_seconds")
+        if (
+            budget.max_evaluations is not None
+            and self.evaluations >= budget.max_evaluations
+        ):
+            raise BudgetExhausted("max_evaluations")
+        if budget.max_rhs_calls is not None and self.rhs_calls >= budget.max_rhs_calls:
+            raise BudgetExhausted("max_rhs_calls")
+
+    def wrap_objective(self, function):
+        def tracked_objective(params, *args):
+            self.check()
+            self.evaluations += 1
+            score = function(params, *args)
+            self.trace.append(score)
+            if score < self.best_score and (
+                self.feasible is None or self.feasible(params)
+            ):
+                self.best_score = score
+                self.best_params = np.array(params, copy=True)
+            return score
+
+        return tracked_objective
+
+    def wrap_rhs(self, function):
+        if not self.budget.watches_rhs():
+            return function
+
+        def tracked_rhs(*args):
+            self.rhs_calls += 1
+            self.check()
+            return function(*args)
+
+        return tracked_rhs
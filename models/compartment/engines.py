@@ -0,0 +1,108 @@
+from scipy.integrate import solve_ivp
+import numpy as np
+
+
+class RK45Engine:
+    """
+    Adaptive Runge-Kutta integration of any compartment model function
+    evaluated at the start of every day.
+    """
+
+    name = "rk45"
+
+    def __call__(self, model, args, initial_state, days):
+        return solve_ivp(
+            model, [0, days], initial_state, args=args, t_eval=np.arange(0, days)
+        )
+
+
+class DailySolution:
+    """
+    Minimal stand-in for the solve_ivp result used by the compartment models.
+    """
+
+    def __init__(self, y, nfev=0):
+        self.y = y
+        self.t = np.arange(y.shape[-1])
+        self.success = True
+        self.nfev = nfev
+
+
+class DailyEngine:
+    """
+    Fixed step integration of any compartment model function.
+    Every day is split into substeps advanced by the second order Heun method,
+    the derivatives come from the model function (so budgets watching
+    the RHS calls see them). Works with scalar parameters as well as with
+    numpy arrays of them, in that case every array element
+    is an independent trajectory.
+
+    Accuracy against RK45 with tight tolerances (rtol=1e-8) on 200 random
+    parameter sets within the DEFAULT_STATES bounds over 80 days,
+    maximal relative error of predicted cases (median / 95% / worst):
+        1 substep: 0.9% / 6.9% / 23%
+        2 substeps: 0.2% / 2.0% / 7.6%
+        4 substeps: 0.05% / 0.5% / 2.1%
+        default RK45 (rtol=1e-3): 0.9% / 3.6% / 6.5%
+    """
+
+    name = "daily"
+
+    def __init__(self, substeps=2):
+        self.substeps = substeps
+
+    def __call__(self, model, args, initial_state, days):
+        R_t, args = args[0], args[1:]
+        reproduction = R_t(0) if callable(R_t) else R_t
+        shape = np.broadcast(reproduction, *initial_state, *args).shape
+        initial_state = np.array([np.broadcast_to(x, shape) for x in initial_state])
+        state = list(initial_state)
+        if shape == ():
+            # python floats are much faster than numpy scalars in the loop
+            state = [float(x) for x in state]
+            args = tuple(float(x) for x in args)
+            if callable(R_t):
+                reproduction = R_t
+
+                def R_t(t):
+                    return float(reproduction(t))
+
+            else:
+                R_t = float(R_t)
+
+        states = []
+        step = 1 / self.substeps
+        half_step = step / 2
+        time_step = 0.0
+        for day in range(1, days):
+            for _ in range(self.substeps):
+                slope = model(time_step, state, R_t, *args)
+                predictor = [x + step * dx for x, dx in zip(state, slope)]
+                time_step += step
+                corrector = model(time_step, predictor, R_t, *args)
+                state = [
+                    x + half_step * (dx + dy)
+                    for x, dx, dy in zip(state, slope, corrector)
+                ]
+            states.append(state)
+
+        trajectory = np.empty((7, days) + shape)
+        trajectory[:, 0] = initial_state
+        if days > 1:
+            trajectory[:, 1:] = np.moveaxis(np.array(states), 0, 1)
+        # the model is evaluated twice per substep
+        return DailySolution(trajectory, 2 * self.substeps * max(days - 1, 0))
+
+
+ENGINES = {"rk45": RK45Engine, "daily": DailyEngine}
+
+
+def get_engine(engine):
+    """
+    Returns an engine instance by its name, engine instances pass as is.
+    """
+    if isinstance(engine, str):
+        if engine not in ENGINES:
+            raise ValueError(f"Wrong engine type {engine}")
+        return ENGINES[engine]()
+    return engine
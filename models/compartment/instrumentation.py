@@ -0,0 +1,114 @@
+import json
+import time
+import pandas as pd
+
+
+class FitProfile:
+    """
+    Counters and timings of a single CompartmentalOptimizer.fit() call.
+        objective_calls = loss function evaluations
+        solve_calls, failed_solves = ODE solves and unsuccessful ones
+        rhs_calls = ODE right hand side evaluations reported by the engine
+        solve_seconds, loss_seconds = time spent integrating and scoring
+        objective_seconds = time spent in the loss function as a whole
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.objective_calls = 0
+        self.solve_calls = 0
+        self.failed_solves = 0
+        self.rhs_calls = 0
+        self.solve_seconds = 0.0
+        self.loss_seconds = 0.0
+        self.objective_seconds = 0.0
+
+    def add_solve(self, solution):
+        self.solve_calls += 1
+        self.rhs_calls += int(getattr(solution, "nfev", 0))
+        if not solution.success:
+            self.failed_solves += 1
+
+    def add_objective(self, start, solved, finished):
+        self.objective_calls += 1
+        self.solve_seconds += solved - start
+        self.loss_seconds += finished - solved
+        self.objective_seconds += finished - start
+
+    def to_record(self):
+        return {
+            "objective_calls": self.objective_calls,
+            "solve_calls": self.solve_calls,
+            "failed_solves": self.failed_solves,
+            "rhs_calls": self.rhs_calls,
+            "solve_seconds": self.solve_seconds,
+            "loss_seconds": self.loss_seconds,
+            "objective_seconds": self.objective_seconds,
+            "fit_seconds": time.perf_counter() - self.start,
+        }
+
+
+class FitInstrumentation:
+    """
+    Opt-in profiling of CompartmentalOptimizer fits.
+    Every fit produces a record with its FitProfile counters, the key,
+    the engine, the loss and the budget status. Records are kept in memory,
+    attached to the fit result as result.profile and, with a filename,
+    appended to a JSON lines file (one write per record, so processes
+    of a fit_many run can share the file).
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.records = []
+
+    def start(self):
+        return FitProfile()
+
+    def finish(self, profile, result, key=None, engine=None):
+        record = {"key": key, "engine": engine}
+        record.update(profile.to_record())
+        if result is not None:
+            record["loss"] = float(result.fun)
+            record["budget_status"] = getattr(result, "budget_status", None)
+        self.records.append(record)
+        if self.filename is not None:
+            with open(self.filename, "a") as handle:
+                handle.write(json.dumps(record) + "\n")
+        return record
+
+
+def read_records(filename):
+    """
+    Reads the fit records of a JSON lines file.
+    """
+    with open(filename) as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def summarize_records(records, by=None):
+    """
+    Totals of the fit counters and timings (with the number of fits)
+    for records, fit results with profiles (e.g. fit_many results)
+    or a JSON lines filename, optionally grouped by a record field.
+    """
+    if isinstance(records, str):
+        records = read_records(records)
+    elif isinstance(records, dict):
+        records = [result.profile for result in records.values()]
+    frame = pd.DataFrame(records)
+    frame["fits"] = 1
+    columns = [
+        "fits",
+        "objective_calls",
+        "solve_calls",
+        "failed_solves",
+        "rhs_calls",
+        "solve_seconds",
+        "loss_seconds",
+        "objective_seconds",
+        "fit_seconds",
+    ]
+    if by is None:
+        return frame[columns].sum()
+    return frame.groupby(by)[columns].sum()
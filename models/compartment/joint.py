@@ -0,0 +1,299 @@
+from scipy.optimize import minimize, NonlinearConstraint, OptimizeResult
+from scipy.integrate import solve_ivp
+from .budget import BudgetTracker, BudgetExhausted
+from .optimizer import DEFAULT_STATES, COMPARTMENT_KEYS
+from .reproduction import HillDecay
+from .seir import SEIR_HCD
+import numpy as np
+
+SHARED_KEYS = COMPARTMENT_KEYS
+# forward difference step, the SLSQP default
+GRADIENT_STEP = np.sqrt(np.finfo(float).eps)
+
+
+def pack_series(series):
+    """
+    Pads a list of 1d series with different lengths into a 2d array.
+    Returns the (n_series, max_length) array and the series lengths.
+    """
+    lengths = np.array([len(x) for x in series])
+    packed = np.zeros((len(series), lengths.max()))
+    for row, values in enumerate(series):
+        packed[row, : len(values)] = values
+    return packed, lengths
+
+
+class JointCompartmentalModel:
+    """
+    Many regions in one ODE system. Region compartments are stacked
+    into a (7, n_regions) block, so the Jacobian is block-diagonal and
+    a single solve_ivp call integrates every region at once.
+    Time is measured in days since the first case of each region.
+    The reproduction model gets arrays of regional parameters.
+    """
+
+    def __init__(self, model_function, optimize_days=21, reproduction=None):
+        self.model = model_function
+        self.optim_days = optimize_days
+        self.reproduction = HillDecay() if reproduction is None else reproduction
+        self.regional_keys = ["R_0"] + list(self.reproduction.states)
+
+    def split_parameters(self, params, n_regions):
+        """
+        Assume this order of parameters:
+            (t_inc, t_inf, t_hosp, t_crit, mild, critical, fatal,
+            R_0 * n_regions, reproduction model parameters * n_regions
+            (k * n_regions, L * n_regions for the Hill decay))
+        """
+        shared = tuple(params[: len(SHARED_KEYS)])
+        regional = np.reshape(
+            params[len(SHARED_KEYS) :], (len(self.regional_keys), n_regions)
+        )
+        return shared, regional
+
+    def _get_optimization_args(self, params, n_regions):
+        shared, regional = self.split_parameters(params, n_regions)
+        time_varying_reproduction = self.reproduction(regional[0], list(regional[1:]))
+        return (time_varying_reproduction,) + shared
+
+    def _stacked_model(self, time_step, compartments, *args):
+        derivatives = self.model(time_step, compartments.reshape(7, -1), *args)
+        return np.concatenate(derivatives)
+
+    def _solve_ode(self, args, population, n_infected, days):
+        """
+        Solve the stacked SEIR system for every region simultaneously.
+        """
+        initial_state = np.zeros((7, len(population)))
+        initial_state[0] = (population - n_infected) / population
+        initial_state[2] = n_infected / population
+
+        solution = solve_ivp(
+            self._stacked_model,
+            [0, days],
+            initial_state.ravel(),
+            args=args,
+            t_eval=np.arange(0, days),
+        )
+        return solution
+
+    def _get_predictions(self, solution, population):
+        """
+        Returns (n_regions, days) predictions of confirmed cases and fatalities.
+        """
+        compartments = solution.y.reshape(7, len(population), -1)
+        _, _, inf, rec, hosp, crit, deaths = compartments
+        population = population[:, None]
+        pred_cases = np.clip(inf + rec + hosp + crit + deaths, 0, np.inf) * population
+        pred_fatal = np.clip(deaths, 0, np.inf) * population
+        return pred_cases, pred_fatal
+
+    def _last_days(self, lengths):
+        """
+        Indices of the last optimized days of every region with their weights.
+        The most recent day has a weight of 1, the one before 1/2 and so on.
+        """
+        offsets = np.arange(self.optim_days)
+        indices = lengths[:, None] - 1 - offsets[None, :]
+        weights = np.where(indices >= 0, 1 / (offsets + 1), 0)
+        return np.clip(indices, 0, None), weights
+
+    def _weighted_msle(self, true, predicted, indices, weights):
+        rows = np.arange(len(true))[:, None]
+        errors = (
+            np.log1p(true[rows, indices]) - np.log1p(predicted[rows, indices])
+        ) ** 2
+        return (errors * weights).sum(1) / weights.sum(1)
+
+    def _eval_msle(self, sol, data_cases, data_deaths, lengths, population):
+        """
+        Weighted mean squared log error of every region.
+        Without deaths data only the cases error is used.
+        """
+        pred_cases, pred_fatal = self._get_predictions(sol, population)
+        if pred_cases.shape[1] < data_cases.shape[1]:
+            # failed integration, the solver stopped early
+            return np.full(len(population), np.inf), (pred_cases, pred_fatal)
+        indices, weights = self._last_days(lengths)
+        msle_cases = self._weighted_msle(data_cases, pred_cases, indices, weights)
+        if data_deaths is None:
+            score = msle_cases
+        else:
+            msle_fat = self._weighted_msle(data_deaths, pred_fatal, indices, weights)
+            score = (msle_cases * 0.75 + msle_fat * 0.25) / 2
+        return score, (pred_cases, pred_fatal)
+
+    def region_scores(self, params, data_cases, data_deaths, lengths, population):
+        args = self._get_optimization_args(params, len(population))
+        sol = self._solve_ode(args, population, data_cases[:, 0], data_cases.shape[1])
+        scores, _ = self._eval_msle(sol, data_cases, data_deaths, lengths, population)
+        return scores
+
+    def model_optimization_function(
+        self, params, data_cases, data_deaths, lengths, population, forecast_days=0
+    ):
+        """
+        Joint optimization function for padded (n_regions, days) data arrays.
+        Returns either the mean msle score or the predicted numbers.
+        """
+        if forecast_days == 0:
+            return np.mean(
+                self.region_scores(params, data_cases, data_deaths, lengths, population)
+            )
+        args = self._get_optimization_args(params, len(population))
+        max_days = data_cases.shape[1] + forecast_days
+        sol = self._solve_ode(args, population, data_cases[:, 0], max_days)
+        _, predicted = self._eval_msle(
+            sol, data_cases, data_deaths, lengths, population
+        )
+        return predicted
+
+    def gradient(
+        self, params, data_cases, data_deaths, lengths, population, forecast_days=0
+    ):
+        """
+        Forward difference gradient of the mean msle.
+        Regions do not interact, so a regional parameter is shifted
+        in every region at once and each region score gives its own derivative:
+        1 + n_shared + n_regional stacked solves per gradient
+        instead of 1 + n_shared + n_regional * n_regions.
+        """
+        data = (data_cases, data_deaths, lengths, population)
+        n_regions = len(population)
+        params = np.asarray(params, dtype=float)
+        scores = self.region_scores(params, *data)
+        gradient = np.empty(len(params))
+        starts = list(range(len(SHARED_KEYS))) + list(
+            range(len(SHARED_KEYS), len(params), n_regions)
+        )
+        for start in starts:
+            end = start + 1 if start < len(SHARED_KEYS) else start + n_regions
+            shifted = params.copy()
+            shifted[start:end] += GRADIENT_STEP
+            differences = (self.region_scores(shifted, *data) - scores) / GRADIENT_STEP
+            if end - start == 1:
+                gradient[start] = np.mean(differences)
+            else:
+                gradient[start:end] = differences / n_regions
+        return gradient
+
+
+class JointCompartmentalOptimizer:
+    """
+    Hierarchical SEIR fit of many regions in one optimization.
+    Incubation, infectious, hospital and critical times together with
+    the outcome fractions are shared, R_0 and the reproduction model
+    parameters (k and L of the default Hill decay) are fitted per region.
+    SLSQP gets the batched gradient of JointCompartmentalModel.gradient.
+    """
+
+    def __init__(self, parameter_states=None, optim_days=21, reproduction=None):
+        self.model = JointCompartmentalModel(SEIR_HCD(), optim_days, reproduction)
+        self.model_fn = self.model.model_optimization_function
+        self.regional_keys = self.model.regional_keys
+        reproduction_states = self.model.reproduction.states
+        self.states = parameter_states
+        if parameter_states is None:
+            self.states = {key: DEFAULT_STATES[key] for key in ["R_0"] + SHARED_KEYS}
+            self.states.update(reproduction_states)
+        if set(self.states.keys()) != set(SHARED_KEYS + self.regional_keys):
+            raise ValueError("Wrong state keys")
+
+    def _pack(self, cases, deaths, populations):
+        data_cases, lengths = pack_series(cases)
+        data_deaths = None if deaths is None else pack_series(deaths)[0]
+        return data_cases, data_deaths, lengths, np.asarray(populations, dtype=float)
+
+    def _initial_guess(self, n_regions):
+        shared = [self.states[key][0] for key in SHARED_KEYS]
+        regional = [[self.states[key][0]] * n_regions for key in self.regional_keys]
+        return np.concatenate([shared] + regional)
+
+    def _bounds(self, n_regions):
+        shared = [self.states[key][1] for key in SHARED_KEYS]
+        regional = [
+            self.states[key][1] for key in self.regional_keys for _ in range(n_regions)
+        ]
+        return shared + regional
+
+    def split_parameters(self, params, n_regions):
+        """
+        Returns shared parameters as a dictionary and regional parameters
+        as a (n_regions, n_regional) array of (R_0, k, L) for the Hill decay.
+        """
+        shared, regional = self.model.split_parameters(params, n_regions)
+        return dict(zip(SHARED_KEYS, shared)), regional.transpose()
+
+    def fit(self, cases, deaths, populations, initial_guess=None, budget=None):
+        """
+        Fits every region at once.
+            cases = list of cumulative case series, one per region,
+                each starting from the first confirmed case
+            deaths = list of death series with the same lengths or None
+            populations = population per region
+        """
+        data = self._pack(cases, deaths, populations)
+        n_regions = len(populations)
+        if initial_guess is None:
+            initial_guess = self._initial_guess(n_regions)
+
+        hospital_index = SHARED_KEYS.index("time_in_hospital")
+        critical_index = SHARED_KEYS.index("time_critical")
+
+        def constraint(x):
+            return x[hospital_index] - x[critical_index]
+
+        cons = NonlinearConstraint(constraint, 1.0, 10.0)
+        tracker = BudgetTracker(budget, lambda x: 1.0 <= constraint(x) <= 10.0)
+        objective = tracker.wrap_objective(self.model_fn)
+
+        def gradient(params, *args):
+            tracker.check()
+            return self.model.gradient(params, *args)
+
+        ode_function = self.model.model
+        self.model.model = tracker.wrap_rhs(ode_function)
+
+        status = "completed"
+        try:
+            result = minimize(
+                objective,
+                initial_guess,
+                bounds=self._bounds(n_regions),
+                constraints=cons,
+                args=data + (False,),
+                jac=gradient,
+                method="SLSQP",
+                tol=1e-10,
+                options={"maxiter": 5000},
+            )
+        except BudgetExhausted as error:
+            status = error.reason
+            result = OptimizeResult(
+                x=initial_guess if tracker.best_params is None else tracker.best_params,
+                fun=tracker.best_score,
+                success=False,
+                message="Budget exhausted, returning the best result so far",
+            )
+        finally:
+            self.model.model = ode_function
+
+        result.budget_status = status
+        result.trace = np.array(tracker.trace)
+        result.nrhs = tracker.rhs_calls
+        result.elapsed = tracker.elapsed()
+        return result
+
+    def predict(self, params, cases, deaths, populations, horizon=10):
+        """
+        Forecasts all regions with a single ODE solve.
+        Returns a list of (predicted cases, predicted deaths) per region,
+        each of the region data length plus the horizon.
+        """
+        data = self._pack(cases, deaths, populations)
+        pred_cases, pred_fatal = self.model_fn(params, *data, forecast_days=horizon)
+        lengths = data[2] + horizon
+        return [
+            (pred_cases[row, :length], pred_fatal[row, :length])
+            for row, length in enumerate(lengths)
+        ]
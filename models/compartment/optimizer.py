@@ -1,9 +1,13 @@
-from scipy.optimize import minimize, NonlinearConstraint
+from scipy.optimize import minimize, NonlinearConstraint, OptimizeResult
 from sklearn.metrics import mean_squared_log_error
-from scipy.integrate import solve_ivp
+from .budget import BudgetTracker, BudgetExhausted
+from .reproduction import HillDecay
+from .engines import get_engine, RK45Engine, DailySolution
+from .stochastic import StochasticSEIR_HCD, quantile_bands
+from .store import data_hash, settings_hash
 from .seir import SEIR_HCD
 import numpy as np
-
+import time
 
 DEFAULT_STATES = {
     "R_0": [2, (1, 7)],
@@ -19,26 +23,38 @@ DEFAULT_STATES = {
 }
 
 
+COMPARTMENT_KEYS = [
+    "time_incubation",
+    "time_infectious",
+    "time_in_hospital",
+    "time_critical",
+    "mild_fraction",
+    "critical_fraction",
+    "fatal_fraction",
+]
+
+
 class CompartmentalModel:
-    def __init__(self, model_function, optimize_days=21):
+    def __init__(
+        self, model_function, optimize_days=21, reproduction=None, engine="rk45"
+    ):
         self.model = model_function
         self.optim_days = optimize_days
+        self.reproduction = HillDecay() if reproduction is None else reproduction
+        self.engine = get_engine(engine)
+        self.profile = None
 
     def _get_optimization_args(self, params):
         """
-        Returns parameters with the reproduction number decayed by Hill.
+        Returns parameters with the time varying reproduction number.
         Assume this order of parameters:
             (R_0, t_inc, t_inf, t_hosp, t_crit,
             mild, critical, fatal,
-            k, L)
+            reproduction model parameters (k, L for the Hill decay))
         """
         R_0 = params[0]
-        k, L = params[-2:]
-
-        def time_varying_reproduction(t):
-            return R_0 / (1 + (t / L) ** k)
-
-        args = (time_varying_reproduction,) + tuple(params[1:-2])
+        time_varying_reproduction = self.reproduction(R_0, params[8:])
+        args = (time_varying_reproduction,) + tuple(params[1:8])
         return args
 
     def _get_predictions(self, solution, population):
@@ -70,36 +86,49 @@ class CompartmentalModel:
         score = np.mean([msle_cases * 0.75, msle_fat * 0.25])
         return score, (pred_cases, pred_fatal)
 
-    def _solve_ode(self, args, population, n_infected, days):
+    def _solve_ode(self, args, population, n_infected, days, engine=None):
         """
         Solve the SEIR differential equation system to get the compartmental
-        function model for further optimization.
+        function model for further optimization. The engine decides how:
+        adaptive RK45 by default or the fixed step daily recurrence.
         """
+        if engine is None:
+            engine = self.engine
         initial_state = [
             (population - n_infected) / population,
             0,
             n_infected / population,
-            0, 0, 0, 0,
+            0,
+            0,
+            0,
+            0,
         ]
 
-        solution = solve_ivp(
-            self.model, [0, days], initial_state, args=args, t_eval=np.arange(0, days)
-        )
+        solution = engine(self.model, args, initial_state, days)
+        if self.profile is not None:
+            self.profile.add_solve(solution)
         return solution
 
     def model_optimization_function(
         self, params, data_cases, data_deaths, population, forecast_days=0
     ):
         """
-        Main optimization function for comparing the SEIR model with 
+        Main optimization function for comparing the SEIR model with
         Returns either the SEIR msle likelihood score or the predicted numbers.
         """
+        profile = self.profile
+        if profile is not None:
+            start = time.perf_counter()
         args = self._get_optimization_args(params)
         max_days = len(data_cases) + forecast_days
         sol = self._solve_ode(args, population, data_cases[0], max_days)
+        if profile is not None:
+            solved = time.perf_counter()
         msle_score, predicted = self._eval_msle(
             sol, data_cases, data_deaths, population
         )
+        if profile is not None:
+            profile.add_objective(start, solved, time.perf_counter())
 
         if forecast_days == 0:
             return msle_score
@@ -112,33 +141,108 @@ class CompartmentalOptimizer:
     Fits the SEIR model to amounts of cases and deaths.
     """
 
-    def __init__(self, parameter_states=None, optim_days=21):
-        model = CompartmentalModel(SEIR_HCD(), optim_days)
-        self.model_fn = model.model_optimization_function
+    def __init__(
+        self,
+        parameter_states=None,
+        optim_days=21,
+        reproduction=None,
+        engine="rk45",
+        store=None,
+        instrumentation=None,
+    ):
+        self.model = CompartmentalModel(SEIR_HCD(), optim_days, reproduction, engine)
+        self.model_fn = self.model.model_optimization_function
+        self.store = store
+        self.instrumentation = instrumentation
+        reproduction_states = self.model.reproduction.states
         self.states = parameter_states
         if parameter_states is None:
-            self.states = DEFAULT_STATES
-        if list(self.states.keys()) != [
-            "R_0",
-            "time_incubation",
-            "time_infectious",
-            "time_in_hospital",
-            "time_critical",
-            "mild_fraction",
-            "critical_fraction",
-            "fatal_fraction",
-            "k",
-            "L",
-        ]:
+            self.states = {
+                key: DEFAULT_STATES[key] for key in ["R_0"] + COMPARTMENT_KEYS
+            }
+            self.states.update(reproduction_states)
+        if list(self.states.keys()) != ["R_0"] + COMPARTMENT_KEYS + list(
+            reproduction_states
+        ):
             raise ValueError("Wrong state keys")
 
-    def fit(self, cases, deaths, population, generate_guesses=None):
-        if generate_guesses is None:
+    def _budget_result(self, tracker, fallback_guess):
+        """
+        Best-so-far result for a fit interrupted by its budget.
+        """
+        if tracker.best_params is None:
+            return OptimizeResult(
+                x=np.array(fallback_guess, dtype=float),
+                fun=np.inf,
+                success=False,
+                message="Budget exhausted before any feasible evaluation",
+            )
+        return OptimizeResult(
+            x=tracker.best_params,
+            fun=tracker.best_score,
+            success=False,
+            message="Budget exhausted, returning the best result so far",
+        )
+
+    def _minimize(self, objective, initial_guess, bounds, constraints, args, tol):
+        return minimize(
+            objective,
+            initial_guess,
+            bounds=bounds,
+            constraints=constraints,
+            args=args,
+            method="SLSQP",
+            tol=tol,
+            options={"maxiter": 5000},
+        )
+
+    def _polish(self, objective, result, bounds, constraints, args, tol):
+        """
+        Refines a result found with a fast engine by the exact RK45 integration.
+        """
+        engine = self.model.engine
+        self.model.engine = RK45Engine()
+        try:
+            return self._minimize(objective, result.x, bounds, constraints, args, tol)
+        finally:
+            self.model.engine = engine
+
+    def fit(
+        self,
+        cases,
+        deaths,
+        population,
+        generate_guesses=None,
+        budget=None,
+        polish=False,
+        initial_guess=None,
+        tol=1e-10,
+        key=None,
+    ):
+        """
+        Fits the model parameters with SLSQP from one or several initial guesses.
+        A given initial_guess (a warm start) replaces the generated ones,
+        warm started refits can use a looser tolerance.
+        With a FitStore and a key the result is saved together with
+        the state trajectory over the data days.
+        An optional FitBudget bounds the time, objective and RHS calls.
+        With polish=True the best result of a non-RK45 engine is refined
+        with the RK45 engine (the returned loss is the RK45 one).
+        The returned OptimizeResult has additional fields:
+            budget_status = "completed" or the name of the exhausted limit
+            trace = objective values in evaluation order
+            nrhs = number of RHS calls (counted for RHS-watching budgets)
+            elapsed = wall-clock seconds spent
+            profile = FitInstrumentation record (with instrumentation only)
+        """
+        if initial_guess is not None:
+            initial_guesses = [initial_guess]
+        elif generate_guesses is None:
             initial_guesses = [[x[0] for x in self.states.values()]]
         else:
             initial_guesses = [
                 np.linspace(x[1][0], x[1][1], generate_guesses)
-                for x in DEFAULT_STATES.values()
+                for x in self.states.values()
             ]
             initial_guesses = np.array(initial_guesses).transpose()
 
@@ -148,23 +252,148 @@ class CompartmentalOptimizer:
             return x[3] - x[4]
 
         cons = NonlinearConstraint(constraint, 1.0, 10.0)
+        tracker = BudgetTracker(budget, lambda x: 1.0 <= constraint(x) <= 10.0)
+        objective = tracker.wrap_objective(self.model_fn)
+        ode_function = self.model.model
+        self.model.model = tracker.wrap_rhs(ode_function)
+        profile = None
+        if self.instrumentation is not None:
+            profile = self.instrumentation.start()
+            self.model.profile = profile
+
+        args = (cases, deaths, population, False)
         best = (10000, None)
-        for initial_guess in initial_guesses:
-            result = minimize(
-                self.model_fn,
-                initial_guess,
-                bounds=bounds,
-                constraints=cons,
-                args=(cases, deaths, population, False),
-                method="SLSQP",
-                tol=1e-10,
-                options={"maxiter": 5000},
-            )
-            if result.fun < best[0]:
+        status = "completed"
+        try:
+            for initial_guess in initial_guesses:
+                result = self._minimize(
+                    objective, initial_guess, bounds, cons, args, tol
+                )
+                if result.fun < best[0]:
+                    best = (result.fun, result)
+            if polish and best[1] is not None and self.model.engine.name != "rk45":
+                result = self._polish(objective, best[1], bounds, cons, args, tol)
                 best = (result.fun, result)
+        except BudgetExhausted as error:
+            status = error.reason
+            best = (
+                tracker.best_score,
+                self._budget_result(tracker, initial_guesses[0]),
+            )
+        finally:
+            self.model.model = ode_function
+            self.model.profile = None
 
-        return best[1]
+        result = best[1]
+        if result is not None:
+            result.budget_status = status
+            result.trace = np.array(tracker.trace)
+            result.nrhs = tracker.rhs_calls
+            result.elapsed = tracker.elapsed()
+            if self.store is not None and key is not None:
+                trajectory = self._trajectory(
+                    result.x, cases[0], population, len(cases)
+                )
+                fingerprint = self._fingerprint(cases, deaths, population)
+                self.store.save(key, result.x, result.fun, fingerprint, trajectory)
+        if profile is not None:
+            record = self.instrumentation.finish(
+                profile, result, key, self.model.engine.name
+            )
+            if result is not None:
+                result.profile = record
+        return result
+
+    def _fingerprint(self, cases, deaths, population):
+        """
+        Store fingerprint: a trajectory is only valid for the same data
+        and the same engine, reproduction model and optimized days.
+        """
+        model = self.model
+        settings = settings_hash(model.engine, model.reproduction, model.optim_days)
+        return data_hash(cases, deaths, population, settings)
 
-    def predict(self, params, cases, deaths, population, horizon=10):
+    def _trajectory(self, params, n_infected, population, days):
+        args = self.model._get_optimization_args(params)
+        return self.model._solve_ode(args, population, n_infected, days).y
+
+    def _extend_trajectory(self, params, trajectory, population, days):
+        """
+        Continues a stored trajectory from its last state up to the days.
+        """
+        R_t, *args = self.model._get_optimization_args(params)
+        offset = trajectory.shape[1] - 1
+
+        def shifted_reproduction(t):
+            return R_t(t + offset)
+
+        solution = self.model.engine(
+            self.model.model,
+            (shifted_reproduction,) + tuple(args),
+            trajectory[:, -1],
+            days - offset,
+        )
+        return np.concatenate([trajectory, solution.y[:, 1:]], axis=1)
+
+    def _stored_prediction(self, params, cases, deaths, population, horizon, key):
+        fingerprint = self._fingerprint(cases, deaths, population)
+        days = len(cases) + horizon
+        record = self.store.find(key, params, fingerprint)
+        if record is None:
+            trajectory = self._trajectory(params, cases[0], population, days)
+            self.store.save(key, params, np.nan, fingerprint, trajectory)
+        else:
+            trajectory = record["trajectory"]
+            if trajectory.shape[1] < days:
+                trajectory = self._extend_trajectory(
+                    params, trajectory, population, days
+                )
+                self.store.save(key, params, record["loss"], fingerprint, trajectory)
+        solution = DailySolution(trajectory[:, :days])
+        return self.model._get_predictions(solution, population)
+
+    def predict(self, params, cases, deaths, population, horizon=10, key=None):
+        """
+        Returns predicted cases and deaths for the data days and the horizon.
+        With a FitStore and a key the stored trajectory is reused
+        and extended from its last state for longer horizons.
+        """
+        if self.store is not None and key is not None:
+            return self._stored_prediction(
+                params, cases, deaths, population, horizon, key
+            )
         predicted = self.model_fn(params, cases, deaths, population, horizon)
         return predicted
+
+    def predict_intervals(
+        self,
+        params,
+        cases,
+        deaths,
+        population,
+        horizon=10,
+        quantiles=(0.05, 0.5, 0.95),
+        n_simulations=10000,
+        seed=None,
+    ):
+        """
+        Forecast quantile bands from the chain binomial SEIR_HCD simulations.
+        Simulations start from the fitted deterministic state
+        on the last day of data and run for the horizon days.
+        Returns a dictionary with (len(quantiles), horizon) arrays
+        of cumulative "cases" and "deaths".
+        """
+        args = self.model._get_optimization_args(params)
+        days = len(cases)
+        solution = self.model._solve_ode(args, population, cases[0], days)
+        last_state = solution.y[:, -1] * population
+
+        simulator = StochasticSEIR_HCD(n_simulations, seed=seed)
+        sim_cases, sim_deaths = simulator.simulate(
+            args, last_state, horizon, start_time=days - 1
+        )
+        return {
+            "quantiles": np.array(quantiles),
+            "cases": quantile_bands(sim_cases[1:], quantiles),
+            "deaths": quantile_bands(sim_deaths[1:], quantiles),
+        }
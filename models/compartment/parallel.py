@@ -0,0 +1,31 @@
+from ..parallel import run_tasks
+
+
+def _fit_one(task):
+    optimizer, code, cases, deaths, population, fit_args = task
+    return code, optimizer.fit(cases, deaths, population, key=code, **fit_args)
+
+
+def fit_many(optimizer, splits, populations, workers=None, **fit_args):
+    """
+    Fits every series of the splits in a process pool.
+        splits = (code, {"cases": array, "deaths": array}) pairs
+            as produced by model_per_country_simple_split
+        populations = mapping from codes to populations
+        fit_args = additional CompartmentalOptimizer.fit arguments
+    Every fit gets its code as the key (FitStore, FitInstrumentation records).
+    Returns a dictionary of fit results by code.
+    """
+    tasks = [
+        (
+            optimizer,
+            code,
+            series["cases"],
+            series["deaths"],
+            populations[code],
+            fit_args,
+        )
+        for code, series in splits
+        if len(series["cases"]) > 0
+    ]
+    return dict(run_tasks(_fit_one, tasks, workers))
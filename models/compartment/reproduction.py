@@ -0,0 +1,97 @@
+import numpy as np
+
+DEFAULT_COVARIATES = [
+    "stringencyindexfordisplay",
+    "retail_and_recreation_percent_change_from_baseline",
+    "workplaces_percent_change_from_baseline",
+    "residential_percent_change_from_baseline",
+]
+
+
+class HillDecay:
+    """
+    Reproduction number decayed by the Hill function: R_0 / (1 + (t / L) ** k).
+    """
+
+    states = {
+        "k": [2, (1, 10)],
+        "L": [2, (1, 100)],
+    }
+
+    def __call__(self, R_0, params):
+        k, L = params
+
+        def time_varying_reproduction(t):
+            return R_0 / (1 + (t / L) ** k)
+
+        return time_varying_reproduction
+
+
+class GridReproduction:
+    """
+    Reproduction number precomputed on a daily grid.
+    Values between days are linearly interpolated with a constant time lookup,
+    times outside of the grid keep the first or the last value.
+    A (days, n_regions) grid gives an array of values per region.
+    """
+
+    def __init__(self, values):
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 1:
+            # python floats are faster to index than numpy scalars
+            slopes = [float(x) for x in np.diff(values)] + [0.0]
+            values = [float(x) for x in values]
+        else:
+            slopes = list(np.diff(values, axis=0)) + [np.zeros(values.shape[1:])]
+            values = list(values)
+        self.pairs = list(zip(values, slopes))
+        self.first, self.last = values[0], values[-1]
+        self.last_day = len(values) - 1
+
+    def __call__(self, t):
+        # solvers pass numpy times, python float arithmetic is faster
+        t = float(t)
+        if 0 < t < self.last_day:
+            day = int(t)
+            value, slope = self.pairs[day]
+            return value + slope * (t - day)
+        return self.first if t <= 0 else self.last
+
+
+class CovariateReproduction:
+    """
+    Reproduction number driven by daily covariates
+    (government response stringency, mobility changes)
+    through a log-linear link: R_t = R_0 * exp(-covariates(t) @ beta).
+    Covariates are aligned with the fitted series, day 0 being the first day.
+    Days after the last covariate row keep the last known value.
+    Arrays of R_0 and of the coefficients (joint fits) give a value per region,
+    all regions share the covariates.
+    """
+
+    def __init__(self, covariates, names=None, bounds=(-5, 5)):
+        covariates = np.asarray(covariates, dtype=float)
+        if covariates.ndim == 1:
+            covariates = covariates[:, None]
+        if names is None:
+            names = [f"covariate_{x}" for x in range(covariates.shape[1])]
+        if len(names) != covariates.shape[1]:
+            raise ValueError("Wrong number of covariate names")
+        self.covariates = covariates
+        self.states = {f"beta_{name}": [0, bounds] for name in names}
+
+    def __call__(self, R_0, params):
+        values = R_0 * np.exp(-self.covariates @ np.asarray(params, dtype=float))
+        return GridReproduction(values)
+
+
+def covariates_from_frame(data, columns=None):
+    """
+    Builds a covariate matrix from the world timeseries rows of one country.
+    Percent values are scaled to fractions, gaps are filled
+    with the previous value and then with zeros.
+    """
+    if columns is None:
+        columns = DEFAULT_COVARIATES
+    covariates = data[columns].fillna(method="ffill").fillna(0) / 100
+    return covariates.values
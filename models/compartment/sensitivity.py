@@ -0,0 +1,131 @@
+from .engines import DailyEngine
+import numpy as np
+import pandas as pd
+
+
+def evaluate_batch(optimizer, samples, n_infected, population, days, batch_size=4096):
+    """
+    Predicted cases and deaths for many parameter sets at once.
+    Parameter sets are rows of the samples array, the fixed step daily engine
+    integrates a whole batch of them in one vectorized recurrence.
+    The reproduction model has to accept parameter arrays (HillDecay does).
+    Returns two (n_samples, days) arrays.
+    """
+    model = optimizer.model
+    engine = DailyEngine()
+    pred_cases, pred_fatal = [], []
+    for start in range(0, len(samples), batch_size):
+        batch = samples[start : start + batch_size].transpose()
+        args = model._get_optimization_args(batch)
+        solution = model._solve_ode(args, population, n_infected, days, engine)
+        batch_cases, batch_fatal = model._get_predictions(solution, population)
+        pred_cases.append(batch_cases.transpose())
+        pred_fatal.append(batch_fatal.transpose())
+    return np.concatenate(pred_cases), np.concatenate(pred_fatal)
+
+
+def _scale(unit_samples, states):
+    bounds = np.array([x[1] for x in states.values()], dtype=float)
+    return bounds[:, 0] + unit_samples * (bounds[:, 1] - bounds[:, 0])
+
+
+def _forecast_outputs(optimizer, samples, cases, population, horizon):
+    """
+    Log forecasts of cases and deaths at the end of the horizon.
+    """
+    days = len(cases) + horizon
+    pred_cases, pred_fatal = evaluate_batch(
+        optimizer, samples, cases[0], population, days
+    )
+    return {
+        "cases": np.log1p(pred_cases[:, -1]),
+        "deaths": np.log1p(pred_fatal[:, -1]),
+    }
+
+
+def sobol_indices(optimizer, cases, population, horizon=14, n_samples=1024, seed=None):
+    """
+    First order (S1) and total (ST) Sobol indices of the forecasted
+    cases and deaths by the Saltelli sampling scheme with the Jansen
+    estimator of total effects. Parameters are sampled uniformly
+    within the optimizer state bounds, n_samples * (n_params + 2)
+    parameter sets are evaluated in batches.
+    Returns a dataframe indexed by parameter names.
+    """
+    names = list(optimizer.states.keys())
+    n_params = len(names)
+    random = np.random.RandomState(seed)
+    A = random.rand(n_samples, n_params)
+    B = random.rand(n_samples, n_params)
+    AB = np.repeat(A[None], n_params, axis=0)
+    AB[np.arange(n_params), :, np.arange(n_params)] = B.transpose()
+
+    unit_samples = np.concatenate([A, B, AB.reshape(-1, n_params)])
+    samples = _scale(unit_samples, optimizer.states)
+    outputs = _forecast_outputs(optimizer, samples, cases, population, horizon)
+
+    report = {}
+    for key, values in outputs.items():
+        f_A = values[:n_samples]
+        f_B = values[n_samples : 2 * n_samples]
+        f_AB = values[2 * n_samples :].reshape(n_params, n_samples)
+        variance = np.var(np.concatenate([f_A, f_B]))
+        report[f"{key}_S1"] = np.mean(f_B * (f_AB - f_A), axis=1) / variance
+        report[f"{key}_ST"] = 0.5 * np.mean((f_A - f_AB) ** 2, axis=1) / variance
+    return pd.DataFrame(report, index=pd.Index(names, name="parameter"))
+
+
+def morris_indices(
+    optimizer, cases, population, horizon=14, trajectories=100, levels=4, seed=None
+):
+    """
+    Morris elementary effects screening of the forecasted cases and deaths.
+    Every trajectory changes one parameter at a time by a fixed step
+    in random order, (n_params + 1) * trajectories parameter sets
+    are evaluated in batches. Effects are measured in units of the bounds.
+    Returns a dataframe with mu_star (mean absolute effect)
+    and sigma (effect deviation) columns indexed by parameter names.
+    """
+    names = list(optimizer.states.keys())
+    n_params = len(names)
+    random = np.random.RandomState(seed)
+    delta = levels / (2 * (levels - 1))
+    base = random.randint(0, levels // 2, (trajectories, n_params)) / (levels - 1)
+    order = np.argsort(random.rand(trajectories, n_params), axis=1)
+
+    points = np.repeat(base[:, None], n_params + 1, axis=1)
+    rows = np.arange(trajectories)
+    for step in range(n_params):
+        points[rows, step + 1 :, order[:, step]] += delta
+
+    samples = _scale(points.reshape(-1, n_params), optimizer.states)
+    outputs = _forecast_outputs(optimizer, samples, cases, population, horizon)
+
+    report = {}
+    for key, values in outputs.items():
+        values = values.reshape(trajectories, n_params + 1)
+        effects = np.empty((trajectories, n_params))
+        effects[rows[:, None], order] = np.diff(values, axis=1) / delta
+        report[f"{key}_mu_star"] = np.abs(effects).mean(0)
+        report[f"{key}_sigma"] = effects.std(0)
+    return pd.DataFrame(report, index=pd.Index(names, name="parameter"))
+
+
+def sensitivity_report(optimizer, splits, populations, method="sobol", **kwargs):
+    """
+    Sensitivity indices for every country (or region) of the splits,
+    as produced by model_per_country_simple_split with a "cases" target.
+    Returns a dataframe indexed by (country_code, parameter).
+    """
+    if method == "sobol":
+        indices = sobol_indices
+    elif method == "morris":
+        indices = morris_indices
+    else:
+        raise ValueError(f"Wrong sensitivity method {method}")
+    reports = {
+        code: indices(optimizer, series["cases"], populations[code], **kwargs)
+        for code, series in splits
+        if len(series["cases"]) > 0
+    }
+    return pd.concat(reports, names=["country_code"])
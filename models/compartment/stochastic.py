@@ -0,0 +1,81 @@
+import numpy as np
+
+
+class StochasticSEIR_HCD:
+    """
+    Chain binomial version of the SEIR_HCD model.
+    Every step moves a binomial number of people between compartments
+    with the transition probabilities 1 - exp(-rate * step).
+    All realizations are simulated at once as (n_simulations,) arrays.
+    Uses the same arguments as the SEIR_HCD model function:
+        (R_t, t_inc, t_inf, t_hosp, t_crit, mild, critical, fatal)
+    """
+
+    def __init__(self, n_simulations=10000, substeps=1, seed=None):
+        self.n_simulations = n_simulations
+        self.substeps = substeps
+        self.random = np.random.RandomState(seed)
+
+    def _leaving(self, compartment, probability):
+        return self.random.binomial(compartment, probability)
+
+    def simulate(self, args, initial_state, days, start_time=0):
+        """
+        Simulates days after the initial state given in people counts.
+        Returns (days + 1, n_simulations) arrays of cumulative cases
+        and deaths, the first row being the initial state.
+        """
+        R_t, t_inc, t_inf, t_hosp, t_crit, mild, critical, fatal = args
+        if not callable(R_t):
+            constant_reproduction = R_t
+
+            def R_t(t):
+                return constant_reproduction
+
+        step = 1 / self.substeps
+        incubated = 1 - np.exp(-step / t_inc)
+        infectious_end = 1 - np.exp(-step / t_inf)
+        hospital_end = 1 - np.exp(-step / t_hosp)
+        critical_end = 1 - np.exp(-step / t_crit)
+
+        # deterministic solutions can slightly undershoot zero
+        counts = [max(int(round(x)), 0) for x in initial_state]
+        population = sum(counts)
+        S, E, I, _, H, C, D = [
+            np.full(self.n_simulations, x, dtype=np.int64) for x in counts
+        ]
+        cases = np.empty((days + 1, self.n_simulations), dtype=np.int64)
+        deaths = np.empty((days + 1, self.n_simulations), dtype=np.int64)
+        cases[0] = population - S - E
+        deaths[0] = D
+
+        time_step = start_time
+        for day in range(1, days + 1):
+            for _ in range(self.substeps):
+                force = R_t(time_step) / t_inf * I / population
+                new_exposed = self._leaving(S, 1 - np.exp(-force * step))
+                new_infected = self._leaving(E, incubated)
+                left_infected = self._leaving(I, infectious_end)
+                new_hospitalized = self._leaving(left_infected, 1 - mild)
+                left_hospital = self._leaving(H, hospital_end)
+                new_critical = self._leaving(left_hospital, critical)
+                left_critical = self._leaving(C, critical_end)
+                new_dead = self._leaving(left_critical, fatal)
+
+                S = S - new_exposed
+                E = E + new_exposed - new_infected
+                I = I + new_infected - left_infected
+                H = H + new_hospitalized - left_hospital + left_critical - new_dead
+                C = C + new_critical - left_critical
+                D = D + new_dead
+                time_step += step
+            cases[day] = population - S - E
+            deaths[day] = D
+        return cases, deaths
+
+
+def quantile_bands(values, quantiles):
+    """
+    Returns (len(quantiles), days) bands from (days, n_simulations) values.
+    """
+    return np.quantile(values, quantiles, axis=1)
@@ -0,0 +1,95 @@
+import hashlib
+import os
+import numpy as np
+
+
+def data_hash(cases, deaths, population, settings=""):
+    """
+    Fingerprint of the data a model was fitted to
+    and of the model settings (see settings_hash).
+    """
+    digest = hashlib.sha1()
+    for values in (cases, deaths, [population]):
+        digest.update(np.ascontiguousarray(values, dtype=float).tobytes())
+    digest.update(settings.encode())
+    return digest.hexdigest()
+
+
+def settings_hash(*components):
+    """
+    Fingerprint of the model settings: class names and attributes
+    of the components (engine, reproduction model) or plain values.
+    """
+    digest = hashlib.sha1()
+    for component in components:
+        digest.update(type(component).__name__.encode())
+        attributes = getattr(component, "__dict__", {"value": component})
+        for name, value in sorted(attributes.items()):
+            digest.update(name.encode())
+            if isinstance(value, np.ndarray):
+                digest.update(np.ascontiguousarray(value).tobytes())
+            else:
+                digest.update(repr(value).encode())
+    return digest.hexdigest()
+
+
+class FitStore:
+    """
+    On-disk storage of fit results, one compressed numpy archive per key
+    (country or region code) with the parameters, the loss, the hash
+    of the data and the model settings (engine, reproduction model,
+    optimized days) and the full state trajectory in fractions of population.
+    Loaded records are kept in memory for repeated predictions.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.records = {}
+        os.makedirs(root, exist_ok=True)
+
+    def __getstate__(self):
+        # process pool tasks get the store without the loaded records,
+        # workers read the records they need from disk
+        state = dict(self.__dict__)
+        state["records"] = {}
+        return state
+
+    def _filename(self, key):
+        return f"{self.root}/{key}.npz"
+
+    def save(self, key, params, loss, fingerprint, trajectory):
+        record = {
+            "parameters": np.asarray(params, dtype=float),
+            "loss": np.float64(loss),
+            "data_hash": np.array(fingerprint),
+            "trajectory": np.asarray(trajectory, dtype=float),
+        }
+        np.savez_compressed(self._filename(key), **record)
+        self.records[key] = record
+
+    def load(self, key):
+        """
+        Returns the stored record as a dictionary or None.
+        """
+        if key in self.records:
+            return self.records[key]
+        filename = self._filename(key)
+        if not os.path.exists(filename):
+            return None
+        with np.load(filename) as archive:
+            record = {name: archive[name] for name in archive.files}
+        self.records[key] = record
+        return record
+
+    def find(self, key, params, fingerprint):
+        """
+        Returns the stored record only if it matches the parameters and data.
+        """
+        record = self.load(key)
+        if record is None:
+            return None
+        if str(record["data_hash"]) != fingerprint:
+            return None
+        if not np.array_equal(record["parameters"], np.asarray(params, dtype=float)):
+            return None
+        return record
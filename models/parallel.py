@@ -0,0 +1,15 @@
+from concurrent.futures import ProcessPoolExecutor
+
+
+def run_tasks(function, tasks, workers=None, executor=None):
+    """
+    Maps the function over the tasks in a process pool
+    (all CPUs by default, 1 runs in place).
+    An open executor is reused instead of starting a new pool.
+    """
+    if executor is not None:
+        return list(executor.map(function, tasks))
+    if workers == 1:
+        return [function(task) for task in tasks]
+    with ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(function, tasks))
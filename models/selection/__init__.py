@@ -1 +1,2 @@
 from .simple_split import model_per_country_simple_split
+from .group_split import GroupSplitter
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+
+class GroupSplitter:
+    """
+    Splits a long dataframe into per group (country, region) arrays.
+    Rows are filtered and sorted once, target columns are gathered once
+    and every group is then a contiguous slice between precomputed offsets,
+    so accessing a group does not copy or search the data.
+        targets = columns to extract, rows with the first target
+            not above zero are dropped when positive is True
+        index = column with group codes, the dataframe index by default
+        sort_by = column to order rows by within every group
+    """
+
+    def __init__(self, data, targets, index=None, sort_by="date", positive=True):
+        keys = data.index.values if index is None else data[index].values
+        mask = np.ones(len(data), dtype=bool)
+        if positive:
+            mask = data[targets[0]].values > 0
+        keys = keys[mask]
+
+        # group codes in order of appearance, sort values by their rank
+        group_ids, self.groups = pd.factorize(keys)
+        sort_ranks = pd.factorize(data[sort_by].values[mask], sort=True)[0]
+        order = np.lexsort((sort_ranks, group_ids))
+
+        self.targets = list(targets)
+        self.columns = {
+            target: data[target].values[mask][order] for target in self.targets
+        }
+        counts = np.bincount(group_ids, minlength=len(self.groups))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.positions = {code: position for position, code in enumerate(self.groups)}
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __contains__(self, code):
+        return code in self.positions
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def get(self, code, start=0, end=None):
+        """
+        Returns {target: array view} of a group, optionally of the
+        [start, end) rows only (negative values count from the group end).
+        """
+        position = self.positions[code]
+        group_start, group_end = self.offsets[position], self.offsets[position + 1]
+        start, end, _ = slice(start, end).indices(group_end - group_start)
+        rows = slice(group_start + start, group_start + end)
+        return {target: self.columns[target][rows] for target in self.targets}
+
+    def split(self, min_length=1):
+        """
+        Yields (code, {target: array view}) for groups of at least min_length rows.
+        """
+        lengths = self.lengths()
+        for position, code in enumerate(self.groups):
+            if lengths[position] < min_length:
+                continue
+            rows = slice(self.offsets[position], self.offsets[position + 1])
+            yield code, {target: self.columns[target][rows] for target in self.targets}
+
+    def train_test_split(self, test_days, train_days=None, min_length=None):
+        """
+        Yields (code, train, test) with the last test_days rows of every group
+        as the test window and up to train_days rows before it for training.
+        Groups shorter than min_length (test_days + 1 by default) are skipped.
+        """
+        if min_length is None:
+            min_length = test_days + 1
+        for code, columns in self.split(min_length):
+            length = len(columns[self.targets[0]])
+            train_end = length - test_days
+            train_start = 0 if train_days is None else max(0, train_end - train_days)
+            train = {
+                key: value[train_start:train_end] for key, value in columns.items()
+            }
+            test = {key: value[train_end:] for key, value in columns.items()}
+            yield code, train, test
@@ -1,10 +1,12 @@
-def model_per_country_simple_split(data, targets, index=None, sort_by="date"):
-    data_copy = data.copy()
-    if index is not None:
-        data_copy = data_copy.set_index(index)
-    data_copy = data_copy.query(f"{targets[0]} > 0").sort_values(sort_by)
+from .group_split import GroupSplitter
 
-    return (
-        (code, {target: data_copy.loc[code, target].values for target in targets})
-        for code in data.index.unique()
-    )
+
+def model_per_country_simple_split(
+    data, targets, index=None, sort_by="date", min_length=1
+):
+    """
+    Yields (code, {target: values}) per country sorted by date,
+    dropping rows where the first target is not above zero.
+    """
+    splitter = GroupSplitter(data, targets, index=index, sort_by=sort_by)
+    return splitter.split(min_length)
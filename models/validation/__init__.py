@@ -1 +1,3 @@
 from .validate import get_validation_results
+from .backtest import rolling_origin_backtest
+from .submission import write_submission
@@ -0,0 +1,122 @@
+from ..parallel import run_tasks
+from .validate import ale
+import numpy as np
+import pandas as pd
+
+
+def forecast_origins(length, min_train=21, step=7, min_horizon=1):
+    """
+    Training lengths (forecast origins) of a rolling-origin evaluation.
+    """
+    return list(range(min_train, length - min_horizon + 1, step))
+
+
+def _backtest_chain(task):
+    """
+    Fits consecutive origins of one series, every fit is warm started
+    from the previous origin result.
+    """
+    optimizer, code, series, population, origins, horizons, fit_args = task
+    cases, deaths = series["cases"], series["deaths"]
+    dates = series.get("date")
+    max_horizon = max(horizons)
+    rows = []
+    params = None
+    for origin in origins:
+        result = optimizer.fit(
+            cases[:origin],
+            deaths[:origin],
+            population,
+            initial_guess=params,
+            **fit_args,
+        )
+        params = result.x
+        pred_cases, pred_fatal = optimizer.predict(
+            params, cases[:origin], deaths[:origin], population, max_horizon
+        )
+        for horizon in sorted(set(horizons)):
+            day = origin + horizon - 1
+            if day >= len(cases):
+                break
+            rows.append(
+                [
+                    code,
+                    origin if dates is None else dates[origin - 1],
+                    horizon,
+                    result.fun,
+                    cases[day],
+                    pred_cases[day],
+                    deaths[day],
+                    pred_fatal[day],
+                ]
+            )
+    return rows
+
+
+def _chunks(origins, n_chunks):
+    n_chunks = max(1, min(n_chunks, len(origins)))
+    return [list(chunk) for chunk in np.array_split(origins, n_chunks)]
+
+
+def rolling_origin_backtest(
+    optimizer,
+    splits,
+    populations,
+    horizons=(1, 7, 14),
+    min_train=21,
+    step=7,
+    workers=None,
+    origin_chunks=1,
+    **fit_args,
+):
+    """
+    Measures how the model would have done at past forecast origins.
+    Every series of the splits is fitted on its first days up to each origin
+    and the forecasts are scored at the horizons with the absolute log error.
+        splits = (code, {"cases": array, "deaths": array}) pairs as produced
+            by model_per_country_simple_split, an optional "date" target
+            labels origins with the last training date instead of its length
+        populations = mapping from codes to populations
+        origin_chunks = parallel warm started chains of origins per series
+        fit_args = additional CompartmentalOptimizer.fit arguments
+            (a FitBudget, a looser tol for warm starts)
+    Chains of origins for all series run in a process pool of workers.
+    Returns a dataframe with a row per (code, origin, horizon).
+    """
+    tasks = []
+    for code, series in splits:
+        origins = forecast_origins(len(series["cases"]), min_train, step)
+        if len(origins) == 0:
+            continue
+        for chunk in _chunks(origins, origin_chunks):
+            tasks.append(
+                (
+                    optimizer,
+                    code,
+                    series,
+                    populations[code],
+                    chunk,
+                    horizons,
+                    fit_args,
+                )
+            )
+
+    rows = [
+        row for chain in run_tasks(_backtest_chain, tasks, workers) for row in chain
+    ]
+    scores = pd.DataFrame(
+        rows,
+        columns=[
+            "code",
+            "origin",
+            "horizon",
+            "loss",
+            "cases",
+            "predicted_cases",
+            "deaths",
+            "predicted_deaths",
+        ],
+    )
+    scores["cases_ale"] = ale(scores["cases"], scores["predicted_cases"])
+    scores["deaths_ale"] = ale(scores["deaths"], scores["predicted_deaths"])
+    return scores
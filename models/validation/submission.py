@@ -0,0 +1,159 @@
+from concurrent.futures import ProcessPoolExecutor
+from ..parallel import run_tasks
+import numpy as np
+import pandas as pd
+
+SUBMISSION_COLUMNS = [
+    "date",
+    "region",
+    "country",
+    "prediction_confirmed",
+    "prediction_deaths",
+]
+
+
+def _forecast_window(task):
+    """
+    Predictions of one series for the days of the [start, end] range.
+    """
+    optimizer, code, params, series, population, start, end = task
+    cases, deaths = series["cases"], series["deaths"]
+    first_date = np.datetime64(pd.Timestamp(series["date"][0]).date())
+    last_date = first_date + np.timedelta64(len(cases) - 1, "D")
+    horizon = max(int((end - last_date) / np.timedelta64(1, "D")), 1)
+    pred_cases, pred_fatal = optimizer.predict(
+        params, cases, deaths, population, horizon, key=code
+    )
+    first = max(int((start - first_date) / np.timedelta64(1, "D")), 0)
+    last = int((end - first_date) / np.timedelta64(1, "D")) + 1
+    # a series starting after the end has no days in the range
+    last = max(last, first)
+    dates = first_date + np.arange(first, last)
+    return code, dates, pred_cases[first:last], pred_fatal[first:last]
+
+
+def _submission_chunk(forecasts, countries):
+    lengths = [len(dates) for _, dates, _, _ in forecasts]
+    codes = [code for code, _, _, _ in forecasts]
+    if countries is None:
+        country = codes
+    elif isinstance(countries, str):
+        country = [countries] * len(codes)
+    else:
+        country = [countries[code] for code in codes]
+    columns = {
+        "date": np.concatenate([x[1] for x in forecasts]).astype(str),
+        "region": np.repeat(codes, lengths),
+        "country": np.repeat(country, lengths),
+        "prediction_confirmed": np.concatenate([x[2] for x in forecasts]),
+        "prediction_deaths": np.concatenate([x[3] for x in forecasts]),
+    }
+    for column in ["prediction_confirmed", "prediction_deaths"]:
+        columns[column] = np.round(columns[column]).astype(np.int64)
+    return columns
+
+
+def _chunks(splits, size):
+    chunk = []
+    for split in splits:
+        chunk.append(split)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def _write_csv(chunks, filename):
+    n_rows = 0
+    with open(filename, "w") as handle:
+        handle.write("," + ",".join(SUBMISSION_COLUMNS) + "\n")
+        for columns in chunks:
+            length = len(columns["date"])
+            frame = pd.DataFrame(
+                columns,
+                columns=SUBMISSION_COLUMNS,
+                index=np.arange(n_rows, n_rows + length),
+            )
+            frame.to_csv(handle, header=False)
+            n_rows += length
+    return n_rows
+
+
+def _write_parquet(chunks, filename):
+    """
+    Appends every chunk as a row group, only one chunk is kept in memory.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [
+            ("date", pa.string()),
+            ("region", pa.string()),
+            ("country", pa.string()),
+            ("prediction_confirmed", pa.int64()),
+            ("prediction_deaths", pa.int64()),
+        ]
+    )
+    n_rows = 0
+    with pq.ParquetWriter(filename, schema) as writer:
+        for columns in chunks:
+            frame = pd.DataFrame(columns, columns=SUBMISSION_COLUMNS)
+            writer.write_table(
+                pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+            )
+            n_rows += len(frame)
+    return n_rows
+
+
+def write_submission(
+    optimizer,
+    results,
+    splits,
+    populations,
+    filename,
+    start,
+    end,
+    countries=None,
+    workers=None,
+    chunk_size=1000,
+):
+    """
+    Writes forecasts of all fitted series in the submission format
+    (see auxiliary_files/submission_example.csv) for the [start, end] dates.
+        results = fit results by code as returned by fit_many
+        splits = (code, {"cases": array, "deaths": array, "date": array}) pairs
+            as produced by model_per_country_simple_split
+        populations = mapping from codes to populations
+        filename = csv or parquet file (needs pyarrow), both are written
+            in chunks as they are forecasted
+        countries = country code of all series, a mapping from series
+            codes to country codes or None to use the series codes
+    Series are forecasted in chunks of chunk_size in one process pool
+    of workers.
+    Returns the number of written rows.
+    """
+    start = np.datetime64(start, "D")
+    end = np.datetime64(end, "D")
+    if end < start:
+        raise ValueError(f"Wrong date range {start} - {end}")
+    tasks = (
+        (optimizer, code, results[code].x, series, populations[code], start, end)
+        for code, series in splits
+        if code in results and len(series["cases"]) > 0
+    )
+    executor = None if workers == 1 else ProcessPoolExecutor(workers)
+    forecasts = (
+        _submission_chunk(
+            run_tasks(_forecast_window, chunk, workers, executor), countries
+        )
+        for chunk in _chunks(tasks, chunk_size)
+    )
+    try:
+        if filename.endswith(".parquet"):
+            return _write_parquet(forecasts, filename)
+        return _write_csv(forecasts, filename)
+    finally:
+        if executor is not None:
+            executor.shutdown()
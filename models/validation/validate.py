@@ -1,3 +1,4 @@
+from ..parallel import run_tasks
 import numpy as np
 import pandas as pd
 
@@ -9,29 +10,79 @@ def ale(true, predicted):
     return np.abs(np.log10((predicted + 1) / (true + 1)))
 
 
-def collect_scores(true_values, pred_df):
+def _read_submission(task):
+    filename, key, start, end = task
+    frame = pd.read_csv(
+        filename,
+        usecols=["date", key, "prediction_confirmed"],
+        dtype={"date": str, key: str},
+    )
+    if start is not None:
+        frame = frame[frame["date"] >= start]
+    if end is not None:
+        frame = frame[frame["date"] <= end]
+    return frame
+
+
+def read_submissions(filenames, start=None, end=None, key="region", workers=None):
     """
-    Collects log error scores between predicted and original dataframes.
+    Reads submission csv files in a process pool, keeping only the columns
+    needed for scoring and the rows of the [start, end] date range.
     """
-    csv_data = []
-    for index in true_values.index.unique():
-        if index not in pred_df.index:
-            continue
-        true_confirmed = true_values.loc[index]["confirmed"]
-        pred_confirmed = pred_df.loc[index]["prediction_confirmed"]
+    tasks = [(filename, key, start, end) for filename in filenames]
+    return run_tasks(_read_submission, tasks, workers)
+
 
-        csv_data.append(
-            [
-                index[0],
-                index[1],
-                true_values.loc[index]["geoname_code"],
-                ale(true_confirmed, pred_confirmed),
-            ]
+def score_submissions(true_values, predictions, key="region"):
+    """
+    Scores all predictions against the original values at once.
+    Submissions are stacked into one long frame, aligned with the original
+    values by a single join on (key, date) and scored with one ale call.
+        true_values = dataframe with key, date, confirmed and geoname_code columns
+        predictions = list of dataframes with key, date and
+            prediction_confirmed columns
+    Returns a dataframe indexed by (region_code, geoname_code, date)
+    with a column of scores per submission (NaN where it has no prediction).
+    """
+    if len(predictions) == 0:
+        index = pd.MultiIndex.from_arrays(
+            [[], [], []], names=["region_code", "geoname_code", "date"]
         )
+        return pd.DataFrame(index=index)
+    stacked = pd.concat(
+        [preds[[key, "date", "prediction_confirmed"]] for preds in predictions],
+        keys=range(len(predictions)),
+        names=["source", None],
+    ).reset_index(level="source")
+    stacked = stacked.drop_duplicates(["source", key, "date"], keep="last")
+
+    merged = stacked.merge(
+        true_values[[key, "date", "confirmed", "geoname_code"]],
+        on=[key, "date"],
+        how="inner",
+    )
+    merged["cases_male"] = ale(
+        merged["confirmed"].values, merged["prediction_confirmed"].values
+    )
+    scores = (
+        merged.rename(columns={key: "region_code"})
+        .set_index(["region_code", "geoname_code", "date", "source"])["cases_male"]
+        .unstack("source")
+        .reindex(columns=range(len(predictions)))
+    )
+    scores.columns.name = None
+    return scores.sort_index()
 
-    csv_data = pd.DataFrame(csv_data)
-    csv_data.columns = ["region_code", "date", "geoname_code", "cases_male"]
-    return csv_data.set_index(["region_code", "geoname_code", "date"])
+
+def collect_scores(true_values, pred_df):
+    """
+    Collects log error scores between predicted and original dataframes.
+    """
+    scores = score_submissions(
+        true_values.reset_index(), [pred_df.reset_index()], key="region"
+    )
+    scores.columns = ["cases_male"]
+    return scores.dropna()
 
 
 def get_validation_results(
@@ -43,40 +94,42 @@ def get_validation_results(
     key="region",
     name_col="csse_province_state",
     custom_ids=None,
+    workers=None,
 ):
     """
     Validates multiple predictions at a time for a specified date range.
         predictions = list of dataframes with predictions (submissions)
+            or of paths to submission csv files, read in parallel
         test_source = original data to compare with
         start = starting date in format "%Y-%m-%d"
         end = ending date in format "%Y-%m-%d"
-        summary_df = regions summary information dataframe
+        summary_df = regions summary information dataframe, used for
+            geoname codes missing from the original data
         key = column with region/country codes
-        name_col = column with region/country names
+        name_col = column with region/country names (not used in scores)
         custom_ids = None or list of strings with distinct team ids
+        workers = processes reading submission files (all CPUs by default)
     """
-    fixed_predictions = []
-    for prediction_df in predictions:
-        preds = prediction_df.copy()
-        preds["geoname_code"] = preds[key].apply(
-            lambda x: summary_df.loc[x, "geoname_code"]
-        )
-        preds["region_name"] = preds[key].apply(lambda x: summary_df.loc[x, name_col])
-        preds = preds.query(f'date >= "{start}" & date <= "{end}"').set_index(
-            ["region", "date"]
-        )
-        fixed_predictions.append(preds)
+    filenames = [x for x in predictions if isinstance(x, str)]
+    loaded = iter(read_submissions(filenames, start, end, key, workers))
+    predictions = [
+        next(loaded) if isinstance(x, str) else x.reset_index(drop=True)
+        for x in predictions
+    ]
+    predictions = [
+        preds[(preds["date"] >= start) & (preds["date"] <= end)]
+        for preds in predictions
+    ]
 
-    test_source["date"] = pd.to_datetime(test_source.date).dt.strftime("%Y-%m-%d")
-    true_values = (
-        test_source.query(f'date >= "{start}" & date <= "{end}"')
-        .reset_index()
-        .set_index(["region", "date"])
-    )
+    true_values = test_source.reset_index()
+    true_values["date"] = pd.to_datetime(true_values["date"]).dt.strftime("%Y-%m-%d")
+    true_values = true_values[
+        (true_values["date"] >= start) & (true_values["date"] <= end)
+    ].copy()
+    if "geoname_code" not in true_values:
+        true_values["geoname_code"] = true_values[key].map(summary_df["geoname_code"])
 
-    scores = pd.concat(
-        [collect_scores(true_values, preds) for preds in fixed_predictions], 1
-    )
+    scores = score_submissions(true_values, predictions, key)
     if custom_ids is None:
         scores.columns = [f"source_{x}" for x in range(len(scores.columns))]
     else:
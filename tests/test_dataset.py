@@ -1,5 +1,29 @@
+import os
+import json
 import yaml
-from data import DatasetManager
+from data import (
+    DatasetManager,
+    StageProfiler,
+    Transport,
+    FeatureStore,
+    DataQuality,
+    CSSEParser,
+    OxfordParser,
+)
+from data.csv_parsers.oxford_parser import OXFORD_COLUMNS
+from data.features import derive_features
+from benchmarks.upstream import build_upstream
+from benchmarks.suite import _offline_config
+from visualization.geometry import GeometryCache, resolve_geodata, simplify_geojson
+from visualization.export import FigureExporter
+from visualization.downsampling import lttb, line_traces
+from visualization.basic import plot_country_dynamic, plot_cases_map
+from visualization.cache import FigureCache
+from visualization.advanced import CustomOverviewGraph
+from models import model_per_country_simple_split
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
 import pytest
 import pandas as pd
 
@@ -102,3 +126,507 @@ class Test_dataset:
                 rus_timeline[rus_timeline["date"] == date].shape[0]
                 == dataframe["russia"]["by_region"].shape[0]
             )
+
+    def test_stage_profiler(self, config):
+        cached_config = dict(config, reload=False)
+        profiler = StageProfiler()
+        cached_manager = DatasetManager(cached_config, profiler)
+        frames = cached_manager.get_data()
+        cached_manager.get_data()
+
+        report = profiler.report()
+        assert list(report["run"].unique()) == [1, 2]
+        stage = report.set_index(["run", "stage"]).loc[
+            (1, "read world_confirmed_cases.csv")
+        ]
+        assert stage["rows_out"] == len(frames["world"]["by_date"])
+        assert stage["seconds"] > 0
+
+        summary = profiler.aggregate()
+        assert summary.loc["read rus_regions.csv", "runs"] == 2
+
+    def test_offline_pipeline(self, config, tmp_path):
+        offline_config = _offline_config(config, str(tmp_path))
+        build_upstream(config, offline_config["transport"]["archive"])
+        frames = DatasetManager(offline_config).get_data()
+
+        cached = DatasetManager(dict(config, reload=False)).get_data()
+        for source, key in [("world", "by_date"), ("russia", "by_date")]:
+            assert frames[source][key].shape[0] == cached[source][key].shape[0]
+        rus_data = frames["russia"]["by_date"]
+        last_date = rus_data["date"].max()
+        assert last_date == cached["russia"]["by_date"]["date"].max()
+        assert rus_data[rus_data["date"] == last_date]["confirmed"].notna().all()
+
+    def test_transport_replay(self, tmp_path, monkeypatch):
+        archive = str(tmp_path / "archive")
+        url = "https://example.com/report.csv"
+
+        class Response:
+            status_code = 200
+            content = "a,b\n1,2\n".encode()
+
+        monkeypatch.setattr("requests.get", lambda url: Response())
+        recorded = Transport("record", archive).get(url)
+
+        monkeypatch.setattr("requests.get", None)
+        replayed = Transport("replay", archive).get(url)
+        assert replayed.content == recorded.content
+        assert replayed.status_code == 200
+        with pytest.raises(ValueError):
+            Transport("replay", archive).get("https://example.com/missing.csv")
+        with pytest.raises(ValueError):
+            Transport("replay")
+
+    def test_geometry_cache(self, config, tmp_path):
+        cache = GeometryCache(config["auxiliary"]["geojson"], str(tmp_path))
+        sizes = cache.build()
+        assert sizes["full"] > sizes["high"] > sizes["medium"] > sizes["low"]
+
+        full, low = cache.get("full"), cache.get("low")
+        codes = [x["properties"]["HASC_1"] for x in full["features"]]
+        assert [x["properties"]["HASC_1"] for x in low["features"]] == codes
+        for feature in low["features"]:
+            geometry = feature["geometry"]
+            polygons = geometry["coordinates"]
+            if geometry["type"] == "Polygon":
+                polygons = [polygons]
+            for ring in [ring for polygon in polygons for ring in polygon]:
+                assert len(ring) >= 4 and ring[0] == ring[-1]
+
+        reloaded = GeometryCache(config["auxiliary"]["geojson"], str(tmp_path))
+        assert reloaded.get("low") == low
+        assert resolve_geodata(full, "low") is full
+        with pytest.raises(ValueError):
+            cache.get("lowest")
+
+    def test_shared_borders(self):
+        # a common wiggly border from (1, 0) to (1, 1), a corner of the left
+        # region and a part of a longer straight side of the right one
+        offsets = np.random.RandomState(0).uniform(-0.02, 0.02, 41)
+        border = [[1 + offsets[x], x / 40] for x in range(41)]
+        left = [[0, 0]] + border + [[0, 1], [0, 0]]
+        right = [[1, 2]] + border[::-1] + [[1, -1], [2, -1], [2, 2], [1, 2]]
+        geodata = {
+            "type": "FeatureCollection",
+            "features": [
+                {"type": "Feature", "geometry": {"type": "Polygon", "coordinates": x}}
+                for x in [[left], [right]]
+            ],
+        }
+        simplified = simplify_geojson(geodata, 0.02, 6)
+        left, right = [x["geometry"]["coordinates"][0] for x in simplified["features"]]
+        left_border = [x for x in left if x[0] > 0.5 and 0 < x[1] < 1]
+        right_border = [x for x in right if x[0] < 1.5 and 0 < x[1] < 1]
+        assert 0 < len(left_border) < len(border) - 2
+        assert left_border == right_border[::-1]
+
+    def test_overview_frames(self, config):
+        data = DatasetManager(dict(config, reload=False)).get_data()["russia"]
+        regions = data["by_region"].set_index("iso_code")
+        rus_data = data["by_date"]
+        with open(config["auxiliary"]["geojson"], encoding="utf-8") as f:
+            geodata = json.load(f)
+        dates = sorted(rus_data["date"].unique())[-5:]
+        fig = CustomOverviewGraph(regions, geodata).plot(rus_data, "confirmed", dates)
+
+        assert [frame.name for frame in fig.frames] == dates
+        assert fig.data[2].geojson is not None
+        for frame, date in zip(fig.frames, dates):
+            day = rus_data[rus_data["date"] == date]
+            bars, pop_map = frame.data[1], frame.data[2]
+            # the geometry stays in the figure trace
+            assert pop_map.geojson is None
+            assert "geojson" not in pop_map.to_plotly_json()
+            # hover text as it was looked up row by row
+            names = [regions.loc[x, "name_with_type"] for x in day["region"]]
+            assert list(pop_map.text) == names
+            assert list(pop_map.locations) == list(day["geoname_code"])
+            population = regions.loc[day["region"], "population"].values
+            assert np.allclose(pop_map.z, 100 * day["confirmed"].values / population)
+            top = day.sort_values(by="confirmed")[-15:]
+            names = [regions.loc[x, "name_with_type"] for x in top["region"]]
+            assert list(bars.text) == names
+            assert np.allclose(bars.y, np.log10(top["confirmed"].values))
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_figure_export(self, tmp_path, workers):
+        figures = {
+            f"figure_{x}": go.Figure(go.Scatter(x=[0, 1, 2], y=[x, x + 1, x]))
+            for x in range(5)
+        }
+        with FigureExporter(str(tmp_path), "json", workers, chunk_size=2) as exporter:
+            filenames = exporter.export(figures)
+            assert len(exporter.export(list(figures.items())[:1])) == 1
+        assert [x.split("/")[-1] for x in filenames] == [f"{x}.json" for x in figures]
+        restored = pio.read_json(filenames[3])
+        assert list(restored.data[0].y) == [3, 4, 3]
+
+    def test_png_export(self, tmp_path):
+        try:
+            pio.to_image(go.Figure(), format="png")
+        except ValueError as error:
+            pytest.skip(f"image renderer is not available: {error}")
+        figures = [
+            (f"figure_{x}", go.Figure(go.Scatter(x=[0, 1, 2], y=[x, x + 1, x])))
+            for x in range(4)
+        ]
+        with FigureExporter(str(tmp_path), "png", workers=2, chunk_size=1) as exporter:
+            filenames = exporter.export(figures[:2])
+            # the second call reuses the running renderer processes
+            executor = exporter.executor
+            filenames += exporter.export(figures[2:])
+            assert exporter.executor is executor
+        for filename in filenames:
+            with open(filename, "rb") as f:
+                assert f.read(8) == b"\x89PNG\r\n\x1a\n"
+
+    def test_downsampling(self):
+        x = np.arange(2000)
+        y = np.sin(x / 100)
+        y[1234] = 10
+        index = lttb(x, y, 100)
+        assert len(index) == 100 and index[0] == 0 and index[-1] == 1999
+        assert np.all(np.diff(index) > 0)
+        assert 1234 in index
+        assert len(lttb(x[:50], y[:50], 100)) == 50
+
+        dates = pd.date_range("2020-03-01", periods=300).astype(str)
+        data = pd.DataFrame(
+            {
+                "date": np.concatenate([dates, dates, dates[:40]]),
+                "region_name": ["A"] * 300 + ["B"] * 300 + ["C"] * 40,
+                "confirmed": np.arange(640, dtype=float) + 1,
+            }
+        )
+        traces = line_traces(data, "date", "confirmed", "region_name", 60)
+        assert [len(x["x"]) for x in traces] == [60, 60, 40]
+        assert traces[1]["x"][-1] == dates[-1] and traces[1]["y"][-1] == 600
+
+        shuffled = data.sample(frac=1, random_state=0)
+        traces = line_traces(shuffled, "date", "confirmed", "region_name", 60)
+        assert sorted(x["name"] for x in traces) == ["A", "B", "C"]
+        for trace in traces:
+            assert list(trace["x"]) == sorted(trace["x"])
+            assert np.all(np.diff(trace["y"]) > 0)
+        assert traces[0]["x"][0] == dates[0]
+
+        fig = plot_country_dynamic(data, start=None, large=True, max_points=60)
+        assert [x.type for x in fig.data] == ["scattergl"] * 3
+
+    def test_cases_map(self):
+        square = [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]
+        geojson = {
+            "type": "FeatureCollection",
+            "features": [
+                {
+                    "type": "Feature",
+                    "properties": {"HASC_1": "RU.AD"},
+                    "geometry": {"type": "Polygon", "coordinates": square},
+                }
+            ],
+        }
+        data = pd.DataFrame(
+            {
+                "date": ["2020-04-01", "2020-04-02"],
+                "geoname_code": "RU.AD",
+                "confirmed": [1.0, 2.0],
+            }
+        )
+        fig = plot_cases_map(data, geojson, mtype="mapbox")
+        assert fig.layout.mapbox.center.lat == 61.5
+        fig = plot_cases_map(data, geojson, mtype="mapbox", center=(55.7, 37.6))
+        assert fig.layout.mapbox.center.lon == 37.6
+
+    def test_figure_cache(self, tmp_path):
+        data = pd.DataFrame(
+            {
+                "date": ["2020-04-01", "2020-04-02"] * 2,
+                "region_name": ["A", "A", "B", "B"],
+                "confirmed": [1.0, 2.0, 3.0, 5.0],
+            }
+        )
+        cache = FigureCache(directory=str(tmp_path))
+        plot = cache.wrap(plot_country_dynamic)
+        figure = plot(data, start=None)
+        assert plot(data, start=None) is figure
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        changed = data.copy()
+        changed.loc[3, "confirmed"] = 6.0
+        assert plot(changed, start=None) is not figure
+        assert plot(data, start="2020-04-01") is not figure
+        assert cache.misses == 3
+
+        small_cache = FigureCache(max_bytes=cache.nbytes // 3, directory=str(tmp_path))
+        restored = small_cache.call(plot_country_dynamic, data, start=None)
+        assert small_cache.hits == 1
+        assert restored.to_json() == figure.to_json()
+        small_cache.call(plot_country_dynamic, changed, start=None)
+        assert len(small_cache.figures) == 1
+
+    def test_feature_store(self, config, tmp_path):
+        data = DatasetManager(dict(config, reload=False)).get_data()
+        full = FeatureStore({"root": str(tmp_path / "full")})
+        os.makedirs(full.root)
+        expected = full.update(data)
+
+        rus_data = expected["russia"]
+        by_region = rus_data.groupby("region")
+        assert np.allclose(
+            rus_data["confirmed_new"], by_region["confirmed"].diff(), equal_nan=True
+        )
+        rolling = by_region["confirmed_new"].transform(
+            lambda x: x.rolling(7, min_periods=1).mean()
+        )
+        assert np.allclose(rus_data["confirmed_new_avg7"], rolling, equal_nan=True)
+        doubling = rus_data["confirmed_doubling_days"].dropna()
+        assert len(doubling) > 0 and (doubling > 0).all()
+
+        # models split the materialized columns instead of recomputing them
+        targets = ["confirmed", "confirmed_new_avg7"]
+        code, series = next(
+            model_per_country_simple_split(rus_data, targets, index="region")
+        )
+        region = rus_data[(rus_data["region"] == code) & (rus_data["confirmed"] > 0)]
+        assert np.allclose(
+            series["confirmed_new_avg7"], region["confirmed_new_avg7"], equal_nan=True
+        )
+
+        store = FeatureStore({"root": str(tmp_path)})
+        last_dates = sorted(data["russia"]["by_date"]["date"].unique())[-5:]
+        old_data = {
+            name: dict(
+                frames, by_date=frames["by_date"].query(f'date < "{last_dates[0]}"')
+            )
+            for name, frames in data.items()
+        }
+        store.update(old_data)
+        features = store.update(data)
+        reloaded = FeatureStore({"root": str(tmp_path)}).update(data)
+        for name in ["world", "russia"]:
+            pd.testing.assert_frame_equal(features[name], expected[name])
+            pd.testing.assert_frame_equal(reloaded[name], expected[name])
+
+        # a new process reads the csv files and computes only the new dates
+        FeatureStore({"root": str(tmp_path)}).update(old_data)
+        profiler = StageProfiler()
+        reloaded = FeatureStore({"root": str(tmp_path)}, profiler=profiler)
+        reloaded = reloaded.update(data)
+        report = profiler.report()
+        assert list(report["stage"]) == ["features world tail", "features russia tail"]
+        assert (report["rows_out"] < report["rows_in"]).all()
+        for name in ["world", "russia"]:
+            pd.testing.assert_frame_equal(reloaded[name], expected[name])
+
+        # windows and lags count days, not rows
+        dates = pd.date_range("2020-03-01", periods=20).strftime("%Y-%m-%d")
+        series = pd.DataFrame(
+            {"region": "A", "date": dates, "confirmed": np.arange(20.0) * 10 + 10}
+        )
+        gaps = derive_features(
+            series.drop([5, 6, 7]), "region", ["confirmed"], {"A": 1e5}
+        )
+        full = derive_features(series, "region", ["confirmed"], {"A": 1e5})
+        full = full.drop([5, 6, 7]).reset_index(drop=True)
+        assert np.isnan(gaps.loc[5, "confirmed_new"])
+        assert gaps.loc[6:, "confirmed_new"].eq(10).all()
+        assert np.allclose(gaps["confirmed_new_avg7"][6:], 10)
+        # growth of the days a week after the gap has no week ago value
+        assert gaps.loc[9:11, "confirmed_growth"].isna().all()
+        growth = "confirmed_growth"
+        assert np.allclose(
+            gaps[growth], full[growth].where(gaps[growth].notna()), equal_nan=True
+        )
+
+    def test_us_counties(self, config, tmp_path):
+        archive = str(tmp_path / "archive")
+        transport = Transport("replay", archive)
+        dates = ["3/30/20", "3/31/20", "4/1/20"]
+        counties = pd.DataFrame(
+            {
+                "UID": [84001001, 84001003],
+                "iso2": "US",
+                "iso3": "USA",
+                "code3": 840,
+                "FIPS": [1001.0, 1003.0],
+                "Admin2": ["Autauga", "Baldwin"],
+                "Province_State": "Alabama",
+                "Country_Region": "US",
+                "Lat": 32.5,
+                "Long_": -86.6,
+                "Combined_Key": ["Autauga, Alabama, US", "Baldwin, Alabama, US"],
+            }
+        )
+        confirmed = pd.concat(
+            [counties, pd.DataFrame([[5, 6, 8], [10, 15, 16]], columns=dates)], axis=1
+        )
+        deaths = pd.concat(
+            [counties, pd.DataFrame([[0, 1, 1], [0, 0, 2]], columns=dates)], axis=1
+        )
+        deaths.insert(11, "Population", [55869, 223234])
+        # rows of the two reports are aligned by UID
+        deaths = deaths.iloc[::-1]
+        transport.save(
+            config["csse"]["us_confirmed"], confirmed.to_csv(index=False).encode()
+        )
+        transport.save(config["csse"]["us_deaths"], deaths.to_csv(index=False).encode())
+
+        csse_config = dict(config["csse"], root=str(tmp_path))
+        parser = CSSEParser(
+            dict(
+                config,
+                csse=csse_config,
+                transport={"mode": "replay", "archive": archive},
+            )
+        )
+        report = parser.load_counties()
+        assert list(report.columns) == [
+            "uid",
+            "fips",
+            "county",
+            "state",
+            "population",
+            "date",
+            "cases",
+            "deaths",
+        ]
+        assert list(report["date"][:3]) == ["2020-03-30", "2020-03-31", "2020-04-01"]
+        assert list(report["cases"]) == [5, 6, 8, 10, 15, 16]
+        assert list(report["deaths"]) == [0, 1, 1, 0, 0, 2]
+        assert list(report["population"][2:4]) == [55869, 223234]
+
+    def test_oxford_regions(self, config, tmp_path):
+        archive = str(tmp_path / "archive")
+        dates = ["20200401", "20200402", "20200403"]
+        report = pd.DataFrame(
+            {
+                "CountryName": "Country",
+                "CountryCode": ["AAA"] * 3 + ["BBB"] * 3 + ["BBB"] * 3,
+                "RegionName": [None] * 6 + ["Region"] * 3,
+                "RegionCode": [None] * 6 + ["BBB_R"] * 3,
+                "Date": dates * 3,
+            }
+        )
+        for column in OXFORD_COLUMNS[2:]:
+            report[column] = [1, None, 2, None, 3, None, None, 1, None]
+            report[column.split("_")[0] + "_Flag"] = 1
+        report["C1_Notes"] = "note"
+        Transport("replay", archive).save(
+            config["oxford"]["main_page_url"], report.to_csv(index=False).encode()
+        )
+
+        oxford_config = dict(config["oxford"], root=str(tmp_path))
+        parser = OxfordParser(
+            dict(
+                config,
+                oxford=oxford_config,
+                transport={"mode": "replay", "archive": archive},
+            )
+        )
+        national = parser.load_data()
+        assert list(national["country_code"]) == ["AAA"] * 3 + ["BBB"] * 3
+        assert list(national["date"][:3]) == ["2020-04-01", "2020-04-02", "2020-04-03"]
+        # the first BBB value is not filled from AAA
+        assert list(national["c1_school_closing"].fillna(-1)) == [1, 1, 2, -1, 3, 3]
+        assert national["c1_school_closing"].dtype == np.float32
+        assert len(national.columns) == len(OXFORD_COLUMNS)
+
+        regions = parser.load_regions()
+        assert list(regions["region_code"]) == ["BBB_R"] * 3
+        assert list(regions["h3_contact_tracing"].fillna(-1)) == [-1, 1, 1]
+
+        # both levels come from one download and parse of the report
+        profiler = StageProfiler()
+        parser.downloader.profiler = profiler
+        parser.load_data()
+        pd.testing.assert_frame_equal(parser.load_regions(), regions)
+        stages = list(profiler.report()["stage"])
+        assert stages == ["download oxford_report.csv", "parse oxford_report.csv"]
+
+    def test_data_quality(self, config):
+        confirmed = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100, 5000]
+        confirmed += [5010, 5020, 5020, 5020, 5020, 5100, 5110, 5100, 5120]
+        data = pd.DataFrame(
+            {
+                "region": ["A"] * 21 + ["B"] * 3,
+                "date": [f"2020-04-{day:02d}" for day in range(1, 22)]
+                + ["2020-04-01", "2020-04-02", "2020-04-03"],
+                "confirmed": confirmed + [1, 1, 1],
+            }
+        ).iloc[::-1]
+        repaired, report = DataQuality(min_jump=100).repair(
+            data, "region", ["confirmed"]
+        )
+        assert list(repaired.index) == list(data.index)
+        values = repaired.sort_values(["region", "date"])["confirmed"].values
+        # the backlog is spread over the previous week, the total is kept
+        assert np.allclose(values[4:12], np.linspace(40, 5000, 8))
+        # the stale run is interpolated, the decrease is held
+        assert list(values[12:21]) == [
+            5010,
+            5020,
+            5040,
+            5060,
+            5080,
+            5100,
+            5110,
+            5110,
+            5120,
+        ]
+        assert list(values[-3:]) == [1, 1, 1]
+        assert report.loc[("A", "confirmed")].tolist() == [1, 10, 1, 3, 10]
+        assert report.loc[("B", "confirmed"), "repaired_values"] == 0
+
+        kept, _ = DataQuality(decreases=None, jumps=None, stale=None).repair(
+            data, "region", ["confirmed"]
+        )
+        assert list(kept["confirmed"]) == list(data["confirmed"])
+        with pytest.raises(ValueError):
+            DataQuality(decreases="drop")
+
+        # spikes are capped and not held, corrections are held,
+        # the flat start after a leading spike is not a stale run
+        series = {
+            "A": [-3, 30, 0, 0, 0, 0, 0, 1, 2, 3, 4, 5],
+            "B": [10, 20, 30, 500, 40, 50, 60, 70, 80, 90, 100, 110],
+            "C": [100, 110, 120, 90, 95, 130, 140, 150, 160, 170, 180, 190],
+        }
+        data = pd.DataFrame(
+            {
+                "region": np.repeat(list(series), 12),
+                "date": [f"2020-04-{day:02d}" for day in range(1, 13)] * 3,
+                "confirmed": np.concatenate(list(series.values())),
+            }
+        )
+        repaired, report = DataQuality(min_jump=100).repair(
+            data, "region", ["confirmed"]
+        )
+        values = repaired.groupby("region")["confirmed"].apply(list)
+        assert values["A"] == [0] * 7 + [1, 2, 3, 4, 5]
+        assert values["B"][2:5] == [30, 40, 40]
+        assert values["C"][2:6] == [120, 120, 120, 130]
+        assert report["stale_days"].sum() == 0
+        assert list(report["repaired_values"]) == [2, 1, 2]
+
+        rus_data = DatasetManager(dict(config, reload=False)).get_data()
+        reports = DataQuality().repair_all(rus_data)
+        for name, (group, keys) in [
+            ("world", ("country_code", ["cases", "deaths"])),
+            ("russia", ("region", ["confirmed"])),
+        ]:
+            frame = rus_data[name]["by_date"].sort_values([group, "date"])
+            for key in keys:
+                assert (frame.groupby(group)[key].diff() < 0).sum() == 0
+            # a few percent of the values are repaired, not whole series
+            repaired_share = reports[name]["repaired_values"].sum() / (
+                len(frame) * len(keys)
+            )
+            assert repaired_share < 0.1
+            assert list(reports[name].columns) == [
+                "decreases",
+                "max_decrease",
+                "jumps",
+                "stale_days",
+                "repaired_values",
+            ]
@@ -1,9 +1,32 @@
 from data import DatasetManager
-from models import CompartmentalOptimizer
-from models.selection import model_per_country_simple_split
+from models import CompartmentalOptimizer, JointCompartmentalOptimizer, FitBudget
+from models.selection import model_per_country_simple_split, GroupSplitter
+from models.compartment.reproduction import CovariateReproduction
+from models.compartment.joint import GRADIENT_STEP
+from models.compartment.engines import DailyEngine
+from models.compartment.bootstrap import bootstrap_fit, resample_series
+from models.compartment.sensitivity import sensitivity_report
+from models.compartment.store import FitStore
+from models.compartment import fit_many, FitInstrumentation, summarize_records
+from models.validation import (
+    rolling_origin_backtest,
+    get_validation_results,
+    write_submission,
+)
+from models.validation.validate import read_submissions, score_submissions
+from visualization.export import FigureExporter
+from scipy.optimize import approx_fprime
+import pickle
+import numpy as np
+import pandas as pd
+import plotly.io as pio
 import pytest
 import yaml
 
+# a short series of the first days of an outbreak
+CASES = np.array([1, 1, 2, 2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 5, 7, 7, 8, 9, 10, 13])
+DEATHS = np.array([0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2])
+
 
 @pytest.fixture(scope="class")
 def config():
@@ -86,3 +109,510 @@ class Test_model:
         splits = model_per_country_simple_split(world_data, targets=["cases", "deaths"])
         country_codes_alpha3 = {x for x, y in splits}
         assert codes == country_codes_alpha3
+
+    def test_group_splitter(self):
+        frame = pd.DataFrame(
+            {
+                "code": ["B", "A", "B", "A", "A", "B", "A"],
+                "date": ["03", "02", "01", "01", "03", "02", "04"],
+                "cases": [3, 2, 1, 0, 3, 2, 4],
+            }
+        )
+        splitter = GroupSplitter(frame, ["cases", "date"], index="code")
+        splits = dict(splitter.split())
+        assert list(splits.keys()) == ["B", "A"]
+        assert list(splits["A"]["date"]) == ["02", "03", "04"]
+        assert list(splits["B"]["cases"]) == [1, 2, 3]
+        assert list(splitter.get("B", -2)["cases"]) == [2, 3]
+        assert [x for x, y in splitter.split(min_length=4)] == []
+
+        code, train, test = next(splitter.train_test_split(1, train_days=1))
+        assert (code, list(train["cases"]), list(test["cases"])) == ("B", [2], [3])
+
+    @pytest.mark.parametrize(
+        "budget, status",
+        [
+            (FitBudget(max_evaluations=15), "max_evaluations"),
+            (FitBudget(max_rhs_calls=300), "max_rhs_calls"),
+            (FitBudget(max_seconds=0.05), "max_seconds"),
+        ],
+    )
+    def test_fit_budget(self, optimizer, budget, status):
+        cases, deaths = CASES, DEATHS
+        res = optimizer.fit(cases, deaths, 397628, budget=budget)
+        assert res.budget_status == status
+        assert not res.success
+        assert len(res.trace) > 0
+        assert res.fun == min(res.trace)
+        if budget.max_evaluations is not None:
+            assert len(res.trace) == budget.max_evaluations
+        if budget.max_rhs_calls is not None:
+            assert res.nrhs == budget.max_rhs_calls
+
+    def test_joint_model(self, optimizer):
+        cases, deaths = CASES, DEATHS
+        params = np.array([3, 5, 4, 6, 3, 0.8, 0.2, 0.1, 2, 20])
+        # shared parameters first, then R_0, k and L per region
+        joint_params = np.concatenate([params[1:8], [params[0], 3], [2, 2], [20, 10]])
+        joint = JointCompartmentalOptimizer(optim_days=14)
+
+        predictions = joint.predict(
+            joint_params, [cases, cases[:15]], [deaths, deaths[:15]], [397628, 1e6], 5
+        )
+        single_cases, single_deaths = optimizer.predict(
+            params, cases, deaths, 397628, 5
+        )
+        assert [len(x[0]) for x in predictions] == [25, 20]
+        assert np.allclose(predictions[0][0], single_cases, rtol=0.05)
+        assert np.allclose(predictions[0][1], single_deaths, rtol=0.05, atol=1e-3)
+
+    def test_joint_fit(self):
+        cases, deaths = CASES, DEATHS
+        joint = JointCompartmentalOptimizer(optim_days=14)
+        data = joint._pack([cases, cases[:15]], [deaths, deaths[:15]], [397628, 1e6])
+        initial_guess = joint._initial_guess(2)
+
+        gradient = joint.model.gradient(initial_guess, *data)
+        expected = approx_fprime(initial_guess, joint.model_fn, GRADIENT_STEP, *data)
+        assert np.allclose(gradient, expected, rtol=1e-3, atol=1e-3)
+
+        res = joint.fit(
+            [cases, cases[:15]],
+            [deaths, deaths[:15]],
+            [397628, 1e6],
+            budget=FitBudget(max_evaluations=50),
+        )
+        assert res.fun < joint.model_fn(initial_guess, *data) / 2
+
+        # a covariate R_t shared by the regions with a coefficient per region
+        days = np.arange(60)
+        hill = np.log(1 + (days / 20) ** 2)
+        reproduction = CovariateReproduction(hill, ["hill"])
+        covariate_joint = JointCompartmentalOptimizer(
+            optim_days=14, reproduction=reproduction
+        )
+        assert covariate_joint.regional_keys == ["R_0", "beta_hill"]
+        params = np.concatenate([initial_guess[:7], [3, 3], [1, 1]])
+        hill_params = np.concatenate([initial_guess[:7], [3, 3], [2, 2], [20, 20]])
+        predictions = covariate_joint.predict(
+            params, [cases, cases[:15]], None, [397628, 1e6], 5
+        )
+        hill_predictions = joint.predict(
+            hill_params, [cases, cases[:15]], None, [397628, 1e6], 5
+        )
+        for (pred_cases, _), (hill_cases, _) in zip(predictions, hill_predictions):
+            assert np.allclose(pred_cases, hill_cases, rtol=0.05)
+
+    def test_covariate_reproduction(self, optimizer):
+        cases, deaths = CASES, DEATHS
+        params = np.array([3, 5, 4, 6, 3, 0.8, 0.2, 0.1, 2, 20])
+        # a covariate reproducing the Hill decay with a unit coefficient
+        days = np.arange(60)
+        hill_covariate = np.log(1 + (days / params[-1]) ** params[-2])
+        reproduction = CovariateReproduction(hill_covariate, ["hill"])
+        covariate_optimizer = CompartmentalOptimizer(
+            optim_days=14, reproduction=reproduction
+        )
+        assert list(covariate_optimizer.states)[-1] == "beta_hill"
+
+        r_t = reproduction(params[0], [1.0])
+        assert np.isclose(r_t(10), params[0] / (1 + (10 / params[-1]) ** params[-2]))
+        assert np.isclose(r_t(10.5), (r_t(10) + r_t(11)) / 2)
+        assert r_t(100) == r_t(59)
+
+        covariate_params = np.concatenate([params[:8], [1.0]])
+        pred_cases, _ = covariate_optimizer.predict(
+            covariate_params, cases, deaths, 397628, 10
+        )
+        hill_cases, _ = optimizer.predict(params, cases, deaths, 397628, 10)
+        assert np.allclose(pred_cases, hill_cases, rtol=0.05)
+
+    @pytest.mark.parametrize("substeps", [1, 2, 4])
+    def test_daily_engine(self, optimizer, substeps):
+        cases, deaths = CASES, DEATHS
+        params = np.array([3, 5, 4, 6, 3, 0.8, 0.2, 0.1, 2, 20])
+        daily_optimizer = CompartmentalOptimizer(
+            optim_days=14, engine=DailyEngine(substeps)
+        )
+        pred_cases, pred_dead = daily_optimizer.predict(
+            params, cases, deaths, 397628, 30
+        )
+        exact_cases, exact_dead = optimizer.predict(params, cases, deaths, 397628, 30)
+        assert len(pred_cases) == len(exact_cases)
+        assert np.allclose(pred_cases, exact_cases, rtol=0.05)
+        assert np.allclose(pred_dead, exact_dead, rtol=0.05, atol=1e-3)
+
+        # the derivatives come from the model, RHS budgets see them
+        res = daily_optimizer.fit(
+            cases, deaths, 397628, budget=FitBudget(max_rhs_calls=300)
+        )
+        assert res.budget_status == "max_rhs_calls"
+        assert res.nrhs == 300
+
+    def test_prediction_intervals(self, optimizer):
+        cases, deaths = CASES, DEATHS
+        params = np.array([3, 5, 4, 6, 3, 0.8, 0.2, 0.1, 2, 20])
+        bands = optimizer.predict_intervals(
+            params, cases, deaths, 397628, 30, n_simulations=2000, seed=0
+        )
+        same_bands = optimizer.predict_intervals(
+            params, cases, deaths, 397628, 30, n_simulations=2000, seed=0
+        )
+        pred_cases, _ = optimizer.predict(params, cases, deaths, 397628, 30)
+        assert bands["cases"].shape == (3, 30)
+        assert bands["deaths"].shape == (3, 30)
+        assert np.array_equal(bands["cases"], same_bands["cases"])
+        assert np.all(np.diff(bands["cases"], axis=0) >= 0)
+        assert np.all(np.diff(bands["cases"], axis=1) >= 0)
+        assert np.all(bands["cases"][0] <= pred_cases[-30:] * 1.05)
+        assert np.all(bands["cases"][-1] >= pred_cases[-30:] * 0.95)
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_bootstrap(self, workers):
+        cases, deaths = CASES, DEATHS
+        daily_optimizer = CompartmentalOptimizer(optim_days=14, engine="daily")
+        res = daily_optimizer.fit(cases, deaths, 397628)
+        intervals = bootstrap_fit(
+            daily_optimizer,
+            res.x,
+            cases,
+            deaths,
+            397628,
+            n_samples=6,
+            horizon=7,
+            workers=workers,
+            budget=FitBudget(max_evaluations=200),
+            seed=0,
+        )
+        assert intervals["samples"].shape == (6, len(res.x))
+        assert intervals["parameters"].shape == (3, len(res.x))
+        assert intervals["cases"].shape == (3, 7)
+        assert np.all(np.diff(intervals["parameters"], axis=0) >= 0)
+        assert intervals["parameter_names"][0] == "R_0"
+
+    def test_block_resampling(self):
+        days = np.arange(60)
+        fitted = 100 * np.exp(days / 20)
+        # increment residuals in two week waves, strongly autocorrelated
+        wave = 0.5 * np.sign(np.sin(2 * np.pi * (days[1:] + 0.5) / 28))
+        increments = np.expm1(np.log1p(np.diff(fitted)) + wave)
+        observed = np.concatenate([[fitted[0]], fitted[0] + np.cumsum(increments)])
+
+        spreads = []
+        for block_size in [1, 7]:
+            samples = resample_series(
+                fitted, observed, 2000, np.random.RandomState(0), block_size
+            )
+            assert samples.shape == (2000, 60)
+            assert np.all(samples[:, 0] == observed[0])
+            assert np.all(np.diff(samples, axis=1) >= 0)
+            low, high = np.quantile(samples[:, -1], [0.05, 0.95])
+            assert low < observed[-1] < high
+            spreads.append(high - low)
+        # iid resampling averages the waves out and narrows the intervals
+        assert spreads[1] > 1.5 * spreads[0]
+
+    @pytest.mark.parametrize(
+        "method, key, kwargs",
+        [
+            ("sobol", "cases_ST", {"n_samples": 256}),
+            ("morris", "cases_mu_star", {"trajectories": 50}),
+        ],
+    )
+    def test_sensitivity(self, optimizer, method, key, kwargs):
+        cases = CASES[:-1]
+        splits = [("AAA", {"cases": cases}), ("BBB", {"cases": cases[5:]})]
+        populations = {"AAA": 397628, "BBB": 1e6}
+        report = sensitivity_report(
+            optimizer, splits, populations, method=method, seed=0, **kwargs
+        )
+        assert report.shape[0] == 2 * len(optimizer.states)
+        indices = report.loc["AAA", key]
+        # hospital stages do not change the amount of confirmed cases
+        assert np.isclose(indices["time_in_hospital"], 0, atol=1e-6)
+        assert indices["R_0"] > indices["time_critical"]
+        assert indices.idxmax() in ("R_0", "L")
+
+    def test_fit_store(self, tmp_path):
+        cases, deaths = CASES, DEATHS
+        store = FitStore(str(tmp_path))
+        stored_optimizer = CompartmentalOptimizer(
+            optim_days=14, engine="daily", store=store
+        )
+        res = stored_optimizer.fit(
+            cases, deaths, 397628, budget=FitBudget(max_evaluations=100), key="AAA"
+        )
+        assert (tmp_path / "AAA.npz").exists()
+        assert store.load("AAA")["trajectory"].shape == (7, len(cases))
+        # pool tasks do not carry the loaded records
+        copied = pickle.loads(pickle.dumps(stored_optimizer)).store
+        assert copied.records == {} and "AAA" in store.records
+        assert np.array_equal(copied.load("AAA")["parameters"], res.x)
+
+        pred_cases, pred_dead = stored_optimizer.predict(
+            res.x, cases, deaths, 397628, 30, key="AAA"
+        )
+        exact_cases, exact_dead = stored_optimizer.predict(
+            res.x, cases, deaths, 397628, 30
+        )
+        assert np.allclose(pred_cases, exact_cases)
+        assert np.allclose(pred_dead, exact_dead)
+
+        # a fresh store reads the extended trajectory from disk
+        fingerprint = stored_optimizer._fingerprint(cases, deaths, 397628)
+        reloaded = FitStore(str(tmp_path)).find("AAA", res.x, fingerprint)
+        assert reloaded["trajectory"].shape == (7, len(cases) + 30)
+        assert reloaded["loss"] == res.fun
+        assert FitStore(str(tmp_path)).find("AAA", res.x * 2, "") is None
+
+        # the daily engine trajectory is not reused by an RK45 optimizer
+        rk45_optimizer = CompartmentalOptimizer(optim_days=14, store=store)
+        rk45_fingerprint = rk45_optimizer._fingerprint(cases, deaths, 397628)
+        assert rk45_fingerprint != fingerprint
+        assert store.find("AAA", res.x, rk45_fingerprint) is None
+        rk45_cases, _ = rk45_optimizer.predict(
+            res.x, cases, deaths, 397628, 30, key="AAA"
+        )
+        assert np.allclose(
+            rk45_cases, rk45_optimizer.predict(res.x, cases, deaths, 397628, 30)[0]
+        )
+        assert not np.allclose(rk45_cases, pred_cases, rtol=1e-6)
+        assert rk45_fingerprint != CompartmentalOptimizer(
+            optim_days=21, store=store
+        )._fingerprint(cases, deaths, 397628)
+
+    def test_backtest(self, tmp_path):
+        cases, deaths = CASES, DEATHS
+        splits = [
+            ("AAA", {"cases": cases, "deaths": deaths}),
+            ("BBB", {"cases": cases[:12], "deaths": deaths[:12]}),
+        ]
+        populations = {"AAA": 397628, "BBB": 1e6}
+        daily_optimizer = CompartmentalOptimizer(optim_days=7, engine="daily")
+        budget = FitBudget(max_evaluations=150)
+
+        scores = rolling_origin_backtest(
+            daily_optimizer,
+            splits,
+            populations,
+            horizons=(1, 5),
+            min_train=10,
+            step=4,
+            workers=1,
+            origin_chunks=2,
+            budget=budget,
+        )
+        # AAA origins 10, 14, 18 and BBB origin 10
+        assert list(scores["origin"]) == [10, 10, 14, 14, 18, 10]
+        assert list(scores["horizon"]) == [1, 5, 1, 5, 1, 1]
+        assert np.all(scores["cases_ale"] >= 0)
+        assert scores.loc[0, "cases"] == cases[10]
+
+        # unsorted horizons score every horizon that fits
+        unsorted = rolling_origin_backtest(
+            daily_optimizer,
+            splits[1:],
+            populations,
+            horizons=(5, 1, 2),
+            min_train=10,
+            step=4,
+            workers=1,
+            budget=budget,
+        )
+        assert list(unsorted["horizon"]) == [1, 2]
+
+        daily_optimizer.store = FitStore(str(tmp_path))
+        results = fit_many(
+            daily_optimizer, splits, populations, workers=1, budget=budget
+        )
+        assert sorted(results.keys()) == ["AAA", "BBB"]
+        # results are stored under their codes
+        for code, series in splits:
+            record = daily_optimizer.store.load(code)
+            assert np.array_equal(record["parameters"], results[code].x)
+            assert record["trajectory"].shape == (7, len(series["cases"]))
+
+    def test_validation_results(self, tmp_path):
+        truth = pd.DataFrame(
+            {
+                "region": ["RU-AD", "RU-AD", "RU-ALT", "RU-ALT"],
+                "date": ["2020-04-19", "2020-04-20", "2020-04-19", "2020-04-20"],
+                "confirmed": [9, 99, 0, 9],
+                "geoname_code": ["RU.AD", "RU.AD", "RU.AL", "RU.AL"],
+            }
+        )
+        first = truth.rename(columns={"confirmed": "prediction_confirmed"})
+        second = first.iloc[1:].assign(prediction_confirmed=[999, 9, 99])
+        filename = str(tmp_path / "second.csv")
+        second.to_csv(filename)
+
+        scores = get_validation_results(
+            [first, filename],
+            truth,
+            "2020-04-20",
+            "2020-04-20",
+            None,
+            custom_ids=["first", "second"],
+            workers=1,
+        )
+        assert list(scores.index.get_level_values("region_code")) == [
+            "RU-AD",
+            "RU-ALT",
+        ]
+        assert list(scores["first"]) == [0, 0]
+        assert np.allclose(scores["second"], [1, 1])
+
+        # open date ranges and no submissions
+        loaded = read_submissions([filename], workers=1)[0]
+        assert len(loaded) == len(second)
+        loaded = read_submissions([filename], start="2020-04-20", workers=1)[0]
+        assert list(loaded["date"]) == ["2020-04-20", "2020-04-20"]
+        empty = score_submissions(truth, [])
+        assert empty.empty and list(empty.index.names) == [
+            "region_code",
+            "geoname_code",
+            "date",
+        ]
+        # geoname codes missing from the original data come from the summary
+        mapped = get_validation_results(
+            [first],
+            truth.drop(columns="geoname_code"),
+            "2020-04-20",
+            "2020-04-20",
+            truth.groupby("region")[["geoname_code"]].first(),
+            workers=1,
+        )
+        assert list(mapped.index) == list(scores.index)
+
+    def test_write_submission(self, tmp_path):
+        cases, deaths = CASES, DEATHS
+        dates = pd.date_range("2020-04-01", periods=20).strftime("%Y-%m-%d").values
+        splits = [
+            ("RU-AD", {"cases": cases, "deaths": deaths, "date": dates}),
+            ("RU-ALT", {"cases": cases[:15], "deaths": deaths[:15], "date": dates}),
+        ]
+        populations = {"RU-AD": 397628, "RU-ALT": 1e6}
+        daily_optimizer = CompartmentalOptimizer(optim_days=7, engine="daily")
+        results = fit_many(
+            daily_optimizer,
+            splits,
+            populations,
+            workers=1,
+            budget=FitBudget(max_evaluations=100),
+        )
+
+        filename = str(tmp_path / "submission.csv")
+        n_rows = write_submission(
+            daily_optimizer,
+            results,
+            splits,
+            populations,
+            filename,
+            "2020-04-19",
+            "2020-04-25",
+            countries="RUS",
+            workers=1,
+            chunk_size=1,
+        )
+        submission = pd.read_csv(filename, index_col=0)
+        assert n_rows == len(submission) == 14
+        assert list(submission.index) == list(range(14))
+        assert list(submission["region"].unique()) == ["RU-AD", "RU-ALT"]
+        assert submission["date"].iloc[-1] == "2020-04-25"
+        assert set(submission["country"]) == {"RUS"}
+
+        pred_cases, _ = daily_optimizer.predict(
+            results["RU-AD"].x, cases, deaths, populations["RU-AD"], 6
+        )
+        assert list(submission["prediction_confirmed"][:7]) == list(
+            np.round(pred_cases[18:25])
+        )
+
+        arguments = (daily_optimizer, results, splits, populations)
+        dates_after = pd.date_range("2020-05-01", periods=15).strftime("%Y-%m-%d")
+        dates = ("2020-04-19", "2020-04-25")
+        # one process pool serves all the chunks
+        pooled = str(tmp_path / "pooled.csv")
+        write_submission(
+            *arguments, pooled, *dates, countries="RUS", workers=2, chunk_size=1
+        )
+        pd.testing.assert_frame_equal(pd.read_csv(pooled, index_col=0), submission)
+
+        # a series starting after the end date adds no rows
+        late = dict(splits[1][1], date=dates_after)
+        late_splits = splits + [("RU-BA", late)]
+        late_results = dict(results, **{"RU-BA": results["RU-ALT"]})
+        late_file = str(tmp_path / "late.csv")
+        write_submission(
+            daily_optimizer,
+            late_results,
+            late_splits,
+            dict(populations, **{"RU-BA": 1e6}),
+            late_file,
+            *dates,
+            countries="RUS",
+            workers=1,
+        )
+        pd.testing.assert_frame_equal(pd.read_csv(late_file, index_col=0), submission)
+
+        pytest.importorskip("pyarrow")
+        parquet = str(tmp_path / "submission.parquet")
+        n_rows = write_submission(
+            *arguments, parquet, *dates, countries="RUS", workers=1, chunk_size=1
+        )
+        assert n_rows == 14
+        pd.testing.assert_frame_equal(
+            pd.read_parquet(parquet), submission.reset_index(drop=True)
+        )
+
+    def test_fit_export(self, tmp_path):
+        cases, deaths = CASES, DEATHS
+        dates = pd.date_range("2020-04-01", periods=20).strftime("%Y-%m-%d").values
+        splits = [("AAA", {"cases": cases, "deaths": deaths, "date": dates})]
+        optimizer = CompartmentalOptimizer(optim_days=7, engine="daily")
+        results = fit_many(
+            optimizer,
+            splits,
+            {"AAA": 397628},
+            workers=1,
+            budget=FitBudget(max_evaluations=50),
+        )
+        with FigureExporter(str(tmp_path), "json", workers=1) as exporter:
+            filenames = exporter.export_fits(
+                optimizer, results, splits, {"AAA": 397628}, horizon=10, rt=True
+            )
+        assert [x.split("/")[-1] for x in filenames] == ["AAA.json", "AAA_rt.json"]
+        figure = pio.read_json(filenames[0])
+        assert len(figure.data[0].x) == 30
+        assert figure.data[0].x[0] == "2020-04-01"
+        assert list(figure.data[1].y) == list(cases)
+
+    def test_instrumentation(self, tmp_path):
+        cases, deaths = CASES, DEATHS
+        filename = str(tmp_path / "fits.jsonl")
+        instrumented = CompartmentalOptimizer(
+            optim_days=7,
+            engine="daily",
+            instrumentation=FitInstrumentation(filename),
+        )
+        results = fit_many(
+            instrumented,
+            [("AAA", {"cases": cases, "deaths": deaths})],
+            {"AAA": 397628},
+            workers=1,
+            budget=FitBudget(max_evaluations=50),
+        )
+        profile = results["AAA"].profile
+        assert profile["key"] == "AAA"
+        assert profile["objective_calls"] == profile["solve_calls"] == 50
+        assert profile["rhs_calls"] == 50 * 4 * (len(cases) - 1)
+        assert profile["solve_seconds"] + profile["loss_seconds"] <= (
+            profile["fit_seconds"]
+        )
+
+        totals = summarize_records(filename)
+        assert totals["fits"] == 1
+        assert list(summarize_records(filename, by="key").index) == ["AAA"]
+        assert (
+            totals["objective_calls"] == summarize_records(results)["objective_calls"]
+        )
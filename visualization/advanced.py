@@ -2,55 +2,69 @@ import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import numpy as np
+from .geometry import resolve_geodata
 
 
 class CustomOverviewGraph:
-    def __init__(self, df, geodata):
+    def __init__(self, df, geodata, level="medium"):
         self.regions_df = df
-        self.geodata = geodata
-
-    def get_pop_map(self, data, date="2020-04-20"):
-        local_data = data.query(f'date == "{date}"')
+        self.geodata = resolve_geodata(geodata, level)
+
+    def _hover_text(self, local_data):
+        if "hover_text" in local_data:
+            return local_data["hover_text"].values
+        return local_data["region"].map(self.regions_df["name_with_type"]).values
+
+    def _pop_map(self, local_data, geometry=True):
+        """
+        Map trace of one date. Animation frames skip the geometry,
+        it stays in the figure trace the frames update.
+        """
         return go.Choroplethmapbox(
-            locations=local_data["geoname_code"],
-            geojson=self.geodata,
-            text=[
-                self.regions_df.loc[x, "name_with_type"]
-                for x in local_data["region"].values
-            ],
+            locations=local_data["geoname_code"].values,
+            geojson=self.geodata if geometry else None,
+            text=self._hover_text(local_data),
             hoverinfo="all",
             featureidkey="properties.HASC_1",
-            z=local_data["confirmed_pop"],
+            z=local_data["confirmed_pop"].values,
             colorscale=px.colors.sequential.tempo,
             coloraxis="coloraxis",
             name="Russian map",
         )
 
-    def get_bar_ratings(self, data, key="prediction_confirmed", date="2020-04-20"):
-        bar_data = data.query(f'date == "{date}"').reset_index()
-        bar_data = bar_data.sort_values(by=key)[-15:]
+    def _bar_ratings(self, local_data, key):
+        bar_data = local_data.sort_values(by=key)[-15:]
         return go.Bar(
-            text=[
-                self.regions_df.loc[x, "name_with_type"]
-                for x in bar_data["region"].values
-            ],
+            text=self._hover_text(bar_data),
             y=bar_data[key].apply(np.log10),
             textposition="inside",
             showlegend=False,
             yaxis="y2",
         )
 
+    def get_pop_map(self, data, date="2020-04-20"):
+        return self._pop_map(data[data["date"] == date])
+
+    def get_bar_ratings(self, data, key="prediction_confirmed", date="2020-04-20"):
+        return self._bar_ratings(data[data["date"] == date], key)
+
     def get_dynamic(self, data, key="prediction_confirmed"):
+        if f"{key}_new" in data:
+            # daily values materialized by the FeatureStore
+            new = data.groupby("date")[f"{key}_new"].sum(min_count=1).dropna()
+            return go.Bar(x=new.index, y=new.values, showlegend=False)
         df_diff = data[["date", key]].groupby("date").sum().diff().dropna()
         return go.Bar(x=df_diff.index, y=df_diff[key], showlegend=False)
 
     def animate(self, fig, data, key, dates):
+        by_date = dict(tuple(data.groupby("date", sort=False)))
+        empty = data.iloc[:0]
         frames = [
             go.Frame(
                 data=[
                     go.Bar(visible=True),
-                    self.get_bar_ratings(data, key, date),
-                    self.get_pop_map(data, date),
+                    self._bar_ratings(by_date.get(date, empty), key),
+                    self._pop_map(by_date.get(date, empty), geometry=False),
                 ],
                 traces=[0, 1, 2],
                 name=date,
@@ -142,11 +156,13 @@ class CustomOverviewGraph:
             ],
         )
 
-        data = data.query('date > "2020-03-20"').reset_index().copy()
-        data["pop"] = data["region"].apply(
-            lambda x: self.regions_df.loc[x, "population"]
-        )
-        data["confirmed_pop"] = 100 * data[key] / data["pop"]
+        data = data[data["date"] > "2020-03-20"].reset_index()
+        if f"{key}_per_100k" in data:
+            data["confirmed_pop"] = data[f"{key}_per_100k"] / 1000
+        else:
+            data["pop"] = data["region"].map(self.regions_df["population"])
+            data["confirmed_pop"] = 100 * data[key] / data["pop"]
+        data["hover_text"] = data["region"].map(self.regions_df["name_with_type"])
         fig.add_trace(self.get_dynamic(data, key), 1, 1)
         fig.add_trace(self.get_bar_ratings(data, key, dates[0]), 2, 1)
         fig.add_trace(self.get_pop_map(data, dates[0]), 1, 2)
@@ -1,6 +1,8 @@
 import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
+from .geometry import resolve_geodata
+from .downsampling import downsample, line_traces
 
 
 def plot_map(
@@ -11,10 +13,19 @@ def plot_map(
     geodata=None,
     hover_name=None,
     animation_frame=None,
-    center=(61.5, 105),
+    center=None,
     map_style="carto-positron",
     map_class="choropleth",
+    level="medium",
 ):
+    """
+    Choropleth of the data by the geoname_code column.
+    The geodata is a geojson dictionary or a GeometryCache,
+    the level picks its simplified geometry (see geometry.LEVELS).
+    The map is centered on Russia unless a (lat, lon) center is given.
+    """
+    if center is None:
+        center = (61.5, 105)
     if map_class == "choropleth":
         map_figure = px.choropleth
     elif map_class in ("choropleth_mapbox", "mapbox"):
@@ -23,7 +34,7 @@ def plot_map(
         raise ValueError(f"Wrong map type {map_class}")
     fig = map_figure(
         data,
-        geojson=geodata,
+        geojson=resolve_geodata(geodata, level),
         locations="geoname_code",
         featureidkey="properties.HASC_1",
         color=color_key,
@@ -36,7 +47,9 @@ def plot_map(
     )
 
     fig.update_layout(
-        mapbox_style=map_style, mapbox_zoom=1, mapbox_center=center,
+        mapbox_style=map_style,
+        mapbox_zoom=1,
+        mapbox_center={"lat": center[0], "lon": center[1]},
     )
     fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
 
@@ -49,15 +62,29 @@ def plot_map(
 
 
 def plot_country_dynamic(
-    data, start="2020-03-06", key="confirmed", group="region_name", clip=0
+    data,
+    start="2020-03-06",
+    key="confirmed",
+    group="region_name",
+    clip=0,
+    large=False,
+    max_points=500,
 ):
+    """
+    Line per group of the data.
+    The large mode draws WebGL traces with every series
+    downsampled to at most max_points points.
+    """
     if start:
         data = data.query(f'date > "{start}"')
     if clip > 0:
         date = data["date"].max()
         selected = data[data["date"] == date].sort_values(by="cases")[-clip:][group]
         data = data.set_index(group).loc[selected].reset_index()
-    fig = px.line(data, x="date", y=key, color=group)
+    if large:
+        fig = go.Figure(line_traces(data, "date", key, group, max_points))
+    else:
+        fig = px.line(data, x="date", y=key, color=group)
     fig.update_layout(yaxis_type="log")
     fig.update_layout(dict(title="Country dynamics for confirmed cases"))
     return fig
@@ -72,6 +99,7 @@ def plot_cases_map(
     mtype="choropleth",
     center=None,
     date=None,
+    level="medium",
 ):
     data["geoname_code"] = data[group]
     if date is None:
@@ -92,17 +120,33 @@ def plot_cases_map(
         geodata=geojson,
         map_class=mtype,
         center=center,
+        level=level,
     )
 
 
-def plot_region_dynamic(data, region_code, key="confirmed", group="region_name"):
+def plot_region_dynamic(
+    data, region_code, key="confirmed", group="region_name", large=False, max_points=500
+):
     bar_data = data.reset_index().set_index(group).loc[region_code].query(f"{key} > 5")
-    fig = go.Figure(
-        [
+    if f"{key}_new" in bar_data:
+        # daily values materialized by the FeatureStore
+        by_day = bar_data[f"{key}_new"]
+    else:
+        by_day = bar_data[key].diff()
+    if large:
+        # bars have no WebGL version, the cumulative values become a filled line
+        dates, values = downsample(bar_data["date"], bar_data[key], max_points)
+        diff_dates, diff = downsample(bar_data["date"], by_day, max_points)
+        traces = [
+            go.Scattergl(x=dates, y=values, fill="tozeroy", name="cumulative"),
+            go.Scattergl(x=diff_dates, y=diff, name="by day"),
+        ]
+    else:
+        traces = [
             go.Bar(x=bar_data["date"], y=bar_data[key], name="cumulative"),
-            go.Scatter(x=bar_data["date"], y=bar_data[key].diff(), name="by day"),
+            go.Scatter(x=bar_data["date"], y=by_day, name="by day"),
         ]
-    )
+    fig = go.Figure(traces)
     title = f"Confirmed cases dynamic for {region_code}"
     fig.update_layout(title=title)
     return fig
@@ -142,6 +186,7 @@ def plot_map_difference(
     by_source=False,
     mtype="choropleth",
     center=None,
+    level="medium",
 ):
     agg = scores.reset_index().groupby(group).mean()
     if by_source:
@@ -168,6 +213,7 @@ def plot_map_difference(
         geodata=geojson,
         map_class=mtype,
         center=center,
+        level=level,
     )
 
     if not by_source:
@@ -0,0 +1,134 @@
+from collections import OrderedDict
+from functools import wraps
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+from .geometry import GeometryCache, GEOMETRY_VERSION
+
+
+def _update(digest, value):
+    if isinstance(value, pd.DataFrame):
+        digest.update(repr(list(value.dtypes.astype(str).items())).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+    elif isinstance(value, pd.Series):
+        digest.update(repr((value.name, str(value.dtype))).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(repr((value.dtype.str, value.shape)).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, GeometryCache):
+        # the cached levels follow the original file
+        digest.update(
+            repr(
+                (value.filename, os.path.getmtime(value.filename), GEOMETRY_VERSION)
+            ).encode()
+        )
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"{type(value).__name__}{len(value)}".encode())
+        for item in value:
+            _update(digest, item)
+    elif isinstance(value, dict):
+        # geojson and other plain structures
+        digest.update(json.dumps(value, sort_keys=True, default=str).encode())
+    else:
+        digest.update(repr(value).encode())
+
+
+def fingerprint(*values):
+    """
+    Content hash of dataframes, arrays, geometry and plain arguments.
+    """
+    digest = hashlib.sha1()
+    for value in values:
+        _update(digest, value)
+    return digest.hexdigest()
+
+
+class FigureCache:
+    """
+    Cache of plotly figures keyed on the plot function name and
+    the fingerprint of its arguments (data contents included).
+        max_bytes = memory limit of the least recently used figures,
+            sized by their JSON
+        directory = optional folder with the figure JSON files,
+            figures evicted from the memory are read back from it
+    Figures are shared between the calls, copy them before changes.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.figures = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _filename(self, key):
+        return f"{self.directory}/{key}.json"
+
+    def _remember(self, key, figure, size):
+        self.figures[key] = (figure, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes and len(self.figures) > 1:
+            _, (_, evicted_size) = self.figures.popitem(last=False)
+            self.nbytes -= evicted_size
+
+    def key(self, function, args, kwargs):
+        name = f"{function.__module__}.{function.__qualname__}"
+        return fingerprint(name, args, sorted(kwargs.items()))
+
+    def get(self, key):
+        """
+        Returns the cached figure or None.
+        """
+        if key in self.figures:
+            self.figures.move_to_end(key)
+            return self.figures[key][0]
+        if self.directory is None or not os.path.exists(self._filename(key)):
+            return None
+        with open(self._filename(key), encoding="utf-8") as f:
+            serialized = f.read()
+        figure = pio.from_json(serialized)
+        self._remember(key, figure, len(serialized))
+        return figure
+
+    def put(self, key, figure):
+        serialized = figure.to_json()
+        if self.directory is not None:
+            with open(self._filename(key), "w", encoding="utf-8") as f:
+                f.write(serialized)
+        self._remember(key, figure, len(serialized))
+
+    def call(self, function, *args, **kwargs):
+        """
+        Returns the cached figure of the call or builds and caches it.
+        """
+        key = self.key(function, args, kwargs)
+        figure = self.get(key)
+        if figure is not None:
+            self.hits += 1
+            return figure
+        self.misses += 1
+        figure = function(*args, **kwargs)
+        self.put(key, figure)
+        return figure
+
+    def wrap(self, function):
+        """
+        Cached version of a plot function.
+        """
+
+        @wraps(function)
+        def cached(*args, **kwargs):
+            return self.call(function, *args, **kwargs)
+
+        return cached
+
+    def clear(self):
+        self.figures.clear()
+        self.nbytes = 0
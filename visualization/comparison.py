@@ -1,10 +1,18 @@
 import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
+from .geometry import resolve_geodata
+from .downsampling import downsample
 
 
 def plot_errors(
-    scores, summary, source_id=None, graph_type="map", geodata=None, height=450
+    scores,
+    summary,
+    source_id=None,
+    graph_type="map",
+    geodata=None,
+    height=450,
+    level="medium",
 ):
     region_errors = scores.reset_index().groupby(["region_code", "geoname_code"]).sum()
     if source_id is None:
@@ -18,7 +26,7 @@ def plot_errors(
     if graph_type == "map":
         fig = px.choropleth_mapbox(
             region_errors,
-            geojson=geodata,
+            geojson=resolve_geodata(geodata, level),
             locations="geoname_code",
             featureidkey="properties.HASC_1",
             color="error",
@@ -53,18 +61,31 @@ def plot_predictions(
     value="RU-MOW",
     key="confirmed",
     height=None,
+    large=False,
+    max_points=500,
 ):
+    """
+    The large mode draws WebGL traces downsampled
+    to at most max_points points each.
+    """
     local_data = data_source.reset_index()
     local_data = local_data.query(f'date > "{local_data["date"].values[-12]}"')
     local_data = local_data.set_index(group).loc[value]
     dates = local_data["date"]
     title = f"Predictions for {group} {value} ({key})"
+    scatter = go.Scattergl if large else go.Scatter
+
+    def points(x, y):
+        if large:
+            return downsample(x, y, max_points)
+        return x, y
 
     fig = go.Figure()
+    source_x, source_y = points(dates, local_data[key])
     fig.add_trace(
-        go.Scatter(
-            x=dates,
-            y=local_data[key],
+        scatter(
+            x=source_x,
+            y=source_y,
             mode="lines+markers",
             name="Source data",
             marker=dict(size=10,),
@@ -75,13 +96,9 @@ def plot_predictions(
         local_pred = local_pred.query(
             f'date >= "{min(dates)}" & date <= "{max(dates)}"'
         )
+        pred_x, pred_y = points(local_pred["date"], local_pred["prediction_" + key])
         fig.add_trace(
-            go.Scatter(
-                x=local_pred["date"],
-                y=local_pred["prediction_" + key],
-                mode="lines+markers",
-                name=names[pred_idx],
-            )
+            scatter(x=pred_x, y=pred_y, mode="lines+markers", name=names[pred_idx])
         )
     fig.update_layout(title=title)
     if height is not None:
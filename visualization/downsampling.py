@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+
+def _numeric(values):
+    values = np.asarray(values)
+    if values.dtype.kind in "biuf":
+        return values.astype(float)
+    # dates as strings or datetimes
+    return pd.to_datetime(values).values.astype(np.int64).astype(float)
+
+
+def lttb_many(x, y, max_points):
+    """
+    Largest triangle three buckets downsampling of several series
+    of the same length at once.
+        x, y = (series, points) numeric arrays
+    Returns a (series, max_points) array of sorted point indices
+    keeping the visual shape of every line, the first and the last
+    points are always kept.
+    """
+    y = np.nan_to_num(y)
+    n_series, n = y.shape
+    if max_points >= n or max_points < 3:
+        return np.tile(np.arange(n), (n_series, 1))
+    rows = np.arange(n_series)
+    # bucket boundaries of the inner points
+    edges = np.append(np.linspace(1, n - 1, max_points - 1).astype(int), n)
+    selected = np.empty((n_series, max_points), dtype=int)
+    selected[:, 0], selected[:, -1] = 0, n - 1
+    last = np.zeros(n_series, dtype=int)
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+        mean_x = x[:, next_start:next_end].mean(1)[:, None]
+        mean_y = y[:, next_start:next_end].mean(1)[:, None]
+        last_x, last_y = x[rows, last][:, None], y[rows, last][:, None]
+        areas = np.abs(
+            (last_x - mean_x) * (y[:, start:end] - last_y)
+            - (last_x - x[:, start:end]) * (mean_y - last_y)
+        )
+        last = start + np.argmax(areas, 1)
+        selected[:, bucket + 1] = last
+    return selected
+
+
+def lttb(x, y, max_points):
+    """
+    Indices of at most max_points points of one (x, y) line, see lttb_many.
+    """
+    x = _numeric(x)[None]
+    y = np.asarray(y, dtype=float)[None]
+    return lttb_many(x, y, max_points)[0]
+
+
+def downsample(x, y, max_points):
+    """
+    (x, y) values reduced to at most max_points with lttb.
+    """
+    index = lttb(x, y, max_points)
+    return np.asarray(x)[index], np.asarray(y)[index]
+
+
+def line_traces(data, x, y, group, max_points=500, mode="lines"):
+    """
+    WebGL line traces (as dictionaries) of every group of the data,
+    each series downsampled to at most max_points points.
+    Series of the same length are downsampled together.
+    Rows of a group do not have to be sorted by x.
+    """
+    values_x = data[x].values
+    numeric_x = _numeric(values_x)
+    values_y = data[y].values.astype(float)
+    # lttb needs the points of every line in x order
+    groups = {
+        name: positions[np.argsort(numeric_x[positions], kind="stable")]
+        for name, positions in data.groupby(group, sort=False).indices.items()
+    }
+
+    by_length = {}
+    for name, positions in groups.items():
+        by_length.setdefault(len(positions), []).append(name)
+    kept = {}
+    for names in by_length.values():
+        positions = np.stack([groups[name] for name in names])
+        index = lttb_many(numeric_x[positions], values_y[positions], max_points)
+        rows = np.arange(len(names))[:, None]
+        for name, points in zip(names, positions[rows, index]):
+            kept[name] = points
+
+    return [
+        dict(
+            type="scattergl",
+            x=values_x[kept[name]],
+            y=values_y[kept[name]],
+            mode=mode,
+            name=name,
+        )
+        for name in groups
+    ]
@@ -0,0 +1,172 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import pandas as pd
+import plotly.io as pio
+from .seir import graph_SEIR, graph_Rt
+
+
+def _write_figure(figure, filename, image_format, scale):
+    if image_format == "json":
+        pio.write_json(figure, filename, validate=False)
+    elif image_format == "html":
+        pio.write_html(figure, filename, include_plotlyjs="cdn", validate=False)
+    else:
+        pio.write_image(
+            figure, filename, format=image_format, scale=scale, validate=False
+        )
+
+
+def _render_chunk(task):
+    """
+    Renders figures of one chunk. The renderer server a worker process
+    starts on its first figure stays alive for the following chunks.
+    """
+    directory, image_format, scale, items = task
+    filenames = []
+    for name, figure in items:
+        filename = os.path.join(directory, f"{name}.{image_format}")
+        _write_figure(figure, filename, image_format, scale)
+        filenames.append(filename)
+    return filenames
+
+
+def _chunks(items, size):
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+class FigureExporter:
+    """
+    Writes figures to a directory through a pool of renderer processes
+    kept alive between export calls, so the renderer startup is paid
+    once per worker instead of once per figure.
+        directory = target folder (created when missing)
+        image_format = png, jpeg, svg, pdf (image renderer) or json, html
+        workers = number of processes (all CPUs by default, 1 renders in place)
+        chunk_size = figures sent to a worker at once
+    Use as a context manager or call close() to stop the workers.
+    """
+
+    def __init__(
+        self, directory, image_format="png", workers=None, chunk_size=10, scale=1
+    ):
+        self.directory = directory
+        self.image_format = image_format
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.scale = scale
+        self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def export(self, figures):
+        """
+        Writes figures named by keys of a dictionary or (name, figure) pairs
+        to "name.format" files, returns the filenames in the same order.
+        """
+        if isinstance(figures, dict):
+            figures = figures.items()
+        # plain dictionaries are cheaper to send to the workers than figures
+        items = [
+            (name, figure if isinstance(figure, dict) else figure.to_dict())
+            for name, figure in figures
+        ]
+        os.makedirs(self.directory, exist_ok=True)
+        tasks = [
+            (self.directory, self.image_format, self.scale, chunk)
+            for chunk in _chunks(items, self.chunk_size)
+        ]
+        if self.workers == 1:
+            chunks = [_render_chunk(task) for task in tasks]
+        else:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.workers)
+            chunks = list(self.executor.map(_render_chunk, tasks))
+        return [filename for chunk in chunks for filename in chunk]
+
+    def export_results(self, results, start_dates, data_key="cases", rt=False):
+        """
+        Writes graph_SEIR figures of fit results by code
+        ("code" files, "code_rt" files with graph_Rt figures if rt is set).
+            results = graph_SEIR dictionaries by code
+                (see fit_figure_data for CompartmentalOptimizer results)
+            start_dates = mapping from codes to "%Y-%m-%d" dates
+                of the first observation
+        """
+        return self.export(seir_figures(results, start_dates, data_key, rt))
+
+    def export_fits(
+        self,
+        optimizer,
+        results,
+        splits,
+        populations,
+        horizon=30,
+        data_key="cases",
+        rt=False,
+    ):
+        """
+        Writes graph_SEIR figures of CompartmentalOptimizer fit results
+        by code as returned by fit_many (see fit_figure_data).
+        """
+        figure_data, start_dates = fit_figure_data(
+            optimizer, results, splits, populations, horizon
+        )
+        return self.export_results(figure_data, start_dates, data_key, rt)
+
+
+def fit_figure_data(optimizer, results, splits, populations, horizon=30):
+    """
+    graph_SEIR and graph_Rt inputs for CompartmentalOptimizer fit results
+    by code (fit_many output): the parameters, the data and the predictions
+    over the data days and the horizon.
+        splits = (code, {"cases": array, "deaths": array, "date": array}) pairs
+            as produced by model_per_country_simple_split
+        populations = mapping from codes to populations
+    Returns the dictionaries by code and the first dates by code.
+    """
+    figure_data, start_dates = {}, {}
+    for code, series in splits:
+        if code not in results:
+            continue
+        cases, deaths = series["cases"], series["deaths"]
+        params = results[code].x
+        pred_cases, pred_deaths = optimizer.predict(
+            params, cases, deaths, populations[code], horizon, key=code
+        )
+        figure_data[code] = {
+            "parameters": params,
+            "predicted_cases": pred_cases,
+            "predicted_deaths": pred_deaths,
+            "original_cases": list(cases),
+            "original_deaths": list(deaths),
+        }
+        start_dates[code] = pd.Timestamp(series["date"][0]).strftime("%Y-%m-%d")
+    return figure_data, start_dates
+
+
+def seir_figures(results, start_dates, data_key="cases", rt=False):
+    """
+    Yields (name, figure) pairs of graph_SEIR
+    (and graph_Rt if rt is set) figures for the fit results by code.
+    """
+    for code, result in results.items():
+        yield code, graph_SEIR(code, result, start_dates[code], data_key)
+        if rt:
+            yield f"{code}_rt", graph_Rt(code, result, start_dates[code])
+
+
+def export_figures(figures, directory, image_format="png", workers=None, **kwargs):
+    """
+    Writes all figures with a FigureExporter pool closed afterwards.
+    """
+    with FigureExporter(directory, image_format, workers, **kwargs) as exporter:
+        return exporter.export(figures)
@@ -0,0 +1,251 @@
+import json
+import os
+import numpy as np
+
+# simplification tolerance (degrees) and kept decimal places of coordinates,
+# a whole country map needs no more than the "medium" level
+LEVELS = {
+    "full": (None, None),
+    "high": (0.02, 3),
+    "medium": (0.05, 2),
+    "low": (0.1, 2),
+}
+# cached files of other versions of the simplification are not reused
+GEOMETRY_VERSION = 2
+
+
+def simplify_line(points, tolerance):
+    """
+    Douglas-Peucker simplification of a (n, 2) array of points,
+    the first and the last points are always kept.
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end <= start + 1:
+            continue
+        inner = points[start + 1 : end]
+        first, direction = points[start], points[end] - points[start]
+        length = np.hypot(*direction)
+        if length == 0:
+            distances = np.hypot(*(inner - first).transpose())
+        else:
+            offsets = inner - first
+            distances = (
+                np.abs(direction[0] * offsets[:, 1] - direction[1] * offsets[:, 0])
+                / length
+            )
+        farthest = np.argmax(distances)
+        if distances[farthest] > tolerance:
+            farthest += start + 1
+            keep[farthest] = True
+            stack.extend([(start, farthest), (farthest, end)])
+    return points[keep]
+
+
+def _rings(geodata):
+    """
+    Polygon lists of every feature (a polygon is a list of rings).
+    """
+    for feature in geodata["features"]:
+        geometry = feature["geometry"]
+        if geometry["type"] == "Polygon":
+            yield [geometry["coordinates"]]
+        elif geometry["type"] == "MultiPolygon":
+            yield geometry["coordinates"]
+        else:
+            raise ValueError(f"Wrong geometry type {geometry['type']}")
+
+
+def _junctions(rings):
+    """
+    Points where the set of rings passing through them changes:
+    the ends of borders shared by neighbouring regions.
+    """
+    owners = {}
+    for index, ring in enumerate(rings):
+        for point in ring:
+            owners.setdefault(point, set()).add(index)
+    junctions = set()
+    for ring in rings:
+        points = ring[:-1]
+        for index, point in enumerate(points):
+            neighbours = points[index - 1], points[(index + 1) % len(points)]
+            if any(owners[x] != owners[point] for x in neighbours):
+                junctions.add(point)
+    return junctions
+
+
+def _ring_arcs(ring, junctions):
+    """
+    Splits a closed ring at the junctions. A ring without junctions
+    is one closed arc starting from its smallest point, so rings
+    with the same points (enclaves and their holes) give the same arc.
+    """
+    points = ring[:-1]
+    cuts = [index for index, point in enumerate(points) if point in junctions]
+    if len(cuts) == 0:
+        cuts = [points.index(min(points))]
+    points = points[cuts[0] :] + points[: cuts[0]]
+    cuts = [index - cuts[0] for index in cuts] + [len(points)]
+    points.append(points[0])
+    return [points[start : end + 1] for start, end in zip(cuts[:-1], cuts[1:])]
+
+
+def _simplify_arc(arc, tolerance, arcs):
+    """
+    Every arc is simplified once, in whatever direction it is met first,
+    so a border shared by two regions keeps the same points in both.
+    """
+    key = tuple(arc)
+    if key in arcs:
+        return arcs[key]
+    reverse = key[::-1]
+    if reverse in arcs:
+        return arcs[reverse][::-1]
+    simplified = simplify_line(np.array(arc, dtype=float), tolerance).tolist()
+    arcs[key] = simplified
+    return simplified
+
+
+def _simplify_ring(ring, tolerance, decimals, junctions, arcs):
+    points = []
+    for arc in _ring_arcs(ring, junctions):
+        simplified = _simplify_arc(arc, tolerance, arcs)
+        points.extend(simplified if len(points) == 0 else simplified[1:])
+    points = np.round(np.array(points), decimals)
+    # quantization can merge neighbouring points
+    changed = np.any(points[1:] != points[:-1], axis=1)
+    points = points[np.concatenate([[True], changed])]
+    if len(points) < 4:
+        return None
+    return points.tolist()
+
+
+def _simplify_polygon(polygon, tolerance, decimals, junctions, arcs):
+    """
+    Simplified polygon rings or None if the exterior ring collapsed,
+    collapsed holes are dropped.
+    """
+    exterior = _simplify_ring(polygon[0], tolerance, decimals, junctions, arcs)
+    if exterior is None:
+        return None
+    holes = [
+        _simplify_ring(ring, tolerance, decimals, junctions, arcs)
+        for ring in polygon[1:]
+    ]
+    return [exterior] + [ring for ring in holes if ring is not None]
+
+
+def simplify_geojson(geodata, tolerance, decimals):
+    """
+    Returns a copy of a polygon feature collection with simplified rings
+    and coordinates rounded to the decimals. Rings are split into arcs
+    at the ends of shared borders and every arc is simplified once,
+    so neighbouring regions stay gapless where their borders have
+    the same points. Parts of multipolygons smaller than the tolerance
+    are dropped, polygons that would vanish completely keep their original rings.
+    """
+    features = [
+        [[[tuple(x) for x in ring] for ring in polygon] for polygon in polygons]
+        for polygons in _rings(geodata)
+    ]
+    junctions = _junctions(
+        [ring for polygons in features for polygon in polygons for ring in polygon]
+    )
+    arcs = {}
+    simplified_features = []
+    for feature, polygons in zip(geodata["features"], features):
+        geometry = feature["geometry"]
+        simplified = [
+            _simplify_polygon(x, tolerance, decimals, junctions, arcs) for x in polygons
+        ]
+        simplified = [x for x in simplified if x is not None]
+        if len(simplified) == 0:
+            simplified = geometry["coordinates"]
+            if geometry["type"] == "Polygon":
+                simplified = [simplified]
+        if geometry["type"] == "Polygon":
+            coordinates = simplified[0]
+        else:
+            coordinates = simplified
+        simplified_features.append(
+            dict(
+                feature, geometry={"type": geometry["type"], "coordinates": coordinates}
+            )
+        )
+    return dict(geodata, features=simplified_features)
+
+
+class GeometryCache:
+    """
+    Simplified and quantized versions of a geojson file by detail level
+    (see LEVELS), built once and cached on disk next to the original
+    (a "geometry_cache" folder by default). Cached files are rebuilt
+    when the original file is newer.
+    """
+
+    def __init__(self, filename, cache_dir=None):
+        self.filename = filename
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(filename), "geometry_cache")
+        self.cache_dir = cache_dir
+        self.geodata = {}
+
+    def _cache_filename(self, level):
+        name = os.path.splitext(os.path.basename(self.filename))[0]
+        return os.path.join(self.cache_dir, f"{name}_{level}_v{GEOMETRY_VERSION}.json")
+
+    def _load(self, filename):
+        with open(filename, encoding="utf-8") as f:
+            return json.load(f)
+
+    def get(self, level="medium"):
+        """
+        Returns the geojson dictionary of the level.
+        """
+        if level not in LEVELS:
+            raise ValueError(f"Wrong geometry level {level}")
+        if level in self.geodata:
+            return self.geodata[level]
+        tolerance, decimals = LEVELS[level]
+        if tolerance is None:
+            self.geodata[level] = self._load(self.filename)
+            return self.geodata[level]
+
+        cache_filename = self._cache_filename(level)
+        if os.path.exists(cache_filename) and os.path.getmtime(
+            cache_filename
+        ) >= os.path.getmtime(self.filename):
+            self.geodata[level] = self._load(cache_filename)
+            return self.geodata[level]
+
+        geodata = simplify_geojson(self.get("full"), tolerance, decimals)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(cache_filename, "w", encoding="utf-8") as f:
+            json.dump(geodata, f, ensure_ascii=False, separators=(",", ":"))
+        self.geodata[level] = geodata
+        return geodata
+
+    def build(self):
+        """
+        Builds the cached files of all levels, returns their sizes in bytes.
+        """
+        sizes = {}
+        for level in LEVELS:
+            self.get(level)
+            filename = self.filename if level == "full" else self._cache_filename(level)
+            sizes[level] = os.path.getsize(filename)
+        return sizes
+
+
+def resolve_geodata(geodata, level="medium"):
+    """
+    Geojson dictionary to plot: a GeometryCache gives the geometry
+    of the level, dictionaries are used as they are.
+    """
+    if isinstance(geodata, GeometryCache):
+        return geodata.get(level)
+    return geodata
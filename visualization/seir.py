@@ -1,5 +1,4 @@
 import plotly.graph_objects as go
-from IPython.display import Image
 from datetime import datetime, timedelta
 
 
@@ -40,6 +39,8 @@ def graph_SEIR(code, opt_result, start_date, data_key="cases", static=False):
         margin=dict(l=50, r=50, b=50, t=50, pad=4),
     )
     if static:
+        from IPython.display import Image
+
         img_bytes = img_bytes = fig.to_image(format="png")
         return Image(img_bytes)
     return fig
@@ -76,6 +77,8 @@ def graph_Rt(code, opt_result, start_date, period=60, static=False):
     )
 
     if static:
+        from IPython.display import Image
+
         img_bytes = img_bytes = fig.to_image(format="png")
         return Image(img_bytes)
     return fig